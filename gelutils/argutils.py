@@ -27,6 +27,17 @@ Common module for parsing and handling arguments.
 import argparse
 
 
+class XmarginAction(argparse.Action):
+    """Store --xmargin values, which must be either 'auto' or two values (left, right)."""
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        is_auto = len(values) == 1 and values[0].strip().lower() == 'auto'
+        if not is_auto and (len(values) != 2 or 'auto' in (value.strip().lower() for value in values)):
+            parser.error("argument %s: expected 'auto' or two values (left right), got: %s"
+                         % (option_string, " ".join(values)))
+        setattr(namespace, self.dest, values)
+
+
 def make_parser(prog='gelannotator', defaults=None,
                 description='Gelutils - Convert and Annotate scientific .GEL/TIFF files.',
                 **argparser_kwargs):
@@ -76,6 +87,25 @@ def make_parser(prog='gelannotator', defaults=None,
                         'Specifying gelfile with this keyword will save it it the .gaml config file. '
                         'Useful for having multiple .gaml config files all using the same .GEL file, '
                         'e.g. with different crop regions if the GEL file contains multiple gels.')
+    elif prog == 'batch':
+        # Batch annotation of many gels, see batchannotator:
+        ap.add_argument('inputs', nargs='+', help="Gel files, yaml files, directories or glob patterns.")
+        ap.add_argument('--workers', '-j', type=int, help="Number of worker processes (default: number of CPUs).")
+        ap.add_argument('--report', metavar="filename",
+                        help="Write CSV report with the status and time used for each gel.")
+    elif prog == 'gel2png':
+        # Conversion of many gels with a read - compute - encode pipeline, see pipeline:
+        ap.add_argument('inputs', nargs='+',
+                        help="Gel files or glob patterns. Use '-' to convert a single gel from stdin and/or to stdout, "
+                             "e.g. 'gel2png - -' or 'gel2png gel1.gel -'.")
+        ap.add_argument('--workers', '-j', type=int,
+                        help="Number of compute worker processes (default: number of CPUs).")
+        ap.add_argument('--prefetch', type=int, default=8,
+                        help="Max number of gels in flight (read ahead of the gels being written). Default: 8.")
+        ap.add_argument('--readers', type=int, default=2, help="Number of reader threads. Default: 2.")
+        ap.add_argument('--encoders', type=int, default=2, help="Number of png encoder/writer threads. Default: 2.")
+        ap.add_argument('--serial', action='store_true',
+                        help="Convert the gels one at a time, without the pipeline (e.g. for comparison).")
     else:
         ap.add_argument('gelfile')
 
@@ -206,6 +236,11 @@ def make_parser(prog='gelannotator', defaults=None,
                     from the top, left pixel. If you want to change this behaviour such that the
                     RIGHT and LOWER values are interpreted as the amount to crop away, e.g.
                     'crop 12%% from the right edge', set ```cropfromedges``` to true. """)
+    ap.add_argument('--autocrop', action='store_const', const='auto', dest='crop',
+                    help="Crop the gel automatically from the empty scanner bed around it (same as crop: auto).")
+    ap.add_argument('--autocrop-margin', dest='autocrop_margin', metavar="margin",
+                    help="Margin added around the gel when using auto-crop, "
+                         "in pixels or as fraction/percentage of the image size. Default: 2%%.")
     ap.add_argument('--cropfromedges', action='store_true', default=None,
                     help="""If true, the crop values RIGHT and LOWER defined above
                     specifies pixels from their respective edges
@@ -217,6 +252,13 @@ def make_parser(prog='gelannotator', defaults=None,
                     Can be a single value for uniform scaling, or two values for different scaling in x vs y.
                     Can be given as float (0.1, 2.5) or percentage (10%%, 250%%).""")
 
+    ap.add_argument('--preview-scale', dest='preview_scale', type=int, metavar="factor",
+                    help="Load a decimated preview of the gel, this many times smaller (e.g. 2, 4 or 8). "
+                         "Much faster for a quick look at large scans. Crop values are still full-resolution.")
+    ap.add_argument('--preview-mode', dest='preview_mode', choices=('bin', 'stride'),
+                    help="How to make the preview: 'bin' averages all pixels (default), "
+                         "'stride' only reads every N'th row, which is faster but may skip thin bands.")
+
     ap.add_argument('--rotate', metavar="angle", type=float,
                     help="Rotate gel image by this angle (counter-clockwise). Default: 0.")
     ap.add_argument('--rotateexpands', action='store_true', default=None,
@@ -258,7 +300,7 @@ def make_parser(prog='gelannotator', defaults=None,
     #
     # Annotations config parameters:
     # ------------------------------
-    if prog.lower() in ('gelannotator', 'gui'):
+    if prog.lower() in ('gelannotator', 'gui', 'batch'):
 
         # Image and text positioning:
         # TODO: Maybe prefix with image_ or img_pos_ or canvas_img_ or svg_img_ or svg_gel_ ?
@@ -269,8 +311,11 @@ def make_parser(prog='gelannotator', defaults=None,
                         help="Y offset (how far down the gel image should be).")
         ap.add_argument('--ypadding', metavar="int-or-fraction",  # , default=100
                         help="Vertical space between gel image and annotations.")
-        ap.add_argument('--xmargin', nargs=2, metavar=("left", "right"),  # , default=(30, 40)
-                        help="Margin to the right and left of lane annotations to the outer edge of GEL image.")
+        ap.add_argument('--xmargin', nargs='+', metavar=("left", "right"), action=XmarginAction,  # default=(30, 40)
+                        help="Margin to the right and left of lane annotations to the outer edge of GEL image. "
+                             "Use 'auto' to detect the lane positions automatically.")
+        ap.add_argument('--lane-xpositions', nargs='+', type=float, dest='lane_xpositions', metavar="x",
+                        help="Specify the x-position of each lane annotation (overrides xmargin and xspacing).")
         ap.add_argument('--xspacing', metavar="int-or-fraction",
                         help="Force a certain x spacing between lanes.")
         ap.add_argument('--xtraspaceright', metavar="int-or-fraction",
@@ -331,6 +376,12 @@ def make_parser(prog='gelannotator', defaults=None,
                         help="Save svg as png (requires cairo package).")
         ap.add_argument('--no-svgtopng', action='store_false', dest='svgtopng',
                         help="Do not save svg as png (requires cairo package).")
+        ap.add_argument('--svgtopng-renderer', dest='svgtopng_renderer', choices=('raster', 'svg'),
+                        help="How to make the annotated png: 'raster' draws the annotations directly onto the "
+                             "gel image (default, does not require cairo); 'svg' converts the svg file.")
+        ap.add_argument('--svgtopng-dpi', dest='svgtopng_dpi', type=int, nargs='+', metavar="DPI",
+                        help="Resolution of the annotated png (raster renderer). "
+                             "Give several values to render one png for each dpi. Default: 96 (svg pixel size).")
 
         # TODO: Rename to to "show_annotated_svg", "show_annotated_png" (or "open", "show", or "display") ?
         ap.add_argument('--openwebbrowser', action='store_true', default=defaults.get('openwebbrowser'),
@@ -338,6 +389,14 @@ def make_parser(prog='gelannotator', defaults=None,
         ap.add_argument('--no-openwebbrowser', action='store_false', dest='openwebbrowser',
                         help="Do not open file in webbrowser.")
 
+        # Incremental (make-style) annotation, see incremental.py:
+        ap.add_argument('--incremental', action='store_true', default=None,
+                        help="Only re-run the stages (png, svg, svgtopng) whose inputs have changed since the "
+                             "last run, using the stage fingerprints saved in the yaml file.")
+        ap.add_argument('--dry-run', action='store_true', dest='dry_run', default=None,
+                        help="Report which stages would be rebuilt in incremental mode, without running them "
+                             "or writing any files.")
+
     return ap
 
 
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Disk-backed cache for intermediate image arrays, e.g. the filtered images and backgrounds in find_peaks().
+
+Each entry is stored as a .npy file and loaded memory-mapped (zero-copy) with np.load(mmap_mode='r').
+Entries are keyed by a hash of the input data, chained with the names and parameters of the stages
+applied to it:
+
+    >>> cache = ArrayCache()
+    >>> key = cache.hash_array(img)
+    >>> key = cache.make_key(key, 'opening', {'selem': (3, 23)})
+    >>> opened = cache.get_or_compute(key, lambda: opening(img, selem=np.ones((3, 23))))
+
+Since each stage's key is derived from its input's key, a pipeline only needs to hash the original input.
+
+The total size of the cache is capped; when the cap is exceeded, the least recently used entries
+are deleted. Access times are tracked using the file modification time (updated on every cache hit).
+
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+import logging
+
+from .config import DEFAULT_ARRAY_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 2 * 1024**3  # 2 GB
+
+
+class ArrayCache(object):
+    """On-disk LRU cache of numpy arrays stored as memory-mappable .npy files."""
+
+    def __init__(self, cachedir=None, max_size=DEFAULT_MAX_SIZE, mmap_mode='r'):
+        """
+        Args:
+            cachedir: directory to store the cache entries in. Default is DEFAULT_ARRAY_CACHE_DIR.
+            max_size: max total size of the cache, in bytes. None for no limit.
+            mmap_mode: mmap_mode used when loading entries with np.load. None to load into memory.
+        """
+        self.cachedir = os.path.abspath(os.path.expanduser(cachedir or DEFAULT_ARRAY_CACHE_DIR))
+        self.max_size = max_size
+        self.mmap_mode = mmap_mode
+        os.makedirs(self.cachedir, exist_ok=True)
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def hash_array(arr):
+        """Return a hex digest of the array's content, dtype and shape."""
+        arr = np.ascontiguousarray(arr)
+        h = hashlib.blake2b(digest_size=20)
+        h.update(("%s%s" % (arr.dtype.str, arr.shape)).encode())
+        h.update(arr.data)
+        return h.hexdigest()
+
+    @staticmethod
+    def make_key(input_key, stage, params=None):
+        """Make the cache key for applying stage (with params) to the input with key input_key."""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(json.dumps([input_key, stage, params], sort_keys=True, default=repr).encode())
+        return h.hexdigest()
+
+    def filepath(self, key):
+        return os.path.join(self.cachedir, key + '.npy')
+
+    def __contains__(self, key):
+        return os.path.exists(self.filepath(key))
+
+    def get(self, key, default=None):
+        """Load the array with the given key (memory-mapped), or return default if not in the cache."""
+        filepath = self.filepath(key)
+        try:
+            arr = np.load(filepath, mmap_mode=self.mmap_mode)
+        except (IOError, ValueError):
+            # IOError/FileNotFoundError if not in cache, ValueError if the file is incomplete/corrupt.
+            self.misses += 1
+            return default
+        try:
+            os.utime(filepath)  # Mark as recently used.
+        except OSError:
+            pass
+        self.hits += 1
+        logger.debug("ArrayCache hit: %s", key)
+        return arr
+
+    def put(self, key, arr):
+        """Store arr in the cache under key, then evict old entries if the cache is above max_size.
+
+        Returns:
+            The stored array, loaded from the cache (memory-mapped).
+        """
+        # Write to a temporary file and rename, so other processes never see an incomplete entry:
+        fd, tmppath = tempfile.mkstemp(suffix='.npy.tmp', dir=self.cachedir)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                np.save(fp, np.asanyarray(arr))
+            os.replace(tmppath, self.filepath(key))
+        except Exception:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            raise
+        self.evict()
+        try:
+            return np.load(self.filepath(key), mmap_mode=self.mmap_mode)
+        except IOError:
+            # The entry was evicted right away because it is larger than max_size.
+            return arr
+
+    def get_or_compute(self, key, func, *args, **kwargs):
+        """Return the cached array for key; if not cached, calculate func(*args, **kwargs) and store the result."""
+        arr = self.get(key)
+        if arr is None:
+            logger.debug("ArrayCache miss: %s", key)
+            arr = self.put(key, func(*args, **kwargs))
+        return arr
+
+    def entries(self):
+        """Return list of (mtime, size, filepath) for all cache entries, least recently used first."""
+        entries = []
+        for entry in os.scandir(self.cachedir):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # Removed by another process.
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self):
+        """Total size of the cache entries, in bytes."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, max_size=None):
+        """Delete the least recently used entries until the total cache size is at most max_size."""
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, filepath in entries:
+            if total <= max_size:
+                break
+            try:
+                os.remove(filepath)
+                logger.debug("ArrayCache evicted %s (%s bytes)", filepath, size)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Delete all cache entries."""
+        self.evict(max_size=0)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Automatic cropping of the gel from the empty scanner bed around it (crop: auto).
+
+The gel boundaries are found in a single pass over a downsampled copy of the image:
+    1. Downsample the image by block-averaging, so the longest side is about DOWNSAMPLED_SIZE pixels.
+    2. Estimate the scanner bed level and noise from the outermost rows and columns.
+    3. Mark pixels that deviate from the bed level, and project the mask onto rows and columns.
+       The gel spans the rows/columns where a sufficient fraction of the pixels deviate from the bed.
+    4. Refine each boundary to the strongest edge gradient of the intensity projection near the boundary.
+The resulting crop box is extended by a margin and clipped to the image.
+
+"""
+
+import numpy as np
+import logging
+
+from .utils import ensure_numeric
+
+logger = logging.getLogger(__name__)
+
+DOWNSAMPLED_SIZE = 512
+DEFAULT_AUTOCROP_MARGIN = 0.02  # fraction of the image size (or pixels, if above 2)
+
+
+def downsample(npimg, target_size=DOWNSAMPLED_SIZE):
+    """Downsample npimg by block-averaging, so its longest side is about target_size pixels.
+
+    Returns:
+        2-tuple of (downsampled float32 image, downsampling factor).
+    """
+    factor = max(1, max(npimg.shape[:2]) // target_size)
+    height, width = (npimg.shape[0] // factor) * factor, (npimg.shape[1] // factor) * factor
+    blocks = npimg[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32), factor
+
+
+def _projection_bounds(fraction, min_fraction):
+    """Return (start, stop) of the range where the projected fraction is above min_fraction * fraction.max()."""
+    above = np.nonzero(fraction > min_fraction * fraction.max())[0]
+    if len(above) == 0:
+        return 0, len(fraction)
+    return int(above[0]), int(above[-1]) + 1
+
+
+def _refine_bound(projection, bound, search, rising):
+    """Move bound to the strongest rising (or falling) step of projection within search pixels of bound."""
+    gradient = np.diff(projection)  # gradient[i] is the step between index i and i+1
+    lo, hi = max(bound - search - 1, 0), min(bound + search, len(gradient))
+    if hi <= lo:
+        return bound
+    window = gradient[lo:hi] if rising else -gradient[lo:hi]
+    return lo + int(np.argmax(window)) + 1
+
+
+def find_gel_bounds(npimg, threshold=None, min_fraction=0.2, border=2, refine=True,
+                    target_size=DOWNSAMPLED_SIZE):
+    """Find the boundaries of the gel on the scanner bed.
+
+    Args:
+        npimg: 2d gel image (numpy array or PIL image).
+        threshold: pixels deviating more than this from the bed level are considered part of the gel.
+            Default is 5 times the bed noise (estimated from the image border),
+            or 10% of the 99th percentile deviation, whichever is larger.
+        min_fraction: rows/columns are part of the gel if the fraction of gel pixels is above
+            min_fraction times the max fraction.
+        border: number of (downsampled) rows and columns at the image border used to estimate the bed level.
+        refine: refine the bounds to the strongest edge gradient of the row/column intensity projections.
+        target_size: size of the downsampled image used to find the bounds.
+
+    Returns:
+        4-tuple of (left, upper, right, lower) absolute pixel coordinates, as used for crop.
+    """
+    npimg = np.asarray(npimg)
+    if npimg.ndim == 3:
+        npimg = npimg.mean(axis=2)
+    small, factor = downsample(npimg, target_size)
+    edge_pixels = np.concatenate([small[:border].ravel(), small[-border:].ravel(),
+                                  small[:, :border].ravel(), small[:, -border:].ravel()])
+    bed = np.median(edge_pixels)
+    deviation = np.abs(small - bed)
+    if threshold is None:
+        noise = np.median(np.abs(edge_pixels - bed)) * 1.4826  # MAD to standard deviation
+        threshold = max(5 * noise, 0.1 * np.percentile(deviation, 99))
+    mask = deviation > threshold
+    upper, lower = _projection_bounds(mask.mean(axis=1), min_fraction)
+    left, right = _projection_bounds(mask.mean(axis=0), min_fraction)
+    if refine:
+        row_projection, col_projection = deviation.mean(axis=1), deviation.mean(axis=0)
+        search = 2
+        upper = _refine_bound(row_projection, upper, search, rising=True)
+        lower = _refine_bound(row_projection, lower, search, rising=False)
+        left = _refine_bound(col_projection, left, search, rising=True)
+        right = _refine_bound(col_projection, right, search, rising=False)
+    height, width = npimg.shape
+    bounds = (left * factor, upper * factor, min(right * factor, width), min(lower * factor, height))
+    logger.debug("Gel bounds (left, upper, right, lower): %s (bed level %s, threshold %s, downsampling %s)",
+                 bounds, bed, threshold, factor)
+    return bounds
+
+
+def find_auto_crop(npimg, margin=DEFAULT_AUTOCROP_MARGIN, **kwargs):
+    """Return the crop box (left, upper, right, lower) of the gel, extended by margin and clipped to the image.
+
+    Args:
+        npimg: 2d gel image (numpy array or PIL image).
+        margin: margin added on each side of the gel. Either pixels or fraction of the image width/height,
+            e.g. 0.02 or "2%" (see utils.ensure_numeric). Can also be a 2-tuple of (x, y) margins.
+        kwargs: passed to find_gel_bounds().
+
+    Returns:
+        4-tuple of absolute (left, upper, right, lower) pixel coordinates.
+    """
+    npimg = np.asarray(npimg)
+    height, width = npimg.shape[:2]
+    left, upper, right, lower = find_gel_bounds(npimg, **kwargs)
+    if isinstance(margin, (list, tuple)):
+        xmargin, ymargin = margin
+    else:
+        xmargin = ymargin = margin
+    xmargin, ymargin = ensure_numeric(xmargin, width), ensure_numeric(ymargin, height)
+    return (max(left - xmargin, 0), max(upper - ymargin, 0),
+            min(right + xmargin, width), min(lower + ymargin, height))
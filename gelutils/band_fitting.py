@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Module for fitting lane profiles as a sum of (skewed) Gaussian bands.
+
+Overlapping bands cannot be separated by simply integrating a window around each band center.
+Instead, each lane profile is fitted as a sum of band peaks (plus a constant baseline), seeded from the
+detected band positions. All bands in a lane are fitted together with scipy.optimize.least_squares,
+using a vectorized residual and an analytic Jacobian, and the lanes are fitted concurrently.
+
+Band models (z = (x - center)/sigma):
+    'gaussian':      amplitude * exp(-z**2/2)
+    'skew_gaussian': amplitude * exp(-z**2/2) * (1 + erf(skew * z/sqrt(2)))
+
+For both models the band area is amplitude * sigma * sqrt(2*pi).
+For the skewed Gaussian, center is the location parameter (equal to the peak position only when skew is 0).
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.special import erf
+import logging
+
+from .band_quantification import (flatten_band_centers_to_dataframe, extract_lane_profiles,
+                                  lane_centers_from_band_centers)
+
+logger = logging.getLogger(__name__)
+
+SQRT_2PI = np.sqrt(2*np.pi)
+SQRT_2_OVER_PI = np.sqrt(2/np.pi)
+BAND_MODELS = ('gaussian', 'skew_gaussian')
+
+
+def _unpack_params(params, n_bands, model):
+    """Split parameter vector [amplitudes, centers, sigmas, (skews), baseline] into column vectors."""
+    amplitude, center, sigma = (params[i*n_bands:(i+1)*n_bands, np.newaxis] for i in range(3))
+    skew = params[3*n_bands:4*n_bands, np.newaxis] if model == 'skew_gaussian' else None
+    return amplitude, center, sigma, skew, params[-1]
+
+
+def band_profile(x, params, n_bands, model='gaussian'):
+    """Evaluate the sum of band peaks plus baseline at positions x.
+
+    Args:
+        x: 1d array of positions.
+        params: parameter vector with amplitudes, centers, sigmas, (skews, if model is 'skew_gaussian'),
+            and finally the baseline.
+        n_bands: number of bands.
+        model: 'gaussian' or 'skew_gaussian'.
+
+    Returns:
+        1d array with the model profile.
+    """
+    amplitude, center, sigma, skew, baseline = _unpack_params(params, n_bands, model)
+    z = (x - center)/sigma  # (n_bands, n_points)
+    peaks = amplitude * np.exp(-0.5*z**2)
+    if model == 'skew_gaussian':
+        peaks *= 1 + erf(skew*z/np.sqrt(2))
+    return peaks.sum(axis=0) + baseline
+
+
+def band_profile_jacobian(x, params, n_bands, model='gaussian'):
+    """Analytic Jacobian of band_profile() with respect to params, shape (n_points, n_params)."""
+    amplitude, center, sigma, skew, _ = _unpack_params(params, n_bands, model)
+    z = (x - center)/sigma
+    gauss = np.exp(-0.5*z**2)
+    if model == 'skew_gaussian':
+        skew_factor = 1 + erf(skew*z/np.sqrt(2))
+        skew_deriv = SQRT_2_OVER_PI * np.exp(-0.5*(skew*z)**2)  # d(skew_factor)/d(skew*z)
+        d_amplitude = gauss * skew_factor
+        # df/dz:
+        d_z = amplitude * gauss * (skew*skew_deriv - z*skew_factor)
+        d_skew = amplitude * gauss * z * skew_deriv
+    else:
+        d_amplitude = gauss
+        d_z = -amplitude * gauss * z
+    # dz/dcenter = -1/sigma, dz/dsigma = -z/sigma
+    columns = [d_amplitude, -d_z/sigma, -d_z*z/sigma]
+    if model == 'skew_gaussian':
+        columns.append(d_skew)
+    columns.append(np.ones((1, len(x))))
+    return np.vstack(columns).T
+
+
+def fit_lane_profile(profile, band_positions, model='gaussian', sigma=3.0, max_shift=None,
+                     min_sigma=0.5, max_sigma=None, max_skew=10.0, margin=None, **least_squares_kwargs):
+    """Fit a lane profile as a sum of band peaks, seeded from the detected band positions.
+
+    Args:
+        profile: 1d lane profile, e.g. from extract_lane_profiles().
+        band_positions: initial band positions (profile index, e.g. the band ypos).
+        model: 'gaussian' or 'skew_gaussian'.
+        sigma: initial band width (standard deviation), in pixels.
+        max_shift: max distance the band centers may move from their initial position. Default is 2*sigma.
+        min_sigma, max_sigma: bounds for the band sigmas. Default max_sigma is 4*sigma.
+        max_skew: bound for the absolute skew parameter (skew_gaussian only).
+        margin: only fit the profile from margin pixels before the first band to margin after the last band.
+            Default is 4*max_sigma.
+        least_squares_kwargs: forwarded to scipy.optimize.least_squares.
+
+    Returns:
+        dict with 1d arrays 'center', 'sigma', 'amplitude', 'area' (and 'skew'), one value for each band,
+        plus the fitted 'baseline', 'success' and 'cost'.
+    """
+    if model not in BAND_MODELS:
+        raise ValueError("Band model must be one of %s, not %r" % (BAND_MODELS, model))
+    profile = np.asarray(profile, dtype=float)
+    band_positions = np.asarray(band_positions, dtype=float)
+    n_bands = len(band_positions)
+    if max_shift is None:
+        max_shift = 2*sigma
+    if max_sigma is None:
+        max_sigma = 4*sigma
+    if margin is None:
+        margin = 4*max_sigma
+    start = max(int(band_positions.min() - margin), 0)
+    stop = min(int(np.ceil(band_positions.max() + margin)) + 1, len(profile))
+    x, y = np.arange(start, stop, dtype=float), profile[start:stop]
+
+    baseline0 = y.min()
+    idx = np.clip(np.round(band_positions).astype(int), 0, len(profile) - 1)
+    amplitude0 = np.clip(profile[idx] - baseline0, 1e-9, None)
+    sigma0 = np.full(n_bands, float(np.clip(sigma, min_sigma, max_sigma)))
+    p0 = [amplitude0, band_positions, sigma0]
+    lower = [np.zeros(n_bands), band_positions - max_shift, np.full(n_bands, min_sigma)]
+    upper = [np.full(n_bands, np.inf), band_positions + max_shift, np.full(n_bands, max_sigma)]
+    if model == 'skew_gaussian':
+        p0.append(np.zeros(n_bands))
+        lower.append(np.full(n_bands, -max_skew))
+        upper.append(np.full(n_bands, max_skew))
+    p0, lower, upper = (np.concatenate(p + [[val]]) for p, val in
+                        ((p0, baseline0), (lower, -np.inf), (upper, np.inf)))
+
+    def residuals(params):
+        return band_profile(x, params, n_bands, model) - y
+
+    def jacobian(params):
+        return band_profile_jacobian(x, params, n_bands, model)
+
+    res = least_squares(residuals, p0, jac=jacobian, bounds=(lower, upper), **least_squares_kwargs)
+    amplitude, center, sigma_fit, skew, baseline = _unpack_params(res.x, n_bands, model)
+    fit = {
+        'center': center.ravel(),
+        'sigma': sigma_fit.ravel(),
+        'amplitude': amplitude.ravel(),
+        'area': (amplitude * sigma_fit).ravel() * SQRT_2PI,
+        'baseline': baseline,
+        'success': res.success,
+        'cost': res.cost,
+    }
+    if model == 'skew_gaussian':
+        fit['skew'] = skew.ravel()
+    return fit
+
+
+def fit_bands(img, lanes_bands_centers, lane_width=25, lane_centers=None, model='gaussian',
+              max_workers=None, **kwargs):
+    """Fit the profile of each lane as a sum of bands, seeded by the given band centers.
+
+    Args:
+        img: background-subtracted, linearized 2d image.
+        lanes_bands_centers: band centers, grouped by [lane_id][band_id],
+            as returned by cluster_peaks_to_lanes_bands().
+        lane_width: width of the lanes, in pixels.
+        lane_centers: Optional sequence of lane x-positions, see quantify_bands().
+        model: 'gaussian' or 'skew_gaussian'.
+        max_workers: max number of threads used to fit lanes concurrently.
+        kwargs: forwarded to fit_lane_profile(), e.g. sigma, max_shift.
+
+    Returns:
+        DataFrame with one row for each band, with the columns from flatten_band_centers_to_dataframe()
+        plus lane_xpos, fit_center, fit_sigma, fit_amplitude, fit_area (and fit_skew) and fit_success.
+    """
+    df = flatten_band_centers_to_dataframe(lanes_bands_centers, product_bands_dist=None)
+    lane_ids = list(lanes_bands_centers.keys())
+    lane_centers = lane_centers_from_band_centers(lanes_bands_centers, lane_centers)
+    # Lanes without bands (or without a given lane center) have a NaN center; they are not fitted,
+    # leaving their fit columns as NaN:
+    valid_idxs = np.nonzero(np.isfinite(lane_centers))[0]
+    profiles = dict(zip(valid_idxs, extract_lane_profiles(img, lane_centers[valid_idxs], lane_width)))
+    lane_rows = [np.nonzero(df['lane_id'].values == lane_id)[0] for lane_id in lane_ids]
+
+    def fit_lane(lane_idx):
+        rows = lane_rows[lane_idx]
+        if len(rows) == 0 or lane_idx not in profiles:
+            return None
+        return fit_lane_profile(profiles[lane_idx], df['ypos'].values[rows].astype(float), model=model, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fits = list(executor.map(fit_lane, range(len(lane_ids))))
+
+    columns = ['center', 'sigma', 'amplitude', 'area'] + (['skew'] if model == 'skew_gaussian' else [])
+    results = {col: np.full(len(df), np.nan) for col in columns}
+    success = np.zeros(len(df), dtype=bool)
+    lane_xpos = np.full(len(df), np.nan)
+    for lane_idx, (rows, fit) in enumerate(zip(lane_rows, fits)):
+        lane_xpos[rows] = lane_centers[lane_idx]
+        if fit is None:
+            continue
+        for col in columns:
+            results[col][rows] = fit[col]
+        success[rows] = fit['success']
+    df['lane_xpos'] = lane_xpos
+    for col in columns:
+        df['fit_' + col] = results[col]
+    df['fit_success'] = success
+    return df
@@ -24,21 +24,30 @@ import numpy as np
 from scipy.cluster.hierarchy import fclusterdata
 # from scipy.cluster.hierarchy import median, average  # various standard linkage calls
 from collections import Counter, defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pprint
 from pandas import DataFrame
 
 from scipy.signal import convolve2d  # 2d convolution, convolve2d(in1, in2)
 from scipy.signal import savgol_filter
+from scipy.signal import find_peaks as find_signal_peaks  # 1d peak finding (not to be confused with find_peaks below)
 
+from scipy import ndimage  # used for label statistics: ndimage.label, ndimage.sum_labels, etc.
 from scipy.ndimage import convolve  # multi-dimensional convolve(input, kernel, ...)
 from scipy.ndimage import gaussian_gradient_magnitude
 from scipy.ndimage import gaussian_filter
+from scipy.ndimage import gaussian_filter1d
 from scipy.ndimage import gaussian_laplace
 from scipy.ndimage import median_filter
 from scipy.ndimage import minimum_filter
 from scipy.ndimage import percentile_filter
 
 from scipy.ndimage.morphology import grey_opening
+try:
+    from scipy.ndimage import sum_labels
+except ImportError:
+    # scipy < 1.6
+    from scipy.ndimage import sum as sum_labels
 
 from skimage import morphology
 from skimage.morphology import opening
@@ -48,6 +57,8 @@ from skimage.feature import peak_local_max
 
 
 from .plot_utils import show_image, show_plot
+from .config import get_dtype_policy
+from .tiling import tiled
 
 
 def draw_rectangle(img, center, width, height=None, val=0, border=0, border_val=None, center_val=None):
@@ -66,12 +77,55 @@ def draw_rectangle(img, center, width, height=None, val=0, border=0, border_val=
     return img
 
 
+def _percentile_along_axis(img, percentile, axis, block_size=None, dtype=np.float32):
+    """Calculate np.percentile(img, percentile, axis=axis) in blocks along the other axis of a 2d image.
+
+    Each block is copied into a scratch buffer of the given dtype, which np.percentile can then
+    partition in-place (overwrite_input=True), so only a single block-sized buffer is allocated.
+    The result is identical to calling np.percentile on the whole array converted to dtype.
+    """
+    other_axis = 1 - axis
+    if block_size is None:
+        block_size = img.shape[other_axis]
+    result = np.empty(img.shape[other_axis], dtype=dtype)
+    scratch = None
+    for start in range(0, img.shape[other_axis], block_size):
+        stop = min(start + block_size, img.shape[other_axis])
+        block = img[:, start:stop] if axis == 0 else img[start:stop, :]
+        if scratch is None or scratch.shape != block.shape:
+            scratch = np.empty(block.shape, dtype=dtype)
+        scratch[...] = block
+        result[start:stop] = np.percentile(scratch, percentile, axis=axis, overwrite_input=True)
+    return result
+
+
 def subtract_row_col_percentile(img, percentile=20, row_window=10, col_window=30,
                                 show_plots=False, show_data=False, verbose=0,
-                                filters=None, window_length=17, polyorder=2):
-    """
-    window_size: row_height, col_width
-    window_length must be odd
+                                filters=None, window_length=17, polyorder=2,
+                                block_rows=None, dtype=None):
+    """Subtract column-wise and then row-wise percentile background from img.
+
+    The column percentiles are subtracted first (to remove smears), then the row percentiles of the
+    column-subtracted image; negative values are clipped to zero after each subtraction.
+    The background is broadcast against a single working copy of the image, which is modified in-place
+    and returned.
+
+    Args:
+        img: 2d image array.
+        percentile: the percentile used as background level.
+        filters: 1d filter function (or sequence of functions), e.g. savgol_filter, used to smooth
+            the column percentiles before subtraction.
+        window_length, polyorder: passed to the filters. window_length must be odd.
+        block_rows: if given, process the image in blocks of this many rows to limit
+            the size of temporary buffers when processing very large images.
+            (If filters are used, the filtered row backgrounds may then differ by rounding errors.)
+        dtype: dtype of the working copy/output image, e.g. float32 to halve the memory used for large images.
+            Default (None) gives the same result (and dtype) as the full-image calculation:
+            the image's float dtype (float64 for integer images), promoted to float64 if filters are used.
+        show_plots, show_data: show the column-subtracted image and the percentile profiles.
+
+    Returns:
+        Background-subtracted image (a new array).
     """
     if filters is None:
         filters = ()
@@ -79,63 +133,65 @@ def subtract_row_col_percentile(img, percentile=20, row_window=10, col_window=30
         filters = (filters,)
 
     print("img.shape:", img.shape)
-    org_min, org_max = np.min(img), np.max(img)
+    n_rows = img.shape[0]
+    if block_rows is None:
+        block_rows = n_rows
+    # Working copy, modified in-place:
+    if dtype is None:
+        img = np.array(img, dtype=img.dtype if img.dtype.kind == 'f' else np.float64)
+    else:
+        img = np.array(img, dtype=dtype)
     # subtract global min
-    img = img - org_min
-    ploti = 0
-    global_max = np.max(img)  # global_min should always be 0
-    global_mean = np.mean(img)
-    global_median = np.median(img)
-    global_10percentile = np.percentile(img, 10)
+    np.subtract(img, img.min(), out=img)
+    global_max = img.max()  # global_min should always be 0
     # img = opened = opening(img, selem=np.ones(3, 29))
     # 20-percentile seems like a good background level:
 
     data = []
     # First do column-wise subtraction to remove smears:
-    column_percentiles = np.percentile(img, percentile, axis=0)  # [row, col], axis=0 means along all rows
+    # Column percentiles are calculated in column blocks of the same size as the row blocks.
+    column_block = max(1, (block_rows * img.shape[1]) // max(n_rows, 1))
+    column_percentiles = _percentile_along_axis(img, percentile, axis=0, block_size=column_block, dtype=img.dtype)
     data.append(('column_percentiles', column_percentiles))
     for filter_1d in filters:
         column_percentiles = filter_1d(column_percentiles, window_length=window_length, polyorder=polyorder)
         column_percentiles = np.clip(column_percentiles, 0, column_percentiles.max())
         data.append((filter_1d.__name__+"_col", column_percentiles))
-#     print("column_percentiles.shape:", column_percentiles.shape)
-    column_background = column_percentiles.reshape(1, column_percentiles.size)
-#     print("column_background.shape:", column_background.shape)
-    column_background = np.vstack([column_background for _ in range(img.shape[0])])  # shape = (rows, cols)
-#     print("column_background.shape:", column_background.shape)
-#     ploti = show_image(column_background, plotidx=ploti, clim=(0, 255))
-
-    # clip to avoid negative values:
-    img = np.clip(img - column_background, 0, global_max)
-    if show_plots:
-        ploti = show_image(img, title="column-subtracted", plotidx=ploti) #, clim=(0, 255))
-
-    # Then subtract row-wise:
-    row_percentiles = np.percentile(img, percentile, axis=1)  # [row, col], axis=0 means along all rows
+    if dtype is None and column_percentiles.dtype != img.dtype:
+        # The filters return float64; subtracting them promotes the image (as in the full-image calculation):
+        img = img.astype(np.result_type(img, column_percentiles))
+    column_percentiles = column_percentiles.astype(img.dtype, copy=False)
+
+    # Then subtract row-wise. Each row's percentile only depends on that row after the column subtraction,
+    # so both subtractions are done in a single pass over the row blocks.
+    # Note: The filters are applied to the row percentiles repeated along each row (one block at a time),
+    # as in the full-image calculation. This only changes the values by rounding errors, but keeps the output
+    # identical. (The filters' clip to the max is a no-op, so only negative values need clipping.)
+    row_percentiles = np.empty(n_rows, dtype=img.dtype)
+    column_subtracted = np.empty_like(img) if show_plots else None
+    for start in range(0, n_rows, block_rows):
+        block = img[start:start+block_rows]
+        # broadcast (cols,) against (rows, cols); clip to avoid negative values:
+        np.subtract(block, column_percentiles, out=block)
+        np.clip(block, 0, global_max, out=block)
+        if column_subtracted is not None:
+            column_subtracted[start:start+block_rows] = block
+        block_percentiles = _percentile_along_axis(block, percentile, axis=1, dtype=img.dtype)
+        row_percentiles[start:start+block_rows] = block_percentiles
+        if filters:
+            row_background = np.repeat(block_percentiles[:, np.newaxis], block.shape[1], axis=1)
+            for filter_1d in filters:
+                row_background = filter_1d(row_background, window_length=window_length, polyorder=polyorder)
+                row_background = np.clip(row_background, 0, None)
+            np.subtract(block, row_background, out=block)
+        else:
+            np.subtract(block, block_percentiles[:, np.newaxis], out=block)
+        np.clip(block, 0, global_max, out=block)
     data.append(('row_percentiles', row_percentiles))
-#     print("row_percentiles.shape:", row_percentiles.shape)
-    row_percentiles = row_percentiles.reshape(row_percentiles.size, 1)
-#     print("row_percentiles.shape:", row_percentiles.shape)
-    row_percentiles = np.hstack([row_percentiles for _ in range(img.shape[1])])  # shape = (rows, cols)
-#     print("row_percentiles.shape:", row_percentiles.shape)
-#     ploti = show_image(row_percentiles, plotidx=ploti, clim=(0, 255))
-
-    for filter_1d in filters:
-        row_percentiles = filter_1d(row_percentiles, window_length=window_length, polyorder=polyorder)
-        row_percentiles = np.clip(row_percentiles, 0, row_percentiles.max())
-        data.append((filter_1d.__name__+"_row", row_percentiles))
-
-    img = np.clip(img - row_percentiles, 0, global_max)
-#     if show_plots:
-#         ploti = show_image(img, title="row-subtracted", plotidx=ploti) #, clim=(0, 255))
 
     ploti = 0
-
-#     fig = pyplot.figure(figsize=(9, 4))  # width, height // unlike [row, col]
-#     pyplot.subplot(121)
-#     pyplot.plot(column_percentiles)
-#     pyplot.subplot(122)
-#     pyplot.plot(row_percentiles)
+    if show_plots:
+        ploti = show_image(column_subtracted, title="column-subtracted", plotidx=ploti) #, clim=(0, 255))
     if show_data:
         for title, vals in data:
             ploti = show_plot(vals, title=title, plotidx=ploti)
@@ -206,7 +262,7 @@ def ellipse_gray(size, dtype=float, only_positive=True, invert=False):
 
 def rolling_minimum_background(img, size=(31, 51), kernel=None,
                                geometry='rectangular', topography='flat',
-                               percentile=0):
+                               percentile=0, tile_shape=None, max_workers=None):
     """
     Instead of calculating the resulting image, just calculate the background and apply with
         img -= rolling_minimum_background(img)
@@ -226,6 +282,8 @@ def rolling_minimum_background(img, size=(31, 51), kernel=None,
         geometry:
         topography:
         percentile: Use percentile_filter with this percentile instead of minimum_filter (equivalent to percentile=0)
+        tile_shape: If given, run the filter in tiles of this shape concurrently, see tiling.run_tiled().
+        max_workers: Max number of threads used when tile_shape is given.
 
     Returns:
         background image
@@ -246,9 +304,14 @@ def rolling_minimum_background(img, size=(31, 51), kernel=None,
 
     if percentile:
         # percentile_filter; footprint must be boolean array; size=(n,m) is equivalent to footprint=np.ones((n,m))
-        background = percentile_filter(img, percentile=percentile, footprint=kernel)
+        filter_func = percentile_filter
+        filter_kwargs = dict(percentile=percentile, footprint=kernel)
     else:
-        background = minimum_filter(img, footprint=kernel)
+        filter_func = minimum_filter
+        filter_kwargs = dict(footprint=kernel)
+    if tile_shape:
+        filter_func = tiled(filter_func, tile_shape=tile_shape, max_workers=max_workers)
+    background = filter_func(img, **filter_kwargs)
 
     return background
 
@@ -257,11 +320,10 @@ def subtract_global_percentile(img, percentile):
     """Reference function, how to globally subtract a value for which a percentile of the population is lower.
     Should generally be applied early to have any effect.
     """
-    bg_val = np.percentile(img, percentile)  # percentile returns float
-    if isinstance(img[0, 0], np.integer):
-        bg_val = np.int(bg_val)
-    img -= bg_val
-    img = np.clip(img, 0, None)  # using amax=None is equivalent to amax=img.max()
+    # Cast to the image dtype (truncating for integer images), so the subtraction doesn't promote the image:
+    bg_val = img.dtype.type(np.percentile(img, percentile))
+    # Not in-place; img may be a read-only (cached) array or used elsewhere:
+    img = np.clip(img - bg_val, 0, None)  # using amax=None is equivalent to amax=img.max()
     return img
 
 
@@ -275,24 +337,137 @@ def apply_and_save(func, img, title, history, history_as_str=True):
     return img, title, history
 
 
-def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
+# Parameters of the find_peaks() (mode '2d') stages, used by find_peaks() and as the parameter sweep defaults:
+FIND_PEAKS_PARAMS = {
+    'opening_shape': (3, 23),
+    'global_percentile': 30,
+    'bg_el_size': (71, 71),
+    'bg_el_percentile': 5,
+    'bg_size': (31, 51),
+    'bg_percentile': 5,
+    'convolve_shape': (3, 29),
+    'pct_filter_size': (3, 21),
+    'pct_filter_percentile': 10,
+    'sigma': 1,
+    'min_distance': 10,
+}
+
+
+# The find_peaks() (mode '2d') stages, shared with parameter_sweep.
+# Each stage returns a new image; the input image is not modified (it may be a read-only cached array,
+# or shared between parameter sweep branches). tile_shape/max_workers run the 2-D filters in tiles
+# of this shape concurrently (see tiling.run_tiled); the output is identical to the untiled filters.
+
+def _tiled_or_not(func, tile_shape=None, max_workers=None):
+    return tiled(func, tile_shape=tile_shape, max_workers=max_workers) if tile_shape else func
+
+
+def peaks_opening(img, shape, tile_shape=None, max_workers=None):
+    """Grey opening of img with a rectangular structuring element of the given shape."""
+    return _tiled_or_not(opening, tile_shape, max_workers)(img, selem=np.ones(shape))
+
+
+def peaks_subtract_global_bg(img, percentile=FIND_PEAKS_PARAMS['global_percentile'], global_bg=None):
+    """Subtract global_bg, or the given percentile of img if global_bg is None, clipping at zero."""
+    if global_bg is None:
+        return subtract_global_percentile(img, percentile=percentile)
+    return np.clip(img - img.dtype.type(global_bg), 0, None)
+
+
+def peaks_rolling_background(img, size, percentile, geometry='rectangular', tile_shape=None, max_workers=None):
+    """Rolling percentile background of img, after smoothing with a gaussian filter (sigma=2)."""
+    smoothed = _tiled_or_not(gaussian_filter, tile_shape, max_workers)(img, sigma=2)
+    return rolling_minimum_background(smoothed, size=size, percentile=percentile, geometry=geometry,
+                                      tile_shape=tile_shape, max_workers=max_workers)
+
+
+def peaks_subtract_background(img, background):
+    """Subtract background from img, clipping at zero."""
+    return np.clip(img - background, 0, None)
+
+
+def peaks_convolve(img, shape, tile_shape=None, max_workers=None):
+    """Convolve img with a normalized rectangular kernel of the given shape (mode='same', so not shifting)."""
+    kernel = np.ones(shape, dtype=img.dtype)  # kernel dtype must match to not promote the image
+    return _tiled_or_not(convolve2d, tile_shape, max_workers)(img, kernel/kernel.sum(), mode='same')
+
+
+def peaks_percentile_filter(img, size, percentile, tile_shape=None, max_workers=None):
+    """Low-percentile filter, to narrow the bands."""
+    return _tiled_or_not(percentile_filter, tile_shape, max_workers)(img, percentile=percentile, size=size)
+
+
+def peaks_gaussian_filter(img, sigma, tile_shape=None, max_workers=None):
+    return _tiled_or_not(gaussian_filter, tile_shape, max_workers)(img, sigma=sigma)
+
+
+def peaks_local_max(img, min_distance):
+    """Return (n, 2) array with the [row, col] positions of the local maxima in img."""
+    return peak_local_max(img, min_distance=min_distance)
+
+
+def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False, mode='2d',
+               tile_shape=None, max_workers=None, cache=None, dtype=None, global_bg=None, **kwargs):
     """
 
     :param img:
     :param band_shape:  (height, width) akak (y, x)
     :param show_images:
     :param save_images:
+    :param mode: '2d' (default) to find peaks with peak_local_max after 2-D filtering of the whole image,
+        or '1d' to find peaks in the lane profiles using find_peaks_lane_profiles(), which is much faster.
+    :param tile_shape: If given, run the 2-D filters in tiles of this shape concurrently in a thread pool
+        (see tiling.run_tiled). The output is identical to the untiled filters.
+    :param max_workers: Max number of threads used when tile_shape is given.
+    :param cache: arraycache.ArrayCache instance. If given, the expensive intermediate images
+        (openings, rolling backgrounds, convolved and filtered images) are loaded from the cache
+        if they have been calculated before for the same input image, and stored in the cache otherwise.
+        Cached images are read-only memory-mapped arrays.
+    :param dtype: dtype used for the calculations (mode '2d'). Default is the compute_dtype from
+        config.get_dtype_policy() (float32). All intermediate images have this dtype.
+    :param global_bg: value subtracted in the subtract_global_percentile stage. Default is the 30th percentile
+        of the opened image. Use this to process parts of an image with the same background, see find_peaks_in_rois.
+    :param kwargs: forwarded to find_peaks_lane_profiles() when mode is '1d'.
     :return:
     """
+    if mode == '1d':
+        peak_pos, profiles = find_peaks_lane_profiles(img, lane_width=kwargs.pop('lane_width', band_shape[1]),
+                                                      return_profiles=True, **kwargs)
+        if show_images:
+            show_image(profiles.T, title="lane profiles", plotidx=0)
+        if save_images:
+            return peak_pos, [(profiles, "lane_profiles", "lane_profiles(img)")]
+        return peak_pos
+    elif mode != '2d':
+        raise ValueError("find_peaks mode must be either '2d' or '1d', not %r" % (mode,))
 
     # Fixed: peaks are shifted, probably because opening() makes a shift from the structuring element.
     # Edit, no it is the convolution that does it...
     #
     img_org = img
-    img = img.astype('f')  # cast to float, otherwise all calculations become inaccurate
+    if dtype is None:
+        dtype = get_dtype_policy()['compute_dtype']
+    img = img.astype(dtype)  # cast to float, otherwise all calculations become inaccurate
+
+    params = FIND_PEAKS_PARAMS
+    tiling = dict(tile_shape=tile_shape, max_workers=max_workers)
+
+    # Each stage's cache key is derived from the key of its input, so only the input image is hashed:
+    cache_key = [cache.hash_array(img) if cache is not None else None]
+
+    def cached(stage, params, func, *args, **kwargs):
+        """Return func(*args, **kwargs), using the cache if given. All stages must pass through here."""
+        if cache is None:
+            return func(*args, **kwargs)
+        cache_key[0] = cache.make_key(cache_key[0], stage, params)
+        return cache.get_or_compute(cache_key[0], func, *args, **kwargs)
+
+    def not_cached(stage, params):
+        """Update the cache key for a (cheap) stage which is calculated without caching its output."""
+        if cache is not None:
+            cache_key[0] = cache.make_key(cache_key[0], stage, params)
 
     images = []
-    band_selem = np.ones((3, 29))
 
     ploti = 0  # start at zero, and show_image will deal with it.
     if show_images:
@@ -322,9 +497,9 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     #
     #
     # opening - larger:
-    title, descr = "opening-3x23", "opening(%s)" % descr
+    title, descr = "opening-%sx%s" % params['opening_shape'], "opening(%s)" % descr
     print(title)
-    img = opened1 = opening(img, selem=np.ones((3, 23)))
+    img = opened1 = cached(title, params['opening_shape'], peaks_opening, img, params['opening_shape'], **tiling)
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -334,7 +509,11 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     title = "subtract_global_percentile"
     descr = "%s(%s)" % (title, descr)
     print(title)
-    img = minus_global_pct_bg = subtract_global_percentile(img, percentile=30)
+    if global_bg is None:
+        not_cached(title, params['global_percentile'])
+    else:
+        not_cached(title, ('global_bg', float(global_bg)))
+    img = minus_global_pct_bg = peaks_subtract_global_bg(img, params['global_percentile'], global_bg=global_bg)
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -346,16 +525,18 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     title = "rolling_5percentile_bg_el"
     descr = "%s(%s)" % (title, descr)
     print(title)
-    rol_min_el = rolling_minimum_background(gaussian_filter(img, sigma=2), percentile=5,
-                                             size=(71, 71),  # height, width (should be odd integers)
-                                             geometry='ellipse')
+    # size is (height, width); should be odd integers:
+    rol_min_el = cached(title, (2, params['bg_el_percentile'], params['bg_el_size'], 'ellipse'),
+                        peaks_rolling_background, img, params['bg_el_size'], params['bg_el_percentile'],
+                        geometry='ellipse', **tiling)
     if show_images:
         ploti = show_image(rol_min_el, title=title, plotidx=ploti, clim_percentile=99.9)
     # subtract the background:
     title = "minus-rol_min_el"
     descr = "%s(%s)" % (title, descr)
     print(title)
-    img = np.clip(img - rol_min_el, 0, None)  # remember to clip at zero
+    not_cached(title, None)
+    img = peaks_subtract_background(img, rol_min_el)  # remember to clip at zero
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -365,14 +546,16 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     title = "rolling_5percentile_bg"
     descr = "%s(%s)" % (title, descr)
     print(title)
-    rol_min_bg = rolling_minimum_background(gaussian_filter(img, sigma=2), percentile=5)
+    rol_min_bg = cached(title, (2, params['bg_percentile']), peaks_rolling_background, img,
+                        params['bg_size'], params['bg_percentile'], **tiling)
     if show_images:
         ploti = show_image(rol_min_bg, title=title, plotidx=ploti, clim_percentile=99.9)
     # subtract the background:
     title = "minus-rol_min_bg"
     descr = "%s(%s)" % (title, descr)
     print(title)
-    img = np.clip(img - rol_min_bg, 0, None)  # remember to clip at zero
+    not_cached(title, None)
+    img = peaks_subtract_background(img, rol_min_bg)  # remember to clip at zero
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -394,7 +577,7 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     # opening, again:
     title, descr = "opening-%sx%s" % band_shape, "opening(%s)" % descr
     print(title)
-    img = opened2 = opening(img, selem=np.ones(band_shape))
+    img = opened2 = cached(title, band_shape, peaks_opening, img, band_shape, **tiling)
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -404,7 +587,8 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     # default mode='full' will shift output, use mode='same' to prevent shifting
     title, descr = "convolved", "convolved(%s)" % descr
     print(title)
-    img = convolved = convolve2d(img, band_selem/band_selem.sum(), mode='same')
+    img = convolved = cached(title, params['convolve_shape'], peaks_convolve, img, params['convolve_shape'],
+                             **tiling)
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -412,11 +596,11 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     #
     # low-percentile filter to narrow the bands:
     # (don't apply further openings or band-shape specific convolutions after narrowing the bands!)
-    size = (3, 21)
+    size, percentile = params['pct_filter_size'], params['pct_filter_percentile']
     title = "pct_filtered-%sx%s" % size
     descr = "%s(%s)" % (title, descr)
     print(title)
-    img = pct_filtered = percentile_filter(img, percentile=10, size=size)
+    img = pct_filtered = cached(title, (percentile, size), peaks_percentile_filter, img, size, percentile, **tiling)
     images.append((img, title, descr))
     if show_images:
         ploti = show_image(img, title=title, plotidx=ploti)
@@ -425,51 +609,50 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
     # gaussian:
     title, descr = "gaussian_filter", "gaussian_filter(%s)" % descr
     print(title)
-    img = gaussianed = gaussian_filter(img, sigma=1)
+    img = gaussianed = cached(title, params['sigma'], peaks_gaussian_filter, img, params['sigma'], **tiling)
     images.append((img, title, descr))
     # if show_images:
     #     ploti = show_image(img, title="gaussianed", plotidx=ploti)
 
     # Peaks!
     print("Finding peaks...")
-    peak_pos = peak_local_max(img,
-                              min_distance=10,
-                              # threshold_abs=3,
-                              # threshold_rel=0.01  # values must be 0.01 * maximum_value
-                             )
+    # (peak_local_max also takes threshold_abs, or threshold_rel=0.01 for values above 0.01 * maximum_value.)
+    peak_pos = peaks_local_max(img, min_distance=params['min_distance'])
     print("peak_pos.shape", peak_pos.shape)
 
-    #
-    # Draw peaks on a copy of the image:
-    img = img.copy()  # otherwise we will write on convolved
-    for pos in peak_pos:
-        draw_rectangle(img, pos, width=2, val=255, border=0, center_val=None)
-    ploti = show_image(img, title="peaks", plotidx=ploti)
-
-    #
-    # Other visualizations:
-    ggm_filtered = gaussian_gradient_magnitude(convolved, sigma=1.0)
-    ploti = show_image(ggm_filtered, title="gaussian_gradient_magnitude",
-                       plotidx=ploti, clim=(0, np.percentile(ggm_filtered, 99.9)))
-
-    title, descr = "glaplace of convolved", "laplace of convolved"
-    # laplaced = laplace(convolved)
-    laplaced = gaussian_laplace(convolved, sigma=2)
-    ploti = show_image(laplaced, title=title, plotidx=ploti,
-                       cmap="gray_r",
-                       clim_percentile=(1, 99))
-
-    lggm = laplaced*(ggm_filtered-3)
-    ploti = show_image(lggm, title="laplaced*(ggm_filtered-3)", plotidx=ploti,
-                       cmap="gray_r",
-                       clim_percentile=(1, 99))
-
-    title, descr = "glaplace of opened1", "laplace of opened1"
-    # laplaced = laplace(convolved)
-    laplaced = gaussian_laplace(opened1, sigma=2)
-    ploti = show_image(laplaced, title=title, plotidx=ploti,
-                       cmap="gray_r",
-                       clim_percentile=(10, 90))
+    if show_images:
+        # Visualizations are only calculated when shown; they are not needed to find the peaks.
+        #
+        # Draw peaks on a copy of the image:
+        img = img.copy()  # otherwise we will write on convolved
+        for pos in peak_pos:
+            draw_rectangle(img, pos, width=2, val=255, border=0, center_val=None)
+        ploti = show_image(img, title="peaks", plotidx=ploti)
+
+        #
+        # Other visualizations:
+        ggm_filtered = gaussian_gradient_magnitude(convolved, sigma=1.0)
+        ploti = show_image(ggm_filtered, title="gaussian_gradient_magnitude",
+                           plotidx=ploti, clim=(0, np.percentile(ggm_filtered, 99.9)))
+
+        title, descr = "glaplace of convolved", "laplace of convolved"
+        # laplaced = laplace(convolved)
+        laplaced = gaussian_laplace(convolved, sigma=2)
+        ploti = show_image(laplaced, title=title, plotidx=ploti,
+                           cmap="gray_r",
+                           clim_percentile=(1, 99))
+
+        lggm = laplaced*(ggm_filtered-3)
+        ploti = show_image(lggm, title="laplaced*(ggm_filtered-3)", plotidx=ploti,
+                           cmap="gray_r",
+                           clim_percentile=(1, 99))
+
+        title, descr = "glaplace of opened1", "laplace of opened1"
+        # laplaced = laplace(convolved)
+        laplaced = gaussian_laplace(opened1, sigma=2)
+        ploti = show_image(laplaced, title=title, plotidx=ploti,
+                           cmap="gray_r",
+                           clim_percentile=(10, 90))
 
     if save_images:
         return peak_pos, images
@@ -477,6 +660,108 @@ def find_peaks(img, band_shape=(3, 25), show_images=False, save_images=False):
         return peak_pos
 
 
+# Number of columns that the find_peaks (mode '2d') output at a pixel depends on, on each side, for each stage:
+# opening-3x23 (applied twice), gaussian(sigma=2) + 71-wide ellipse percentile bg, gaussian(sigma=2) + 51-wide bg,
+# opening with band_shape (added in find_peaks_halo), convolve 3x29, percentile 3x21, gaussian(sigma=1),
+# and peak_local_max(min_distance=10).
+FIND_PEAKS_STAGE_HALOS = (2*11, 8 + 35, 8 + 25, 14, 10, 4, 10)
+
+
+def find_peaks_halo(band_shape=(3, 25)):
+    """Return the number of columns needed on each side of a region to get the same find_peaks() output
+    within the region as when processing the whole image."""
+    return sum(FIND_PEAKS_STAGE_HALOS) + 2*(band_shape[1]//2)
+
+
+def merge_column_intervals(col_start, col_stop, halo=0, img_width=None):
+    """Extend the column intervals [start, stop) by halo on each side and merge the overlapping intervals.
+
+    Returns:
+        List of (start, stop) tuples with the merged intervals, left to right, clipped to the image.
+    """
+    intervals = sorted(zip(np.asarray(col_start) - halo, np.asarray(col_stop) + halo))
+    merged = []
+    for start, stop in intervals:
+        start = max(int(start), 0)
+        stop = int(stop) if img_width is None else min(int(stop), img_width)
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return [tuple(interval) for interval in merged]
+
+
+def find_peaks_in_rois(img, lane_rois=None, lane_centers=None, lane_width=25, band_shape=(3, 25),
+                       global_bg=None, global_percentile=30, max_workers=None, return_strips=False, **kwargs):
+    """Find peaks (mode '2d') only in the given lane regions, instead of filtering the whole image.
+
+    The lanes are extended by the filter halo (see find_peaks_halo), overlapping regions are merged into
+    column strips, and find_peaks() is run on each strip. Peaks are reported in image coordinates,
+    and only peaks inside the lane regions are returned. Inter-lane gaps wider than twice the halo
+    and the empty space around the gel are not processed.
+
+    The global background is calculated from the whole (opened) image, as in find_peaks(), which is cheap
+    compared to the other filters. The peaks within the lanes are thus identical to find_peaks() on the whole image.
+
+    Args:
+        img: 2d image.
+        lane_rois: sequence of (col_start, col_stop) for each lane.
+        lane_centers: alternatively, sequence of lane x-positions (e.g. from lane_detection.find_lane_positions
+            or from the annotation lane positions), each lane being lane_width wide.
+        lane_width: width of the lanes, when given as lane_centers.
+        band_shape: passed to find_peaks().
+        global_bg: background value subtracted from the opened image, see find_peaks().
+            Default is the global_percentile of the whole image after opening.
+        global_percentile: percentile used to calculate global_bg.
+        max_workers: max number of threads used to process the strips concurrently.
+        return_strips: If True, also return the list of processed (col_start, col_stop) strips.
+        kwargs: forwarded to find_peaks(), e.g. dtype, cache, tile_shape.
+
+    Returns:
+        (n, 2) int array of [row, col] peak positions, sorted by col then row.
+        If return_strips is True, a 2-tuple of (peak_pos, strips).
+    """
+    img_width = img.shape[1]
+    if lane_rois is None:
+        if lane_centers is None:
+            raise ValueError("Either lane_rois or lane_centers must be given.")
+        col_start, col_stop = lane_column_bounds(lane_centers, lane_width, img_width)
+    else:
+        col_start, col_stop = (np.asarray(bounds, dtype=int) for bounds in zip(*lane_rois))
+    in_lanes = np.zeros(img_width, dtype=bool)
+    for start, stop in zip(col_start, col_stop):
+        in_lanes[start:stop] = True
+    if global_bg is None:
+        dtype = kwargs.get('dtype') or get_dtype_policy()['compute_dtype']
+        img_dtype = img.astype(dtype)
+        shape = FIND_PEAKS_PARAMS['opening_shape']
+        cache = kwargs.get('cache')
+        if cache is None:
+            opened = peaks_opening(img_dtype, shape)
+        else:
+            # Same key as the first find_peaks() stage on the whole image:
+            key = cache.make_key(cache.hash_array(img_dtype), "opening-%sx%s" % shape, shape)
+            opened = cache.get_or_compute(key, peaks_opening, img_dtype, shape)
+        global_bg = np.percentile(opened, global_percentile)
+    strips = merge_column_intervals(col_start, col_stop, halo=find_peaks_halo(band_shape), img_width=img_width)
+    print("find_peaks_in_rois: processing %s of %s columns in %s strips." % (
+        sum(stop - start for start, stop in strips), img_width, len(strips)))
+
+    def find_strip_peaks(strip):
+        start, stop = strip
+        peak_pos = find_peaks(img[:, start:stop], band_shape=band_shape, mode='2d', global_bg=global_bg, **kwargs)
+        return peak_pos + [0, start]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        peak_pos = list(executor.map(find_strip_peaks, strips))
+    peak_pos = np.concatenate(peak_pos).astype(int) if peak_pos else np.empty((0, 2), dtype=int)
+    peak_pos = peak_pos[in_lanes[peak_pos[:, 1]]]
+    peak_pos = peak_pos[np.lexsort((peak_pos[:, 0], peak_pos[:, 1]))]
+    if return_strips:
+        return peak_pos, strips
+    return peak_pos
+
+
 def filter_pos_in_area(pos, area):
     """
 
@@ -670,3 +955,313 @@ def add_band_product_id_annotation(df, vdist=5.0):
     df['product_id'] = product_clusters_ids
 
 
+
+
+def lane_centers_from_peaks_by_lane(peaks_by_lane):
+    """Return the x-position (column) of each lane, as the mean x-position of the lane's peaks.
+
+    Args:
+        peaks_by_lane: dict of lane_id -> (n, 2) array of [row, col] peak positions,
+            as returned by cluster_peaks_by_lane().
+
+    Returns:
+        1d array of lane centers, in the same order as peaks_by_lane.
+    """
+    return np.array([lane_peaks[:, 1].mean() for lane_peaks in peaks_by_lane.values()])
+
+
+def lane_centers_from_band_centers(lanes_bands_centers, lane_centers=None):
+    """Return the x-position (column) of each lane, as the mean x-position of the lane's band centers.
+
+    Args:
+        lanes_bands_centers: band centers, grouped by [lane_id][band_id],
+            as returned by cluster_peaks_to_lanes_bands().
+        lane_centers: Optional sequence of lane x-positions, e.g. from annotation lane positions;
+            if given, these are returned (as array) instead.
+
+    Returns:
+        1d float array of lane centers, in the same order as lanes_bands_centers (NaN for lanes without bands).
+    """
+    if lane_centers is None:
+        lane_centers = [np.mean([center[1] for center in bands_centers.values()]) if bands_centers else np.nan
+                        for bands_centers in lanes_bands_centers.values()]
+    return np.asarray(lane_centers, dtype=float)
+
+
+def lane_column_bounds(lane_centers, lane_width, img_width):
+    """Calculate the [start, stop) column bounds of each lane, clipped to the image.
+
+    Args:
+        lane_centers: sequence of lane x-positions (columns).
+        lane_width: width of each lane, in pixels.
+        img_width: image width (number of columns).
+
+    Returns:
+        2-tuple of int arrays (col_start, col_stop).
+        Lanes with a non-finite center (e.g. lanes without any bands) get the empty bounds (0, 0).
+    """
+    lane_centers = np.asarray(lane_centers, dtype=float)
+    valid = np.isfinite(lane_centers)
+    half_width = lane_width / 2
+    centers = np.where(valid, lane_centers, 0)  # Casting NaN to int is undefined.
+    col_start = np.clip(np.round(centers - half_width), 0, img_width - 1).astype(int)
+    col_stop = np.clip(np.round(centers + half_width), 1, img_width).astype(int)
+    col_stop = np.maximum(col_stop, col_start + 1)  # Make sure every valid lane has at least one column.
+    col_start[~valid] = 0
+    col_stop[~valid] = 0
+    return col_start, col_stop
+
+
+def extract_lane_profiles(img, lane_centers, lane_width):
+    """Extract the vertical intensity profile of every lane, summed over the lane's columns.
+
+    All lanes are extracted with a single vectorized np.add.reduceat call over the column slices
+    [start_0, stop_0, start_1, stop_1, ...]; every other output column is then the sum over a lane.
+    The image should be background-subtracted and linearized, otherwise the profile sums are
+    not proportional to the amount of material in the lane.
+
+    Args:
+        img: 2d image, [row, col] aka [y, x].
+        lane_centers: sequence of lane x-positions (columns), e.g. from lane_centers_from_peaks_by_lane().
+        lane_width: width of each lane, in pixels.
+
+    Returns:
+        2d array of shape (n_lanes, img.shape[0]), one row profile for each lane.
+        Lanes with a non-finite center (e.g. lanes without any bands) get an all-NaN profile.
+    """
+    img_height, img_width = img.shape
+    lane_centers = np.asarray(lane_centers, dtype=float)
+    valid = np.isfinite(lane_centers)
+    if not valid.all():
+        sum_dtype = img.dtype if np.issubdtype(img.dtype, np.floating) else get_dtype_policy()['accumulate_dtype']
+        profiles = np.full((len(lane_centers), img_height), np.nan, dtype=sum_dtype)
+        if valid.any():
+            profiles[valid] = extract_lane_profiles(img, lane_centers[valid], lane_width)
+        return profiles
+    col_start, col_stop = lane_column_bounds(lane_centers, lane_width, img_width)
+    # reduceat indices must be < img_width; a stop at the right edge is handled by omitting it,
+    # which makes reduceat sum to the end of the image:
+    at_edge = col_stop >= img_width
+    indices = np.empty(2*len(col_start), dtype=int)
+    indices[0::2] = col_start
+    indices[1::2] = np.where(at_edge, img_width - 1, col_stop)
+    # Integer images are summed in the accumulate dtype (float64) to prevent overflow:
+    sum_dtype = img.dtype if np.issubdtype(img.dtype, np.floating) else get_dtype_policy()['accumulate_dtype']
+    profiles = np.add.reduceat(img, indices, axis=1, dtype=sum_dtype)[:, 0::2].T  # shape = (n_lanes, rows)
+    # For lanes that ends at the image edge, the slice above stopped one column early:
+    # (reduceat with indices[i] >= indices[i+1] just returns img[:, indices[i]], so only valid lanes are fixed.)
+    if at_edge.any():
+        profiles = np.ascontiguousarray(profiles)
+        edge_lanes = np.nonzero(at_edge & (col_start < img_width - 1))[0]
+        profiles[edge_lanes] += img[:, -1]
+    return profiles
+
+
+def integrate_band_volumes(lane_profiles, lane_idxs, band_start, band_stop):
+    """Integrate band volumes from lane profiles using a cumulative-sum profile.
+
+    Each band volume is csum[lane, stop] - csum[lane, start], computed for all bands at once.
+
+    Args:
+        lane_profiles: (n_lanes, n_rows) array, e.g. from extract_lane_profiles().
+        lane_idxs: array with the lane index (row in lane_profiles) of each band.
+        band_start: array with the first row of each band window (inclusive).
+        band_stop: array with the last row of each band window (exclusive).
+
+    Returns:
+        1d array with the integrated volume of each band.
+    """
+    n_lanes, n_rows = lane_profiles.shape
+    # Use float64 for the cumulative sum to avoid loss of precision for long profiles:
+    csum = np.zeros((n_lanes, n_rows + 1), dtype=np.float64)
+    np.cumsum(lane_profiles, axis=1, out=csum[:, 1:])
+    lane_idxs = np.asarray(lane_idxs, dtype=int)
+    band_start = np.clip(np.asarray(band_start, dtype=int), 0, n_rows)
+    band_stop = np.clip(np.asarray(band_stop, dtype=int), 0, n_rows)
+    return csum[lane_idxs, band_stop] - csum[lane_idxs, band_start]
+
+
+def quantify_bands(img, lanes_bands_centers, lane_width=25, band_height=11, lane_centers=None,
+                   product_bands_dist=None):
+    """Quantify the amount of material in each band of a gel.
+
+    Args:
+        img: background-subtracted, linearized 2d image.
+        lanes_bands_centers: band centers, grouped by [lane_id][band_id],
+            as returned by cluster_peaks_to_lanes_bands().
+        lane_width: width of the lanes, in pixels.
+        band_height: height of the window used to integrate each band, in pixels.
+        lane_centers: Optional sequence of lane x-positions, one for each lane in lanes_bands_centers,
+            e.g. from annotation lane positions. Default is the mean x-position of each lane's bands.
+        product_bands_dist: forwarded to flatten_band_centers_to_dataframe().
+
+    Returns:
+        DataFrame with one row for each band, with the columns from flatten_band_centers_to_dataframe()
+        plus lane_xpos, ystart, ystop and volume.
+    """
+    df = flatten_band_centers_to_dataframe(lanes_bands_centers, product_bands_dist=product_bands_dist)
+    lane_ids = list(lanes_bands_centers.keys())
+    lane_centers = lane_centers_from_band_centers(lanes_bands_centers, lane_centers)
+    lane_idxs = df['lane_id'].map({lane_id: idx for idx, lane_id in enumerate(lane_ids)}).values.astype(int)
+    profiles = extract_lane_profiles(img, lane_centers, lane_width)
+    ypos = df['ypos'].values.astype(float)
+    df['lane_xpos'] = lane_centers[lane_idxs]
+    ystart = np.round(ypos).astype(int) - band_height//2
+    df['ystart'] = ystart.clip(0, img.shape[0])
+    df['ystop'] = (ystart + band_height).clip(0, img.shape[0])
+    df['volume'] = integrate_band_volumes(profiles, lane_idxs, df['ystart'].values, df['ystop'].values)
+    return df
+
+
+def find_lane_centers(img, lane_width=25, sigma=None, rel_prominence=0.05):
+    """Find the x-position of lanes from the column profile of the image.
+
+    Args:
+        img: 2d image with bands as high pixel values.
+        lane_width: approximate lane width; peaks in the column profile closer than 0.8*lane_width are merged.
+        sigma: gaussian smoothing of the column profile; defaults to lane_width/6.
+        rel_prominence: minimum peak prominence, relative to the range of the smoothed column profile.
+
+    Returns:
+        1d array with the x-position (column) of each lane, sorted left to right.
+    """
+    if sigma is None:
+        sigma = lane_width / 6
+    col_profile = gaussian_filter1d(img.mean(axis=0, dtype=np.float64), sigma=sigma)
+    lane_centers, _ = find_signal_peaks(col_profile, distance=max(1, int(0.8*lane_width)),
+                                        prominence=rel_prominence*np.ptp(col_profile))
+    return lane_centers
+
+
+def find_peaks_lane_profiles(img, lane_centers=None, lane_width=25, sigma=1.0, min_distance=5,
+                             prominence=None, rel_prominence=0.02, width=1, return_profiles=False):
+    """Find band peaks in 1-D lane profiles instead of with 2-D filtering of the whole image.
+
+    Each lane is collapsed into a single vertical profile (see extract_lane_profiles), all profiles are
+    smoothed with a single gaussian_filter1d call, and bands are found with scipy.signal.find_peaks
+    using prominence and width criteria. This processes roughly width/lane_width fewer pixels than find_peaks.
+
+    Args:
+        img: 2d image with bands as high pixel values, preferably background-subtracted.
+        lane_centers: sequence of lane x-positions; if not given, these are found with find_lane_centers().
+        lane_width: width of the lanes, in pixels.
+        sigma: gaussian smoothing (in pixels) of the lane profiles. Set to 0 to disable smoothing.
+        min_distance: minimum vertical distance between two bands in the same lane.
+        prominence: minimum absolute prominence of a band, in lane-profile units (summed over lane_width).
+        rel_prominence: if prominence is not given, minimum prominence relative to the range of all lane profiles.
+        width: minimum band width (height, in rows) at half prominence.
+        return_profiles: if True, also return the smoothed lane profiles.
+
+    Returns:
+        (n, 2) int array of [row, col] peak positions, same format as find_peaks (peak_local_max),
+        where col is the center of the lane. If return_profiles is True, a 2-tuple of (peak_pos, profiles).
+    """
+    if lane_centers is None:
+        lane_centers = find_lane_centers(img, lane_width=lane_width)
+    lane_centers = np.asarray(lane_centers)
+    profiles = extract_lane_profiles(img, lane_centers, lane_width)
+    if sigma:
+        profiles = gaussian_filter1d(profiles, sigma=sigma, axis=1)
+    if prominence is None:
+        prominence = rel_prominence * np.ptp(profiles) if profiles.size else 0
+    peak_pos = []
+    for lane_center, profile in zip(np.round(lane_centers).astype(int), profiles):
+        rows, _ = find_signal_peaks(profile, distance=max(1, min_distance), prominence=prominence, width=width)
+        peak_pos.append(np.column_stack((rows, np.full(rows.shape, lane_center))))
+    peak_pos = np.concatenate(peak_pos).astype(int) if peak_pos else np.empty((0, 2), dtype=int)
+    if return_profiles:
+        return peak_pos, profiles
+    return peak_pos
+
+
+def label_band_regions(img, threshold=None, structure=None):
+    """Threshold a background-subtracted image and label the connected band regions.
+
+    Args:
+        img: background-subtracted 2d image, e.g. after rolling_minimum_background or subtract_row_col_percentile.
+        threshold: pixels above this value are considered part of a band. Default is mean + standard deviation.
+        structure: connectivity structuring element, passed to ndimage.label. Default is 4-connectivity.
+
+    Returns:
+        2-tuple of (labels, n_regions), where labels is an int array of same shape as img
+        with 0 for background and 1..n_regions for each connected band region.
+    """
+    if threshold is None:
+        threshold = img.mean() + img.std()
+    return ndimage.label(img > threshold, structure=structure)
+
+
+def band_region_stats(img, labels, n_regions=None, saturation_img=None, saturation_value=None):
+    """Calculate statistics for all labeled band regions at once.
+
+    Every statistic is calculated with a single vectorized call over all labels.
+
+    Args:
+        img: the (background-subtracted) image used to calculate volumes, maxima and centers of mass.
+        labels: labeled image, e.g. from label_band_regions().
+        n_regions: number of regions in labels; determined from labels if not given.
+        saturation_img: image used to determine saturation, e.g. the raw image before background subtraction.
+            Defaults to img.
+        saturation_value: regions with pixels at or above this value are flagged as saturated.
+            Defaults to the maximum value of saturation_img's dtype, if that is an integer dtype.
+
+    Returns:
+        DataFrame indexed by region_id, with columns area, volume, max_value, ycom, xcom,
+        ystart, ystop, xstart, xstop, and saturated.
+    """
+    if n_regions is None:
+        n_regions = labels.max()
+    index = np.arange(1, n_regions + 1)
+    area = np.bincount(labels.ravel(), minlength=n_regions + 1)[1:]
+    volume = sum_labels(img, labels, index)
+    max_value = ndimage.maximum(img, labels, index)
+    com = np.array(ndimage.center_of_mass(img, labels, index)).reshape(-1, 2)
+    # find_objects returns a (row_slice, col_slice) tuple for each label:
+    bboxes = np.array([(rs.start, rs.stop, cs.start, cs.stop) for rs, cs in ndimage.find_objects(labels, n_regions)],
+                      dtype=int).reshape(-1, 4)
+    if saturation_img is None:
+        saturation_img = img
+    if saturation_value is None and np.issubdtype(saturation_img.dtype, np.integer):
+        saturation_value = np.iinfo(saturation_img.dtype).max
+    if saturation_value is None:
+        saturated = np.zeros(n_regions, dtype=bool)
+    else:
+        saturated = ndimage.maximum(saturation_img, labels, index) >= saturation_value
+    stats = DataFrame(
+        OrderedDict([
+            ('area', area), ('volume', volume), ('max_value', max_value),
+            ('ycom', com[:, 0]), ('xcom', com[:, 1]),
+            ('ystart', bboxes[:, 0]), ('ystop', bboxes[:, 1]), ('xstart', bboxes[:, 2]), ('xstop', bboxes[:, 3]),
+            ('saturated', saturated),
+        ]),
+        index=index,
+    )
+    stats.index.name = 'region_id'
+    return stats
+
+
+def add_band_region_stats(df, img, threshold=None, structure=None, saturation_img=None, saturation_value=None):
+    """Label band regions in img and join the region statistics into the band table.
+
+    Each band (row in df) is linked to the labeled region at the band's center;
+    bands whose center is not inside a labeled region get NaN statistics.
+    The image is only labeled once, and all statistics are calculated in vectorized calls.
+
+    Args:
+        df: band table with xpos and ypos columns, e.g. from flatten_band_centers_to_dataframe() or quantify_bands().
+        img: background-subtracted image.
+        threshold, structure: passed to label_band_regions().
+        saturation_img, saturation_value: passed to band_region_stats().
+
+    Returns:
+        New DataFrame with the columns from df plus region_id and the columns from band_region_stats(),
+        prefixed with 'region_'.
+    """
+    labels, n_regions = label_band_regions(img, threshold=threshold, structure=structure)
+    stats = band_region_stats(img, labels, n_regions, saturation_img=saturation_img,
+                              saturation_value=saturation_value)
+    rows = np.clip(np.round(df['ypos'].values.astype(float)).astype(int), 0, img.shape[0] - 1)
+    cols = np.clip(np.round(df['xpos'].values.astype(float)).astype(int), 0, img.shape[1] - 1)
+    df = df.copy()
+    df['region_id'] = labels[rows, cols]
+    return df.join(stats.add_prefix('region_'), on='region_id')
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Batch annotation of many gels, e.g. a whole scanner folder at the end of the day.
+
+The layered config is resolved in the main process, reading each distinct file only once:
+    parser defaults < system config (DEFAULT_CONFIG_FILEPATHS) < config template < per-gel yaml file
+    < options given on the command line.
+Each gel is then annotated with annotate_gel() (convert, make_svg and optionally svgtopng)
+in a process pool, and the status and time used for each gel is reported as it completes.
+
+Usage:
+    $ batchannotate scans/ --svgtopng --workers 8 --report annotate_report.csv
+    $ batchannotate "scans/*.gaml"
+    $ batchannotate scans/ --incremental --dry-run
+
+With --incremental, only the stages of each gel whose inputs have changed since the last run are re-run
+(see incremental.py); --dry-run reports what would be rebuilt without writing anything.
+
+Inputs can be gel files, yaml (config) files, directories (all gel files in the directory),
+or glob patterns. For a gel file, the yaml file is <gelfile>.gaml (if it exists); for a yaml file,
+the gel file is the 'gelfile' given in the yaml file.
+
+"""
+
+import os
+import sys
+import csv
+import glob
+import time
+import traceback
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import logging
+
+from .argutils import make_parser
+from . import dirindex
+from .config import get_default_config, yaml_get, gel_exts, img_exts, cfg_exts
+from .gelannotator import annotate_gel, find_yamlfilepath
+from .utils import getabsfilepath, mergedicts
+
+logger = logging.getLogger(__name__)
+
+# Options only used by the batch runner, not passed on to annotate_gel:
+BATCH_OPTIONS = ('inputs', 'workers', 'report', 'load_system_config', 'config_template')
+
+
+def find_annotation_jobs(inputs):
+    """Find (gelfile, yamlfile) pairs from a list of gel files, yaml files, directories and glob patterns.
+
+    Directories are searched (non-recursively) for gel files (config.gel_exts), so previously
+    generated png files are not annotated again.
+
+    Returns:
+        List of (gelfile, yamlfile) 2-tuples, sorted and without duplicates.
+        yamlfile is the config file for the gel, which may not exist yet.
+    """
+    jobs = {}
+    for inp in inputs:
+        if os.path.isdir(inp):
+            candidates = [os.path.join(inp, fn) for fn in dirindex.default_index.listing(inp)
+                          if os.path.splitext(fn)[1].lower() in gel_exts]
+        else:
+            candidates = glob.glob(inp)
+        for fn in candidates:
+            ext = os.path.splitext(fn)[1].lower()
+            if not os.path.isfile(fn):
+                continue
+            if ext in cfg_exts:
+                gelfile = (yaml_get(fn) or {}).get('gelfile')
+                if not gelfile:
+                    logger.warning("Config file %s does not specify a gelfile; skipping.", fn)
+                    continue
+                jobs[(getabsfilepath(fn, gelfile), fn)] = None
+            elif ext in gel_exts + img_exts:
+                jobs[(fn, find_yamlfilepath(fn))] = None
+    return sorted(jobs)
+
+
+def get_base_config(load_system_config=True, config_template=None):
+    """Return the config shared by all gels: system config merged with the config template (if given)."""
+    config = {}
+    if load_system_config:
+        system_config_fn, system_config = get_default_config()
+        if system_config:
+            logger.info("Loaded system config from file %s", system_config_fn)
+            config = mergedicts(config, system_config)
+    if config_template:
+        template_config = yaml_get(config_template)
+        if template_config is None:
+            raise IOError("Could not load config template: %s" % config_template)
+        config = mergedicts(config, template_config)
+    return config
+
+
+def make_job_args(jobs, defaults=None, base_config=None, user_args=None):
+    """Resolve the layered config for each (gelfile, yamlfile) job.
+
+    Each distinct yaml file is only read once.
+
+    Returns:
+        List of dicts with gelfile, yamlfile, yamlsettings (content of yamlfile) and args (the merged config).
+    """
+    yaml_cache = {}
+    job_args = []
+    for gelfile, yamlfile in jobs:
+        key = os.path.abspath(yamlfile)
+        if key not in yaml_cache:
+            yaml_cache[key] = yaml_get(yamlfile, default={}) or {}
+        yamlsettings = yaml_cache[key]
+        args = mergedicts(defaults or {}, base_config or {}, yamlsettings, user_args or {})
+        args.setdefault('annotationsfile', None)
+        # Never open hundreds of browser windows:
+        args['openwebbrowser'] = False
+        job_args.append({'gelfile': gelfile, 'yamlfile': yamlfile, 'yamlsettings': yamlsettings, 'args': args})
+    return job_args
+
+
+def _annotate_gel_worker(job):
+    """Process pool worker: annotate the gel in job, returning a status dict."""
+    start = time.time()
+    status = {'gelfile': job['gelfile'], 'yamlfile': job['yamlfile'], 'status': 'ok', 'rebuilt': None,
+              'svgfile': None, 'pngfile': None, 'seconds': None, 'error': None}
+    info = {}
+    try:
+        _, svgfilename, args = annotate_gel(job['gelfile'], job['args'], yamlfile=job['yamlfile'],
+                                            yamlsettings=job['yamlsettings'], info=info)
+        status['svgfile'], status['pngfile'] = svgfilename, args.get('pngfile')
+        if 'stages' in info:
+            # Incremental mode: report the stages that were (or would be) rebuilt:
+            status['rebuilt'] = " ".join(stage for stage, stage_status in info['stages'].items()
+                                         if stage_status == 'rebuild')
+            if args.get('dry_run'):
+                status['status'] = 'dry-run'
+            elif not status['rebuilt']:
+                status['status'] = 'up-to-date'
+    except Exception:  # pylint: disable=W0703
+        status['status'], status['error'] = 'error', traceback.format_exc()
+    status['seconds'] = time.time() - start
+    return status
+
+
+def group_jobs_by_gel(job_args):
+    """Group the jobs by gel file.
+
+    A gel can have several jobs, e.g. from <gelfile>.gaml and from another yaml file with the same gelfile.
+    The output files (png, svg and annotated png) are named after the gel file (pngfnfmt, svgfnfmt),
+    so these jobs must not run at the same time.
+
+    Returns:
+        List of lists of jobs, one list for each gel file, in the order of job_args.
+    """
+    groups = OrderedDict()
+    for job in job_args:
+        groups.setdefault(os.path.abspath(job['gelfile']), []).append(job)
+    for gelfile, jobs in groups.items():
+        if len(jobs) > 1:
+            logger.warning("Gel %s is annotated by %s config files (%s); these jobs write the same output files "
+                           "and are run one after another.", gelfile, len(jobs),
+                           ", ".join(job['yamlfile'] for job in jobs))
+    return list(groups.values())
+
+
+def _report_status(status, results, n_jobs):
+    """Append the status of a completed job to results and print it."""
+    results.append(status)
+    if status['error'] is not None:
+        logger.error("Error annotating gel %s: %s", status['gelfile'], status['error'])
+        print("ERROR annotating gel %s: %s [%s/%s]" % (
+            status['gelfile'], status['error'].strip().splitlines()[-1], len(results), n_jobs))
+    elif status['status'] == 'dry-run':
+        print("Gel %s: would rebuild: %s [%s/%s]" % (
+            status['gelfile'], status['rebuilt'] or "nothing", len(results), n_jobs))
+    elif status['status'] == 'up-to-date':
+        print("Gel %s is up to date (%.2f s) [%s/%s]" % (
+            status['gelfile'], status['seconds'], len(results), n_jobs))
+    else:
+        print("Annotated gel %s -> %s (%.2f s) [%s/%s]" % (
+            status['gelfile'], status['svgfile'], status['seconds'], len(results), n_jobs))
+
+
+def annotate_gels(job_args, workers=None, reportfile=None):
+    """Annotate gels in a process pool, printing the status of each gel as it completes.
+
+    Jobs for the same gel file are run one after another, see group_jobs_by_gel().
+
+    Args:
+        job_args: list of job dicts, from make_job_args().
+        workers: number of worker processes (default: number of CPUs).
+        reportfile: optional CSV file with gelfile, status, seconds, output files and error for each gel.
+
+    Returns:
+        List of status dicts, one for each gel, in the order they completed.
+    """
+    results = []
+    if not job_args:
+        return results
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        groups = [deque(jobs) for jobs in group_jobs_by_gel(job_args)]
+        pending = {executor.submit(_annotate_gel_worker, jobs.popleft()): jobs for jobs in groups}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                jobs = pending.pop(future)
+                if jobs:
+                    # Next job for the same gel, now that the previous one has finished writing the output files:
+                    pending[executor.submit(_annotate_gel_worker, jobs.popleft())] = jobs
+                _report_status(future.result(), results, len(job_args))
+    logger.info("Annotated %s gels in %.2f s.", len(results), time.time() - start)
+    if reportfile:
+        fields = ['gelfile', 'yamlfile', 'status', 'rebuilt', 'seconds', 'svgfile', 'pngfile', 'error']
+        with open(reportfile, 'w', newline='') as fp:
+            writer = csv.DictWriter(fp, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(results)
+    return results
+
+
+def main(argv=None):
+    """batchannotate command line entry point."""
+    ap = make_parser(prog='batch', description="Annotate many gels in parallel.")
+    ap.prog = 'batchannotate'
+    argns = ap.parse_args(argv)
+    logging.basicConfig(level=argns.loglevel or logging.WARNING)
+    cmdlineargs = vars(argns)
+    defaults = {k: ap.get_default(k) for k in cmdlineargs}
+    user_args = {k: v for k, v in cmdlineargs.items() if v is not None and v != defaults[k]}
+    if cmdlineargs.get('dynamicrange') and cmdlineargs['dynamicrange'][0] == 'auto':
+        user_args['dynamicrange'] = 'auto'
+
+    jobs = find_annotation_jobs(argns.inputs)
+    if not jobs:
+        print("No gel files found in", argns.inputs)
+        return 1
+    base_config = get_base_config(argns.load_system_config, argns.config_template)
+    defaults, user_args = ({k: v for k, v in d.items() if k not in BATCH_OPTIONS} for d in (defaults, user_args))
+    job_args = make_job_args(jobs, defaults=defaults, base_config=base_config, user_args=user_args)
+    print("Annotating %s gels..." % len(job_args))
+    results = annotate_gels(job_args, workers=argns.workers, reportfile=argns.report)
+    n_failed = sum(1 for status in results if status['error'] is not None)
+    print("Done: %s gels annotated, %s failed." % (len(results) - n_failed, n_failed))
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -21,9 +21,14 @@ Default constants and configuration.
 """
 
 import os
+import copy
+import time
+import numpy
 import yaml
 import logging
 
+from . import dirindex
+
 logger = logging.getLogger(__name__)
 
 gel_exts = (".gel", ".tiff", ".tif")
@@ -40,6 +45,31 @@ DEFAULT_CONFIG_FILEPATHS = (
     '~/appdata/gelannotator/gelannotator.yaml',
     '~/.appdata/gelannotator/gelannotator.yaml',
 )
+# Directory for cached intermediate arrays, see arraycache.ArrayCache:
+DEFAULT_ARRAY_CACHE_DIR = '~/.cache/gelannotator/arrays'
+
+# Data type policy for image data, see get_dtype_policy().
+# storage_dtype is used for raw (integer) pixel data, compute_dtype for image calculations
+# (linearization, dynamic range, filters, background subtraction), and accumulate_dtype where accuracy needs it
+# (sums and cumulative sums, e.g. band volumes).
+DEFAULT_STORAGE_DTYPE = 'uint16'
+DEFAULT_COMPUTE_DTYPE = 'float32'
+DEFAULT_ACCUMULATE_DTYPE = 'float64'
+
+
+def get_dtype_policy(args=None):
+    """Return dict with the numpy dtypes to use for image data, given config args.
+
+    The dtypes can be set in args with the keys 'storage_dtype', 'compute_dtype' and 'accumulate_dtype';
+    default values are DEFAULT_STORAGE_DTYPE, DEFAULT_COMPUTE_DTYPE and DEFAULT_ACCUMULATE_DTYPE.
+    """
+    if args is None:
+        args = {}
+    return {
+        'storage_dtype': numpy.dtype(args.get('storage_dtype') or DEFAULT_STORAGE_DTYPE),
+        'compute_dtype': numpy.dtype(args.get('compute_dtype') or DEFAULT_COMPUTE_DTYPE),
+        'accumulate_dtype': numpy.dtype(args.get('accumulate_dtype') or DEFAULT_ACCUMULATE_DTYPE),
+    }
 
 
 def filename_is_yaml(fn):
@@ -47,15 +77,156 @@ def filename_is_yaml(fn):
     return ext in cfg_exts
 
 
+# Config (yaml) I/O:
+# Use libyaml's C loader and dumper if PyYAML was built with libyaml (about 10x faster than the pure-Python ones).
+try:
+    from yaml import CSafeLoader as YamlSafeLoader, CSafeDumper as YamlSafeDumper
+except ImportError:
+    from yaml import SafeLoader as YamlSafeLoader, SafeDumper as YamlSafeDumper
+
+# Parsed yaml files: abspath -> (file signature (size, mtime_ns), file content, parsed data or _UNPARSED, trusted)
+# As for the directory index (see dirindex.RACY_WINDOW), an entry read within RACY_WINDOW seconds of the file's
+# modification time is not trusted: a same-size edit within the mtime resolution (e.g. 2 seconds on FAT/SMB)
+# would not change the signature. For untrusted entries, the file is read again (but only re-parsed if changed).
+_yaml_cache = {}
+_UNPARSED = object()
+
+
+def yaml_load(stream):
+    """Parse yaml from string or stream (safe loader)."""
+    return yaml.load(stream, Loader=YamlSafeLoader)
+
+
+def yaml_dump(data, stream=None):
+    """Dump data as block-style yaml to stream, or return as string if stream is None (safe dumper)."""
+    return yaml.dump(data, stream, Dumper=YamlSafeDumper, default_flow_style=False)
+
+
+def _file_signature(filepath):
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _is_trusted(signature):
+    """Return True if a file with this signature, read now, is older than the racy window."""
+    return time.time() - signature[1]/1e9 > dirindex.RACY_WINDOW
+
+
+def load_yaml(filepath):
+    """Load yaml file, re-using the parsed data if the file has not changed since it was last loaded.
+
+    Returns:
+        The parsed data (a copy, which the caller may modify). None if the file is empty.
+
+    Raises:
+        IOError (FileNotFoundError) if the file could not be read, yaml.error.YAMLError if it could not be parsed.
+    """
+    key = os.path.abspath(filepath)
+    signature = _file_signature(key)
+    cached = _yaml_cache.get(key)
+    if cached is None or cached[0] != signature or not cached[3]:
+        trusted = _is_trusted(signature)
+        with open(key, encoding="utf-8") as fd:
+            content = fd.read()
+        if cached is None or cached[1] != content:
+            cached = (signature, content, _UNPARSED, trusted)
+        else:
+            cached = (signature, content, cached[2], trusted)
+    if cached[2] is _UNPARSED:
+        cached = (cached[0], cached[1], yaml_load(cached[1]), cached[3])
+        logger.debug("yaml file loaded: %s", filepath)
+    _yaml_cache[key] = cached
+    return copy.deepcopy(cached[2])
+
+
 def yaml_get(filepath, default=None):
     """Load yaml from filepath. Return default if file could not be loaded."""
     try:
-        with open(filepath) as fd:
-            data = yaml.safe_load(fd)
-            logger.debug("yaml file loaded: %s", filepath)
+        data = load_yaml(filepath)
     except IOError:
         logger.debug("Could not find/load yaml file %s", filepath)
         data = default
     return data
 
 
+def save_yaml(filepath, data, skip_unchanged=True):
+    """Save data to yaml file filepath (block style).
+
+    Args:
+        filepath: the yaml file.
+        data: dict (or other yaml-serializable data) to save.
+        skip_unchanged: If True (default), the file is not re-written if it already has the same content
+            (or, if the file was loaded with load_yaml, the same parsed data),
+            so the file's modification time is not touched needlessly.
+
+    Returns:
+        True if the file was written, False if it was skipped because it was unchanged.
+    """
+    key = os.path.abspath(filepath)
+    cached = None
+    if skip_unchanged:
+        try:
+            signature = _file_signature(key)
+        except OSError:
+            signature = None
+        cached = _yaml_cache.get(key)
+        if signature is None or cached is None or cached[0] != signature or not cached[3]:
+            cached = None
+        if cached is not None and cached[2] is not _UNPARSED and cached[2] == data:
+            logger.debug("yaml file %s is unchanged; not re-writing it.", filepath)
+            return False
+    content = yaml_dump(data)
+    if skip_unchanged:
+        if cached is None and signature is not None:
+            try:
+                with open(key, encoding="utf-8") as fd:
+                    cached = (signature, fd.read(), _UNPARSED, False)
+            except IOError:
+                pass
+        if cached is not None and cached[1] == content:
+            logger.debug("yaml file %s is unchanged; not re-writing it.", filepath)
+            return False
+    # yaml_dump produces a str output, so the file must be opened in str mode:
+    with open(key, 'w', encoding="utf-8") as fd:
+        fd.write(content)
+    _yaml_cache[key] = (_file_signature(key), content, _UNPARSED, False)
+    logger.debug("yaml file saved: %s", filepath)
+    return True
+
+
+def get_default_config(fncands=None):
+    """Find default user config.
+
+    Locate and load default user config from file.
+    The "system default" config is created by the argument parser).
+
+    Arguments:
+        fncands: Sequence of potential filenames to search for user config.
+
+    Returns:
+        2-Tuple with (filename, config), where:
+            filename is the config file that was found first, and
+            config is a dict with user config or None if no default config files were found.
+    """
+    # Load default user config
+    if fncands is None:
+        fncands = DEFAULT_CONFIG_FILEPATHS
+
+    for fn in fncands:
+        # Check the cached directory listing first, so missing candidates do not cost a file system request each:
+        if not dirindex.isfile(os.path.expanduser(fn)):
+            logger.debug("Config cand not found (continuing search): %s", fn)
+            continue
+        try:
+            default_config = load_yaml(os.path.expanduser(fn))
+        except (IOError, FileNotFoundError):
+            # Note: logging is not initialized, so won't print anything, this is for dev debug..
+            logger.debug("Config cand not found (continuing search): %s", fn)
+            continue
+        except yaml.error.YAMLError:
+            logger.info("YAMLError, could not parse file content (continuing search): %s", fn)
+            print("WARNING: YAML could not parse the content of default config file %s." % fn)
+            continue
+        else:
+            return fn, default_config
+    return None, None
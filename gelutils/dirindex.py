@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Cached directory listings for file discovery (annotations files, config files, existing png files).
+
+Looking for files by trying candidate names with os.path.isfile() and glob.glob() costs one metadata
+request per candidate (and a full directory listing per glob pattern). On network shares (SMB/NFS) with
+thousands of files per folder, these requests dominate the run time of batch annotation.
+
+DirectoryIndex keeps a snapshot of each directory's file names (from a single os.scandir), and answers
+isfile() and glob() queries from memory. A snapshot is re-used as long as the directory's modification time
+is unchanged, so each query costs at most one stat of the directory.
+Directory mtimes may have a coarse resolution (e.g. 2 seconds on FAT/SMB), so a file created right after
+the listing might not change the mtime. Snapshots taken within RACY_WINDOW seconds of the directory's mtime
+are therefore not trusted, and the directory is listed again on the next query.
+
+Usage:
+    >>> from gelutils import dirindex
+    >>> dirindex.isfile('scans/gel1.annotations.txt')
+    >>> dirindex.glob('scans/gel1*.txt')
+
+"""
+
+import os
+import time
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+RACY_WINDOW = 2.0  # seconds
+
+
+class DirectoryIndex(object):
+    """In-memory snapshot of directory listings, validated by the directory modification time."""
+
+    def __init__(self):
+        # dirpath -> (dir mtime_ns, trusted, tuple of file names in listing order)
+        self._listings = {}
+        self.hits, self.misses = 0, 0
+
+    def listing(self, dirpath):
+        """Return tuple with the names of the files (not directories) in dirpath, in os.scandir order.
+
+        Returns an empty tuple if dirpath does not exist.
+        """
+        dirpath = os.path.abspath(dirpath or os.curdir)
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError:
+            self._listings.pop(dirpath, None)
+            return ()
+        cached = self._listings.get(dirpath)
+        if cached is not None and cached[0] == mtime and cached[1]:
+            self.hits += 1
+            return cached[2]
+        self.misses += 1
+        try:
+            with os.scandir(dirpath) as entries:
+                names = tuple(entry.name for entry in entries if entry.is_file())
+        except OSError as e:
+            logger.debug("Could not list directory %s: %s", dirpath, e)
+            self._listings.pop(dirpath, None)
+            return ()
+        trusted = time.time() - mtime/1e9 > RACY_WINDOW
+        self._listings[dirpath] = (mtime, trusted, names)
+        return names
+
+    def isfile(self, filepath):
+        """Return True if filepath is an existing file (like os.path.isfile)."""
+        dirpath, name = os.path.split(filepath)
+        if not name:
+            return False
+        if os.path.normcase('A') == 'a':
+            # Case-insensitive file system (Windows):
+            name = os.path.normcase(name)
+            return any(os.path.normcase(fn) == name for fn in self.listing(dirpath))
+        return name in self.listing(dirpath)
+
+    def glob(self, pattern):
+        """Return list of files matching pattern (like glob.glob), in directory listing order.
+
+        Only the file name part of pattern may contain wildcards. As with glob.glob,
+        files starting with '.' are only matched if the pattern starts with '.'.
+        """
+        dirpath, namepat = os.path.split(pattern)
+        hidden = namepat.startswith('.')
+        return [os.path.join(dirpath, fn) for fn in self.listing(dirpath)
+                if (hidden or not fn.startswith('.')) and fnmatch.fnmatch(fn, namepat)]
+
+    def invalidate(self, dirpath=None):
+        """Forget the snapshot of dirpath, or of all directories if dirpath is None."""
+        if dirpath is None:
+            self._listings.clear()
+        else:
+            self._listings.pop(os.path.abspath(dirpath or os.curdir), None)
+
+
+# Shared index, used by the module-level functions:
+default_index = DirectoryIndex()
+
+
+def isfile(filepath):
+    """Return True if filepath is an existing file, using the shared directory index."""
+    return default_index.isfile(filepath)
+
+
+def glob(pattern):
+    """Return list of files matching pattern, using the shared directory index."""
+    return default_index.glob(pattern)
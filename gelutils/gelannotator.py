@@ -38,8 +38,7 @@ See:
 
 from __future__ import print_function, absolute_import
 import os
-import glob
-import yaml
+import io
 from yaml.representer import RepresenterError
 import base64
 from itertools import chain
@@ -56,7 +55,12 @@ from .utils import (gen_trimmed_lines, trimmed_lines_from_file, init_logging,
 from .argutils import parseargs  # , make_parser
 from .geltransformer import convert
 from .imageconverter import svg2png
-from .config import config_ext
+from .config import config_ext, load_yaml, save_yaml
+from . import dirindex
+from .lane_detection import find_lane_positions
+from .raster_annotation import save_annotated_pngs, SVG_DPI
+from .incremental import (STAGES, PNG_STAGE_ARGS, SVG_STAGE_ARGS, SVGTOPNG_STAGE_ARGS,
+                          stage_fingerprint, stage_is_current, make_stage_record)
 from . import __version__
 
 # Constants:
@@ -106,6 +110,7 @@ def find_annotationsfilepath(filenames, rel=False, fallback=True):
     # First search for files with a name similar to the gelfile, then search for standard annotation filenames:
     # use glob() or direct isfile()?
     # - glob uses unix style wildcards - these includes bracket groups [1-9], so patterns with [SYBR Gold] won't work!
+    # Both are answered from the cached directory listing (dirindex), not the file system.
     # search_ext = ("*.annotations.txt", "*.txt", "*.lanes.yml")
     search_ext = [".annotations.txt", ".txt", ".lanes.yml"]
     std_pats = ['samples.txt', 'annotations.txt']
@@ -116,12 +121,12 @@ def find_annotationsfilepath(filenames, rel=False, fallback=True):
     logger.debug("fn_pats: %s", fn_cands)
     logger.debug("glob_pats: %s", glob_pats)
     for fn_cand in fn_cands:
-        if os.path.isfile(fn_cand):
+        if dirindex.isfile(fn_cand):
             ann_fn = fn_cand
             break
     else:
         try:
-            ann_fn = next(fn for fn in chain(*(glob.glob(pat) for pat in glob_pats)))
+            ann_fn = next(fn for fn in chain(*(dirindex.glob(pat) for pat in glob_pats)))
         except StopIteration:
             logger.debug("None of the file patterns in search_pats matched any file, using fallback: %s", fallback)
             if fallback:
@@ -133,6 +138,20 @@ def find_annotationsfilepath(filenames, rel=False, fallback=True):
     return ann_fn
 
 
+def find_stage_annotationsfile(gelfile, args, annotationsfile=None):
+    """Return the annotations file that make_svg would use for gelfile (actual path), or None if there is none.
+
+    Used to include the annotations file in the svg stage fingerprint (incremental mode).
+    """
+    annotationsfile = annotationsfile or args.get('annotationsfile')
+    if annotationsfile:
+        return getabsfilepath(gelfile, annotationsfile)
+    try:
+        return find_annotationsfilepath([gelfile], fallback=False)
+    except ValueError:
+        return None
+
+
 # def asterix_line_trimming(annotation_lines, remove_asterix='first_only', require_asterix=False):
 #     """
 #     Removes asterix from lines. Useful if you have a
@@ -182,13 +201,141 @@ def get_annotations(args=None, annotationsfile=None, gelfile=None):
 
     # We have a filepath with annotations:
     if os.path.splitext(annotationsfile)[1].lower() == '.yml':
-        laneannotations = yaml.load(open(annotationsfile))
+        laneannotations = load_yaml(annotationsfile)
     else:
         laneannotations = trimmed_lines_from_file(annotationsfile, args)
     return laneannotations, annotationsfile
 
 
-def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yamlfile=None, **kwargs):
+def is_auto(value):
+    """Return True if value is 'auto' (or a list with the single element 'auto', e.g. from the command line)."""
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        value = value[0]
+    return isinstance(value, str) and value.strip().lower() == 'auto'
+
+
+def extend_lane_positions(lane_xpositions, n_lanes):
+    """Return list of n_lanes x-positions from lane_xpositions.
+
+    If there are too many positions, the extra positions are ignored; if there are too few,
+    the positions are extrapolated using the mean spacing.
+    """
+    lane_xpositions = list(lane_xpositions)
+    if len(lane_xpositions) != n_lanes:
+        logger.warning("Got %s lane x-positions for %s lane annotations.", len(lane_xpositions), n_lanes)
+    if len(lane_xpositions) >= n_lanes:
+        return lane_xpositions[:n_lanes]
+    if len(lane_xpositions) >= 2:
+        spacing = (lane_xpositions[-1] - lane_xpositions[0])/(len(lane_xpositions) - 1)
+    else:
+        spacing = 0
+    last = lane_xpositions[-1]
+    return lane_xpositions + [last + spacing*(i+1) for i in range(n_lanes - len(lane_xpositions))]
+
+
+def annotation_layout(args, imgwidth, imgheight, laneannotations, pngimage=None):
+    """Calculate the position of the gel image and lane annotations (in pixels).
+
+    The layout is shared by the svg (make_svg) and raster (raster_annotation) renderers.
+
+    Args:
+        args: dict with annotation args (xmargin, xspacing, lane_xpositions, yoffset, ypadding,
+            xtraspaceright, textfmt, laneidxstart, textrotation, fontsize, fontfamily, fontweight).
+        imgwidth, imgheight: size of the gel (png) image.
+        laneannotations: list of lane annotations.
+        pngimage: the gel (png) image, only required if xmargin is 'auto'.
+
+    Returns:
+        dict with width and height of the annotated image, the yoffset of the gel image, the ypadding,
+        lane_xpositions and texts (the formatted lane annotations), and the text settings
+        textrotation, fontsize, fontfamily and fontweight.
+    """
+    lane_xpositions = args.get('lane_xpositions')
+    if not lane_xpositions and is_auto(args['xmargin']):
+        lane_xpositions = find_lane_positions(pngimage, n_lanes=len(laneannotations)).tolist()
+        logger.info("Auto-detected lane x-positions: %s", lane_xpositions)
+
+    # Convert any relative values (fractions, percentage):
+    ypad, yoff = ensure_numeric([args['ypadding'], args['yoffset']], imgheight)
+
+    # convert relative values ('5%' or 0.05) to absolute image values:
+    if lane_xpositions:
+        lane_xpositions = ensure_numeric(lane_xpositions, imgwidth, converter=float)
+        lane_xpositions = extend_lane_positions(lane_xpositions, len(laneannotations))
+        logger.debug("lane_xpositions: %s", lane_xpositions)
+    else:
+        xmargin = ensure_numeric(args['xmargin'], imgwidth)
+        # Consider deprechating xspacing argument; I only ever use xmargin.
+        # Number of spaces is 1 less than number of lanes.
+        xspacing = (imgwidth-sum(xmargin))/(len(laneannotations)-1) if not args.get('xspacing') else args['xspacing']
+        lane_xpositions = [xmargin[0]+xspacing*idx for idx in range(len(laneannotations))]
+        logger.debug("xmargin: %s", xmargin)
+        logger.debug("xspacing: %s", xspacing)
+    xtra_right = ensure_numeric(args['xtraspaceright'], imgwidth)
+
+    texts = [args['textfmt'].format(idx=idx+args['laneidxstart'], name=annotation)
+             for idx, annotation in enumerate(laneannotations)]
+    return dict(width=imgwidth+xtra_right, height=imgheight+yoff, imgwidth=imgwidth, imgheight=imgheight,
+                yoffset=yoff, ypadding=ypad, lane_xpositions=lane_xpositions, texts=texts,
+                textrotation=args['textrotation'], fontsize=args['fontsize'],
+                fontfamily=args['fontfamily'], fontweight=args['fontweight'])
+
+
+# Embedded image data is base64-encoded in chunks of EMBED_CHUNK_LINES lines of 57 bytes (76 base64 characters),
+# so each chunk encodes to complete lines and the chunks join to the same text as base64.encodebytes(data).
+EMBED_CHUNK_LINES = 16384
+EMBED_PLACEHOLDER = "__GELUTILS_EMBEDDED_IMAGE_DATA__"
+
+
+def iter_base64_chunks(data=None, filepath=None, chunk_lines=None):
+    """Generate the base64 encoding of data (bytes) or the content of filepath, one chunk at a time.
+
+    The concatenated chunks are identical to base64.encodebytes(data), but only a single chunk
+    (about 1 MB with the default chunk_lines, EMBED_CHUNK_LINES) of encoded data is held in memory at a time.
+    """
+    chunk_size = 57*(chunk_lines or EMBED_CHUNK_LINES)
+    if data is not None:
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            yield base64.encodebytes(view[start:start+chunk_size])
+        return
+    with open(filepath, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            yield base64.encodebytes(chunk)
+
+
+def write_svg(dwg, svgfilename, datachunks=None):
+    """Write drawing to svgfilename, streaming embedded image data into the file.
+
+    Args:
+        dwg: svgwrite Drawing. If datachunks is given, the drawing must have an image with
+            EMBED_PLACEHOLDER in its href, which is replaced by the data chunks in the output.
+        svgfilename: the output svg file.
+        datachunks: iterable of base64-encoded (bytes) chunks, e.g. from iter_base64_chunks().
+
+    Returns:
+        The svg document (str), or None if image data was streamed into the file.
+
+    The output is identical to dwg.save() with the image data in the href.
+    """
+    buf = io.StringIO()
+    dwg.write(buf)
+    svgdata = buf.getvalue()
+    with open(svgfilename, 'w', encoding='utf-8') as fp:
+        if datachunks is None:
+            fp.write(svgdata)
+            return svgdata
+        head, tail = svgdata.split(EMBED_PLACEHOLDER)
+        fp.write(head)
+        for chunk in datachunks:
+            # The same escaping of newlines as used by svgwrite (ElementTree) for attribute values:
+            fp.write(chunk.decode('ascii').replace('\n', '&#10;'))
+        fp.write(tail)
+    return None
+
+
+def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yamlfile=None,
+             pngimage=None, pngdata=None, return_svgdata=False, info=None, **kwargs):
     """Creates SVG file with lane annotations overlayed over the gel.
 
     Arguments:
@@ -197,15 +344,31 @@ def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yam
         annotationsfile : file with lane annotations (only used if laneannotations is None).
         laneannotations : list of lane annotations.
         yamlfile: May be used if svgfilename format makes use of it.
+        pngimage: The (PIL) image in args['pngfile'], if already loaded, e.g. from convert().
+            Used for the image size (and lane detection) instead of opening the png file.
+        pngdata: The encoded data of args['pngfile'], if available, e.g. from convert(return_encoded=True).
+            Used when embedding the image instead of reading the png file.
+        return_svgdata: If True, also return the SVG document as a string,
+            e.g. for svg2png(svgfilename, svgdata=svgdata) without re-reading the svg file.
+            Embedded image data is streamed into the svg file and not kept in memory,
+            so svgdata is None if the image is embedded.
+        info: Optional dict, which is updated with the annotation 'layout' (see annotation_layout)
+            and the 'pngfile' (path) that was annotated, e.g. for raster_annotation.save_annotated_pngs().
+
+    Returns:
+        2-tuple of (drawing, svgfilename), or 3-tuple of (drawing, svgfilename, svgdata) if return_svgdata is True.
 
     annotationsfile and laneannotations specifically not kwargs and defaultargs;
 
     We dont want to add this to args if it was not present there already.
     Supported keyword arguments:
-    gelfile, laneannotations, xmargin, xspacing, yoffset, ypadding, textfmt, laneidxstart,
+    gelfile, laneannotations, xmargin, xspacing, lane_xpositions, yoffset, ypadding, textfmt, laneidxstart,
     yamlfile, embed, png, xtraspaceright, textrotation, fontsize, fontfamily, fontweight
 
     ypadding: vertical space between annotations and gel.
+    xmargin: left, right margin of the first and last lane annotation, or 'auto' to detect
+        the lane positions from the gel image (see lane_detection.find_lane_positions).
+    lane_xpositions: list with the x-position of each lane annotation; overrides xmargin and xspacing.
 
     precedence scheme:
         kwargs over argns over defaultargs
@@ -269,17 +432,17 @@ def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yam
         logger.warning("args is: {%s}", printdict(args))
         raise TypeError("Could not determine pngfile version of gel image.")
 
-    # Get size of png image:
-    pngimage = Image.open(pngfile_actual)
+    # Get size of png image (only opening the png file if we don't already have the image):
+    close_pngimage = pngimage is None
+    if pngimage is None:
+        pngimage = Image.open(pngfile_actual)
     imgwidth, imgheight = pngimage.size
-    pngimage.fp.close()
-
-    # Convert any relative values (fractions, percentage):
-    ypad, yoff = ensure_numeric([args['ypadding'], args['yoffset']], imgheight)
-
-    # convert relative values ('5%' or 0.05) to absolute image values:
-    xmargin = ensure_numeric(args['xmargin'], imgwidth)
-    xtra_right = ensure_numeric(args['xtraspaceright'], imgwidth)
+    layout = annotation_layout(args, imgwidth, imgheight, laneannotations, pngimage=pngimage)
+    if close_pngimage:
+        pngimage.close()
+    yoff, ypad = layout['yoffset'], layout['ypadding']
+    if info is not None:
+        info.update(layout=layout, pngfile=pngfile_actual)
 
     ext = '.svg'
     svgfnfmt = args.get('svgfnfmt', "{pngfnroot}_annotated{ext}")
@@ -288,8 +451,8 @@ def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yam
     svgfilename = svgfnfmt.format(pngfnroot=pngfnroot, gelfnroot=gelfnroot, ext=ext,
                                   lanefnroot=lanefnroot, yamlfnroot=yamlfnroot)
     svgfilename = os.path.join(folderpath, svgfilename)
-    size = dict(width="{}px".format(imgwidth+xtra_right),
-                height="{}px".format(imgheight+yoff))
+    size = dict(width="{}px".format(layout['width']),
+                height="{}px".format(layout['height']))
     # Apparently, setting width, height (using **size) cannot be done on instantiation:
     dwg = svgwrite.Drawing(svgfilename, profile='tiny')
     dwg.attribs.update(size)
@@ -300,17 +463,17 @@ def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yam
     # xlink:href is first argument 'href'.
     # width="100%" height="100%" or  width="524" height="437" ?
     # additional image attribs: overflow, width, height, transform
+    datachunks = None
     if args.get('embed', True):
-        filedata = open(pngfile_actual, 'rb').read()
-        # when you DECODE, the length of the base64 encoded data should be a multiple of 4.
-        datab64 = base64.encodebytes(filedata)
+        # The base64 image data is streamed into the svg file by write_svg(), in place of EMBED_PLACEHOLDER:
+        datachunks = iter_base64_chunks(data=pngdata, filepath=pngfile_actual)
         # See http://www.askapache.com/online-tools/base64-image-converter/ for info:
         mimebyext = {'.jpg': 'image/jpeg',
                      '.jpeg': 'image/jpeg',
                      '.png': 'image/png'}
         mimetype = mimebyext[pngext]
         logger.debug("Embedding data from %s into svg file.", pngfile_actual)
-        imghref = "data:"+mimetype+";base64,"+datab64.decode()
+        imghref = "data:"+mimetype+";base64,"+EMBED_PLACEHOLDER
     else:
         imghref = pngfile_relative
         logger.debug("Linking to png file %s in svg file.", pngfile_actual)
@@ -320,25 +483,20 @@ def make_svg(gelfile, args=None, annotationsfile=None, laneannotations=None, yam
     # Add annotations to svg drawing object:
     g2 = dwg.add(dwg.g(id='Annotations'))   # Make annotations group
 
-    # Consider deprechating xspacing argument; I only ever use xmargin.
-    # Number of spaces is 1 less than number of lanes.
-    xspacing = (imgwidth-sum(xmargin))/(len(laneannotations)-1) if not args.get('xspacing') else args['xspacing']
-
-    logger.debug("xmargin: %s", xmargin)
-    logger.debug("xspacing: %s", xspacing)
-
-    for idx, annotation in enumerate(laneannotations):
-        text = g2.add(dwg.text(args['textfmt'].format(idx=idx+args['laneidxstart'], name=annotation)))
+    for label, xpos in zip(layout['texts'], layout['lane_xpositions']):
+        text = g2.add(dwg.text(label))
         for att in ('font-size', 'font-family', 'font-weight'):
             argkey = att.replace('-', '')
-            if args[argkey]:
-                text.attribs[att] = args[argkey]
-        text.translate(tx=xmargin[0]+xspacing*idx, ty=yoff-ypad)
-        text.rotate(-args['textrotation'])  # Negative rotation, because that is the most intuitive.
+            if layout[argkey]:
+                text.attribs[att] = layout[argkey]
+        text.translate(tx=xpos, ty=yoff-ypad)
+        text.rotate(-layout['textrotation'])  # Negative rotation, because that is the most intuitive.
 
-    dwg.save()
+    svgdata = write_svg(dwg, svgfilename, datachunks=datachunks)
     logger.info("Annotated gel saved to file: %s", svgfilename)
 
+    if return_svgdata:
+        return dwg, svgfilename, svgdata
     return dwg, svgfilename
 
 
@@ -355,7 +513,8 @@ def ensure_png_exists(gelfile, args, yamlfile=None, lanefile=None):
         lanefile: The annotationsfile with gel/lane annotations.
 
     Returns:
-        None (no return value)
+        None if no conversion was needed, otherwise the 3-tuple (image, info, encoded_bytes)
+        from convert(..., return_encoded=True), which can be passed on to make_svg().
 
     Raises:
         ValueError if gelfile extension is not recognized.
@@ -371,30 +530,30 @@ def ensure_png_exists(gelfile, args, yamlfile=None, lanefile=None):
         # Hmm... it might be nicer to allow rotation of an existing png image, not only .gel files?
         if any(args.get(k) for k in ('invert', 'crop', 'rotate')):
             logger.debug("invert, crop or rotate requested; performing conversion even if gelfile is PNG...")
-            convert(gelfile, args, yamlfile, lanefile)
+            return convert(gelfile, args, yamlfile, lanefile, return_encoded=True)
         elif not args.get('reusepng', True):
             pass    #
-        return
+        return None
     if args.get('pngfile') and args.get('reusepng', True):
         # We have a png file and want to re-use it and not re-generate it:
-        return
+        return None
 
     if gelext.lower() == '.gel':
         # convert gel to png:
         args.setdefault('convertgelto', 'png')
         logger.info("ensure_png_exists: Converting %s to png...", gelfile)
-        convert(gelfile, args, yamlfile, lanefile)   # convert will update args['pngfile']
+        return convert(gelfile, args, yamlfile, lanefile, return_encoded=True)   # convert will update args['pngfile']
     elif gelext.lower() in ('.tif', '.tiff'):
         # convert tif to png:
         if args.get('linearize') is None:  # set sane default
             args['linearize'] = False
         args.setdefault('convertgelto', 'png')
-        convert(gelfile, args, yamlfile, lanefile)
+        return convert(gelfile, args, yamlfile, lanefile, return_encoded=True)
     else:
         raise ValueError("gelfile extension not recognized. Recognized extensions are: .gel, .png, .jpg.")
 
 
-def annotate_gel(gelfile=None, args=None, yamlfile=None, annotationsfile=None):
+def annotate_gel(gelfile=None, args=None, yamlfile=None, annotationsfile=None, yamlsettings=None, info=None):
     """Annotate gel according to the given configuraiton args.
 
     This function is the primary function in charge of annotating gel files.
@@ -409,10 +568,20 @@ def annotate_gel(gelfile=None, args=None, yamlfile=None, annotationsfile=None):
         gelfile: main gelfile.
         annotationsfile: file with annotations. Is this actual or relative to gelfile? - Relative.
         yamlfile: file with options in yaml format. Is this actual or relative to gelfile? - Relative.
+        yamlsettings: the content of yamlfile, if already loaded (e.g. by batchannotator);
+            if given, yamlfile is not read again.
+        info: optional dict, updated with 'stages', a dict with the status ('rebuild' or 'up-to-date')
+            of each stage, if args['incremental'] or args['dry_run'] is set.
+
+    Incremental mode:
+        If args['incremental'] is true, each stage is only run if its inputs have changed since the last run,
+        using the stage fingerprints saved in the yaml file, see incremental.py.
+        If args['dry_run'] is true, the stages that would be rebuilt are determined (and added to info),
+        but nothing is run or written, and (None, None, args) is returned.
 
     Returns:
         A 3-tuple with:
-            drawing,
+            drawing (None if the svg stage was up to date),
             svgfilename,
             args - updated args dict with anything that may have been changed as a result of the run.
 
@@ -427,11 +596,14 @@ def annotate_gel(gelfile=None, args=None, yamlfile=None, annotationsfile=None):
         yamlfile = args.get('yamlfile')  # Do not update.
     if annotationsfile is None:
         annotationsfile = args.get('annotationsfile')
-    if yamlfile:
+    if yamlfile and yamlsettings is not None:
+        yamlfile = getabsfilepath(gelfile, yamlfile)
+        args.update(mergedicts(yamlsettings, args))
+    elif yamlfile:
         yamlfile = getabsfilepath(gelfile, yamlfile)
         try:
             logger.debug("Loading additional settings (those not already specified) from file: %s", yamlfile)
-            yamlsettings = yaml.safe_load(open(yamlfile))
+            yamlsettings = load_yaml(yamlfile)
             # for key, value in settings.items():
             #    setattr(argns, key, value)
             # Make sure to update in-place:
@@ -453,28 +625,118 @@ def annotate_gel(gelfile=None, args=None, yamlfile=None, annotationsfile=None):
     # but we then save yaml file under a different name.
     args['gelfile_last_used'] = gelfile
 
-    # args = mergeargs(argsns=args, argsdict=yamlsettings, excludeNone=True, precedence='argns')
-    logger.debug("Ensuring that we have a PNG file to annotate using ensure_png_exists(%s, ...). "
-                 "If a PNG file is not available, or if args['reusepng'] is false, "
-                 "then a PNG file will be generated from the GEL file.", gelfile)
-    ensure_png_exists(gelfile, args, yamlfile=yamlfile, lanefile=annotationsfile)
-    # Note: args is updated in-place. yamlfile and lanefile is only used to generate pngfilename.
+    # Incremental mode: Only re-run stages whose inputs have changed, see incremental.py
+    incremental = args.get('incremental') or args.get('dry_run')
+    records = dict(args.get('stage_fingerprints') or {})
+    stages = {}
+    if incremental and info is not None:
+        info['stages'] = stages
+
+    # PNG STAGE: #
+    if incremental:
+        png_fingerprint = stage_fingerprint('png', args, PNG_STAGE_ARGS, files=[gelfile])
+        png_current = stage_is_current(records.get('png'), png_fingerprint, gelfile)
+        stages['png'] = 'up-to-date' if png_current else 'rebuild'
+    if incremental and png_current:
+        logger.debug("PNG stage is up to date, re-using png file %s", records['png']['output'])
+        args['pngfile'] = records['png']['output']
+        converted = None
+    elif args.get('dry_run'):
+        converted = None
+    else:
+        # args = mergeargs(argsns=args, argsdict=yamlsettings, excludeNone=True, precedence='argns')
+        logger.debug("Ensuring that we have a PNG file to annotate using ensure_png_exists(%s, ...). "
+                     "If a PNG file is not available, or if args['reusepng'] is false, "
+                     "then a PNG file will be generated from the GEL file.", gelfile)
+        reusepng = args.get('reusepng')
+        if incremental:
+            # The png file is out of date, so it should not be re-used:
+            args['reusepng'] = False
+        try:
+            converted = ensure_png_exists(gelfile, args, yamlfile=yamlfile, lanefile=annotationsfile)
+        finally:
+            if incremental:
+                args['reusepng'] = reusepng
+        # Note: args is updated in-place. yamlfile and lanefile is only used to generate pngfilename.
+        if incremental:
+            records['png'] = make_stage_record(
+                [png_fingerprint, stage_fingerprint('png', args, PNG_STAGE_ARGS, files=[gelfile])],
+                getabsfilepath(gelfile, args.get('pngfile') or gelfile), gelfile)
+    # The converted image and its encoded file data are passed on in memory, so the png file is not re-read:
+    pngimage, _, pngdata = converted if converted else (None, None, None)
+
+    # Stage fingerprints for the svg and svgtopng stages; if the png stage is rebuilt, so are the following stages.
+    if incremental:
+        if stages['png'] == 'rebuild' and args.get('dry_run'):
+            svg_current = svgtopng_current = False
+        else:
+            svg_files = [getabsfilepath(gelfile, args.get('pngfile') or gelfile),
+                         find_stage_annotationsfile(gelfile, args, annotationsfile)]
+            svg_fingerprint = stage_fingerprint('svg', args, SVG_STAGE_ARGS, files=svg_files)
+            svg_current = not args.get('fromclipboard') and stage_is_current(records.get('svg'), svg_fingerprint,
+                                                                             gelfile)
+            svgtopng_current = svg_current and stage_is_current(
+                records.get('svgtopng'),
+                stage_fingerprint('svgtopng', args, SVGTOPNG_STAGE_ARGS,
+                                  files=[getabsfilepath(gelfile, records['svg']['output'])]),
+                gelfile)
+        if args.get('svgtopng') and not svgtopng_current:
+            # Rendering the annotated png requires the annotation layout (or svg data) from make_svg:
+            svg_current = False
+        stages['svg'] = 'up-to-date' if svg_current else 'rebuild'
+        if args.get('svgtopng'):
+            stages['svgtopng'] = 'up-to-date' if svgtopng_current else 'rebuild'
+        logger.info("Incremental annotation of %s: %s", gelfile,
+                    ", ".join("%s: %s" % (stage, stages[stage]) for stage in STAGES if stage in stages))
+        if args.get('dry_run'):
+            return None, None, args
 
     # MAKE SVG FILE WITH ANNOTATIONS: #
-    # annotationsfile is relative to gelfile; make_svg takes care of it.
-    logger.debug("Making annotated SVG file using make_svg(%s, ...)", gelfile)
-    dwg, svgfilename = make_svg(gelfile, args, annotationsfile=annotationsfile, yamlfile=yamlfile)
+    svginfo = {}
+    if incremental and svg_current:
+        logger.debug("SVG stage is up to date, re-using svg file %s", records['svg']['output'])
+        dwg, svgdata = None, None
+        svgfilename = getabsfilepath(gelfile, records['svg']['output'])
+    else:
+        # annotationsfile is relative to gelfile; make_svg takes care of it.
+        logger.debug("Making annotated SVG file using make_svg(%s, ...)", gelfile)
+        dwg, svgfilename, svgdata = make_svg(gelfile, args, annotationsfile=annotationsfile, yamlfile=yamlfile,
+                                             pngimage=pngimage, pngdata=pngdata, return_svgdata=True, info=svginfo)
+        if incremental:
+            records['svg'] = make_stage_record(
+                [svg_fingerprint, stage_fingerprint('svg', args, SVG_STAGE_ARGS, files=svg_files)],
+                svgfilename, gelfile)
 
     # Convert SVG to PNG: #
-    if args.get('svgtopng'):
+    if incremental and args.get('svgtopng') and svgtopng_current:
+        logger.debug("svgtopng stage is up to date, re-using png file %s", records['svgtopng']['output'])
+        svg2pngfn = getabsfilepath(gelfile, records['svgtopng']['output'])
+    elif args.get('svgtopng') and (args.get('svgtopng_renderer') or 'raster') == 'raster':
+        # Draw the annotations directly onto the gel image, using the same layout as the svg file:
+        svg2pngfn = os.path.splitext(svgfilename)[0] + '.png'
+        logger.debug("Rendering annotated png file %s using save_annotated_pngs()", svg2pngfn)
+        image = pngimage if pngimage is not None else Image.open(svginfo['pngfile'])
+        try:
+            pngfiles = save_annotated_pngs(image, svginfo['layout'], svg2pngfn,
+                                           dpis=args.get('svgtopng_dpi') or SVG_DPI)
+        finally:
+            if image is not pngimage:
+                image.close()
+        svg2pngfn = os.path.abspath(pngfiles[0])
+    elif args.get('svgtopng'):
         # svg's base64 encoding is not as optimal as a native file but about 40-50% larger.
         # Thus, it might be nice to be able to export
         # print "PNG export not implemented. Requires Cairo."
         # svg2pngfn = args['svgtopngfile'] = svg2png(svgfilename)
         logger.debug("Converting svg to png using svg2png(%s)", svgfilename)
-        svg2pngfn = svg2png(svgfilename)    # not saving svgtopngfile in args...
+        svg2pngfn = svg2png(svgfilename, svgdata=svgdata)    # not saving svgtopngfile in args...
     else:
         svg2pngfn = None
+    if incremental and args.get('svgtopng') and not svgtopng_current:
+        records['svgtopng'] = make_stage_record(
+            [stage_fingerprint('svgtopng', args, SVGTOPNG_STAGE_ARGS, files=[svgfilename])], svg2pngfn, gelfile)
+    if incremental:
+        args['stage_fingerprints'] = records
 
     # Open file: #
     if args.get('openwebbrowser'):
@@ -513,22 +775,21 @@ def annotate_gel(gelfile=None, args=None, yamlfile=None, annotationsfile=None):
 
         # Not sure if this should be done here or in AnnotateGel GUI app:
         logger.debug("Saving final config parameters to file: %s", final_params_fn)
-        # For Python3 it is important that the file mode is correct: binary vs str
-        # yaml safe_dump produces a str output, so the file must be opened in str mode:
-        with open(final_params_fn, 'w') as fd:
-            # Call signature: yaml.dump_all(documents, stream=None, Dumper=<class 'yaml.dumper.Dumper'>,
-            # default_style=None, default_flow_style=None, canonical=None, indent=None, width=None,
-            # allow_unicode=None, line_break=None, encoding='utf-8', explicit_start=None, explicit_end=None,
-            # version=None, tags=None)
-            try:
-                yaml.safe_dump(args, fd, default_flow_style=False)
-            except RepresenterError as e:
-                logger.warning("yaml.representer.RepresenterError: %s. args is: %s", e, args)
-                raise
+        # save_yaml only writes the file if the content has changed:
+        try:
+            save_yaml(final_params_fn, args)
+        except RepresenterError as e:
+            logger.warning("yaml.representer.RepresenterError: %s. args is: %s", e, args)
+            raise
     else:
+        final_params_fn = None
         args['gelfile_last_used'] = gelfile
         args['yamlfile_last_used'] = yamlfile
         args['annotationsfile_last_used'] = annotationsfile
+    if incremental and yamlfile and final_params_fn != yamlfile:
+        # The stage fingerprints are always saved in the gel's yaml file, so the next run can find them:
+        logger.debug("Saving stage fingerprints to file: %s", yamlfile)
+        save_yaml(yamlfile, dict(yamlsettings or {}, stage_fingerprints=records))
 
     return dwg, svgfilename, args
 
@@ -540,6 +801,10 @@ if __name__ == '__main__':
     argns = parseargs()
     cmd_gelfile = argns.gelfile
 
-    drawing, svgfn, updatedargs = annotate_gel(cmd_gelfile, argns)
+    runinfo = {}
+    drawing, svgfn, updatedargs = annotate_gel(cmd_gelfile, argns, info=runinfo)
+    if updatedargs.get('dry_run'):
+        print("Stages that would be rebuilt:", ", ".join(
+            "%s: %s" % (stage, status) for stage, status in runinfo['stages'].items()))
     if drawing:
         print("Annotated svg saved as:", drawing.filename)
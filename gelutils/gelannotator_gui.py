@@ -38,7 +38,6 @@ from __future__ import print_function, absolute_import
 import sys
 import os
 import locale
-import yaml
 import webbrowser
 from datetime import datetime
 from six import string_types
@@ -52,7 +51,7 @@ from .argutils import parseargs, make_parser
 from .utils import init_logging, getrelfilepath, getabsfilepath, printdict, mergedicts
 from .tkui.gelannotator_tkroot import GelAnnotatorTkRoot
 from .config import DEFAULT_CONFIG_FILEPATHS, gel_exts, img_exts, cfg_exts
-from .config import filename_is_yaml
+from .config import filename_is_yaml, get_default_config, load_yaml, yaml_load, yaml_dump
 
 # flush keyword only supported for python 3.3+, so create custom print function:
 # Edit: Instead of modifying print to accept flush keyword, just make sure to use line-buffering for file objects
@@ -323,9 +322,8 @@ class GelAnnotatorApp(object):   # pylint: disable=R0904
         # default_config = yaml_get(default_config_file, {}) if default_config_file else {}
         # yamlconfig = yaml_get(fn, default_config)
         try:
-            with open(filepath, encoding="utf-8") as fd:
-                yamlconfig = yaml.safe_load(fd)  # returns None if file/string is empty
-                logger.debug("loading yaml file: %s", filepath)
+            yamlconfig = load_yaml(filepath)  # returns None if file/string is empty
+            logger.debug("loading yaml file: %s", filepath)
         except IOError:
             logger.debug("Could not find/load yaml file %s", filepath)
         else:
@@ -333,7 +331,7 @@ class GelAnnotatorApp(object):   # pylint: disable=R0904
             if yamlconfig:  # If loading empty file, the result may be None.
                 args.update(mergedicts(yamlconfig, args))  # get merged dict, then update in-place.
         logger.debug("args: %s", printdict(args))
-        self.set_yaml(yaml.dump(args, default_flow_style=False))
+        self.set_yaml(yaml_dump(args))
 
     def load_yaml(self, filepath=None, filepath_is_relative_to_gelfile=True):
         """Load content of yaml file into yaml text widget.
@@ -427,11 +425,11 @@ class GelAnnotatorApp(object):   # pylint: disable=R0904
 
     def parse_config_from_yaml_widget(self):
         """Return parsed config dict of the yaml-formatted text of config widget."""
-        return yaml.safe_load(self.get_yaml())
+        return yaml_load(self.get_yaml())
 
     def dump_config_to_yaml_widget(self, config):
         """Set yaml-formatted text of config widget using config dict."""
-        self.set_yaml(yaml.dump(config, default_flow_style=False))
+        self.set_yaml(yaml_dump(config))
 
     def update_entry_in_yaml(self, key, value):
         """Update a single keyword value in the yaml config text widget."""
@@ -645,41 +643,6 @@ def set_workdir(args):
     os.chdir(d)
 
 
-def get_default_config(fncands=None):
-    """Find default user config.
-
-    Locate and load default user config from file.
-    The "system default" config is created by the argument parser).
-
-    Arguments:
-        fncands: Sequence of potential filenames to search for user config.
-
-    Returns:
-        2-Tuple with (filename, config), where:
-            filename is the config file that was found first, and
-            config is a dict with user config or None if no default config files were found.
-    """
-    # Load default user config
-    if fncands is None:
-        fncands = DEFAULT_CONFIG_FILEPATHS
-
-    for fn in fncands:
-        try:
-            with open(os.path.expanduser(fn), encoding="utf-8") as fp:
-                default_config = yaml.load(fp)
-        except (IOError, FileNotFoundError):
-            # Note: logging is not initialized, so won't print anything, this is for dev debug..
-            logger.debug("Config cand not found (continuing search): %s", fn)
-            continue
-        except yaml.error.YAMLError:
-            logger.info("YAMLError, could not parse file content (continuing search): %s", fn)
-            print("WARNING: YAML could not parse the content of default config file %s." % fn)
-            continue
-        else:
-            return fn, default_config
-    return None, None
-
-
 def get_config(scheme=2, defaults=None):
 
     # In all schemes, defaults is our starting point:
@@ -696,7 +659,7 @@ def get_config(scheme=2, defaults=None):
         if config_template_fn:
             print("Loading explicitly-specififed config_template from file: %s" % config_template_fn)
             try:
-                template_config = yaml.load(open(config_template_fn, encoding="utf-8"))
+                template_config = load_yaml(config_template_fn)
             except FileNotFoundError as e:
                 print("Error loading default config: %s" % e)
             else:
@@ -733,7 +696,7 @@ def get_config(scheme=2, defaults=None):
         if "--template-config" in sys.argv:
             config_template_fn = sys.argv[sys.argv.index("--template-config")+1]
             try:
-                template_config = yaml.load(open(config_template_fn, encoding="utf-8"))
+                template_config = load_yaml(config_template_fn)
             except FileNotFoundError as e:
                 print("Error loading default config: %s" % e)
             else:
@@ -770,7 +733,7 @@ def get_config(scheme=2, defaults=None):
         if config_template_fn:
             print("Loading explicitly-specififed config_template from file: %s" % config_template_fn)
             try:
-                template_config = yaml.load(open(config_template_fn, encoding="utf-8"))
+                template_config = load_yaml(config_template_fn)
             except FileNotFoundError as e:
                 print("Error loading default config: %s" % e)
             else:
@@ -804,7 +767,7 @@ def get_config(scheme=2, defaults=None):
         if config_template_fn:
             print("Loading explicitly-specififed config_template from file: %s" % config_template_fn)
             try:
-                template_config = yaml.load(open(config_template_fn, encoding="utf-8"))
+                template_config = load_yaml(config_template_fn)
             except FileNotFoundError as e:
                 print("Error loading default config: %s" % e)
             else:
@@ -817,10 +780,9 @@ def get_config(scheme=2, defaults=None):
         yamlfile = config.get('file')  # evt. pop() here?
     if yamlfile:
         # If config file  is explicitly specified, do not try to catch errors:
-        with open(os.path.expanduser(yamlfile), encoding="utf-8") as fp:
-            print("Using yaml-formatted configuration file:", yamlfile)
-            yaml_config = yaml.load(fp)
-            config = mergedicts(config, yaml_config)  # latter takes precedence except None-valued entries
+        print("Using yaml-formatted configuration file:", yamlfile)
+        yaml_config = load_yaml(os.path.expanduser(yamlfile))
+        config = mergedicts(config, yaml_config)  # latter takes precedence except None-valued entries
 
     return config
 
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Batch quantification of gel bands.
+
+Each gel is loaded (and linearized) with geltransformer.get_gel_array(), the background is subtracted,
+peaks are found and clustered to lanes and bands, and the bands are quantified with
+band_quantification.quantify_bands(). Gels are processed in a process pool, and the band tables
+are appended to a single combined CSV file (with a gel_id column) as each gel completes.
+
+The opened gel image, the background and the find_peaks stages are stored in an on-disk array cache
+(arraycache.ArrayCache, default config.DEFAULT_ARRAY_CACHE_DIR), so re-running on the same gels with the
+same parameters (e.g. after a crash or to tweak the clustering) loads them from the cache instead of
+recalculating them. Each worker process has its own ArrayCache instance on the shared cache directory.
+
+The gel_id of each completed gel is written to a progress file, so an interrupted run can be
+resumed simply by running the same command again. Gels that fail are written to an errors report
+(and are retried when the run is resumed).
+
+Usage:
+    $ gelquant "gels/*.gel" --output bands.csv --workers 8
+    $ gelquant "gels/*.gel" --output bands.csv --no-cache
+
+"""
+
+import os
+import sys
+import csv
+import glob
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import logging
+
+from .config import get_dtype_policy, DEFAULT_ARRAY_CACHE_DIR
+from .arraycache import ArrayCache
+from .incremental import file_signature
+from .geltransformer import get_gel_array
+from .band_quantification import (rolling_minimum_background, find_peaks, find_peaks_in_rois,
+                                  cluster_peaks_to_lanes_bands, quantify_bands)
+from .lane_detection import find_lane_positions
+
+logger = logging.getLogger(__name__)
+
+GEL_EXTENSIONS = ('.gel', '.tif', '.tiff', '.png')
+
+DEFAULT_ARGS = {
+    'bg_size': (71, 71),
+    'bg_percentile': 5,
+    'band_shape': (3, 25),
+    'band_height': 11,
+    'find_peaks_mode': '2d',
+    'hdist': 8.0,
+    'vdist': 5.0,
+    'tile_shape': None,
+    'lane_centers': None,
+}
+
+# Per-process ArrayCache used by _quantify_gel_worker, see _init_worker():
+_worker_cache = {'cache': None}
+
+
+def find_gel_files(inputs, extensions=GEL_EXTENSIONS):
+    """Find gel files from a list of files, directories and glob patterns.
+
+    Directories are searched (non-recursively) for files with the given extensions.
+
+    Returns:
+        Sorted list of file paths, without duplicates.
+    """
+    gelfiles = set()
+    for inp in inputs:
+        if os.path.isdir(inp):
+            candidates = [os.path.join(inp, fn) for fn in os.listdir(inp)]
+        else:
+            candidates = glob.glob(inp)
+        gelfiles.update(fn for fn in candidates
+                        if os.path.isfile(fn) and os.path.splitext(fn)[1].lower() in extensions)
+    return sorted(gelfiles)
+
+
+def load_gel_array(gelfile, args, cache=None):
+    """Return the pixel data of gelfile from get_gel_array(), using cache if given.
+
+    The cache key is derived from the gel file (path, size and modification time) and the image args,
+    i.e. all args except the quantification parameters.
+    """
+    if cache is None:
+        return get_gel_array(gelfile, args)[0]
+    image_args = {k: v for k, v in args.items() if k not in DEFAULT_ARGS}
+    key = cache.make_key(None, 'get_gel_array', [os.path.abspath(gelfile), file_signature(gelfile), image_args])
+    return cache.get_or_compute(key, lambda: get_gel_array(gelfile, args)[0])
+
+
+def quantify_gel(gelfile, args=None, cache=None):
+    """Load a gel, subtract background, find and cluster peaks, and quantify the bands.
+
+    Args:
+        gelfile: path to gel file.
+        args: dict with quantification parameters, see DEFAULT_ARGS.
+            Image transformation args (crop, rotate, linearize, etc) are passed to get_gel_array().
+            If lane_centers is given (list of x-positions, or 'auto' to detect the lanes from the wells),
+            peaks are only searched for within the lanes (see find_peaks_in_rois).
+        cache: arraycache.ArrayCache instance. If given, the opened gel image, the background and the
+            find_peaks stages are loaded from the cache if they have been calculated before.
+
+    Returns:
+        pandas DataFrame with one row per band, see quantify_bands().
+    """
+    args = dict(DEFAULT_ARGS, **(args or {}))
+    npimg = load_gel_array(gelfile, args, cache=cache)
+    dtype = get_dtype_policy(args)['compute_dtype']
+    img = npimg.astype(dtype)
+    bg_params = {'size': tuple(args['bg_size']), 'percentile': args['bg_percentile']}
+    if cache is None:
+        background = rolling_minimum_background(img, tile_shape=args['tile_shape'], **bg_params)
+    else:
+        key = cache.make_key(cache.hash_array(img), 'rolling_minimum_background', bg_params)
+        background = cache.get_or_compute(key, rolling_minimum_background, img, tile_shape=args['tile_shape'],
+                                          **bg_params)
+    img = np.clip(img - background, 0, None)
+    lane_centers = args['lane_centers']
+    if lane_centers in ('auto', ['auto']):
+        lane_centers = find_lane_positions(npimg)
+    if lane_centers is not None and args['find_peaks_mode'] == '2d':
+        peak_pos = find_peaks_in_rois(img, lane_centers=lane_centers, lane_width=args['band_shape'][1],
+                                      band_shape=args['band_shape'], tile_shape=args['tile_shape'], dtype=dtype,
+                                      cache=cache)
+    else:
+        peak_pos = find_peaks(img, band_shape=args['band_shape'], mode=args['find_peaks_mode'],
+                              tile_shape=args['tile_shape'], dtype=dtype, cache=cache)
+    if len(peak_pos) < 2:
+        raise ValueError("Found %s peaks in gel %s; at least two peaks are needed to cluster bands."
+                         % (len(peak_pos), gelfile))
+    _, _, lanes_bands_centers = cluster_peaks_to_lanes_bands(peak_pos, hdist=args['hdist'], vdist=args['vdist'])
+    return quantify_bands(img, lanes_bands_centers, lane_width=args['band_shape'][1],
+                          band_height=args['band_height'])
+
+
+def _init_worker(cache_dir=None):
+    """Process pool initializer: create the worker's ArrayCache (if cache_dir is given)."""
+    _worker_cache['cache'] = ArrayCache(cache_dir) if cache_dir else None
+
+
+def _quantify_gel_worker(gelfile, args):
+    """Process pool worker: quantify gelfile, returning (gelfile, dataframe, error)."""
+    try:
+        return gelfile, quantify_gel(gelfile, args, cache=_worker_cache['cache']), None
+    except Exception:  # pylint: disable=W0703
+        return gelfile, None, traceback.format_exc()
+
+
+def read_progress(progressfile):
+    """Return set of gel_ids listed as completed in progressfile (empty set if the file does not exist)."""
+    if not progressfile or not os.path.exists(progressfile):
+        return set()
+    with open(progressfile) as fp:
+        return {line.rstrip('\n') for line in fp if line.strip()}
+
+
+def quantify_gels(gelfiles, outputfile, args=None, workers=None, progressfile=None, errorsfile=None, resume=True,
+                  cache_dir=None):
+    """Quantify gelfiles in a process pool, appending the band tables to a single CSV outputfile.
+
+    Args:
+        gelfiles: list of gel files. The file path is used as gel_id.
+        outputfile: combined CSV output file. New results are appended to the file.
+        args: quantification parameters, passed to quantify_gel().
+        workers: number of worker processes (default: number of CPUs).
+        progressfile: file listing the completed gel_ids. Default is outputfile + '.progress'.
+        errorsfile: CSV file with gel_id, error and traceback for each failed gel.
+            Default is outputfile + '.errors.csv'.
+        resume: If True (default), skip gels listed in progressfile. If False, start over.
+        cache_dir: directory of the array cache used by the workers, see quantify_gel().
+            Default is None (no cache).
+
+    Returns:
+        2-tuple of (n_completed, n_failed) for this run.
+    """
+    if progressfile is None:
+        progressfile = outputfile + '.progress'
+    if errorsfile is None:
+        errorsfile = outputfile + '.errors.csv'
+    if resume:
+        completed = read_progress(progressfile)
+    else:
+        completed = set()
+        for fn in (outputfile, progressfile, errorsfile):
+            if os.path.exists(fn):
+                os.remove(fn)
+    pending = [gelfile for gelfile in gelfiles if gelfile not in completed]
+    print("Quantifying %s gels (%s already completed)..." % (len(pending), len(gelfiles) - len(pending)))
+    if not pending:
+        return 0, 0
+
+    write_header = not (os.path.exists(outputfile) and os.path.getsize(outputfile) > 0)
+    n_completed, n_failed = 0, 0
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cache_dir,))
+    with open(outputfile, 'a', newline='') as outfp, open(progressfile, 'a') as progressfp, \
+            open(errorsfile, 'w', newline='') as errorsfp, executor:
+        errors_writer = csv.writer(errorsfp)
+        errors_writer.writerow(['gel_id', 'error', 'traceback'])
+        futures = [executor.submit(_quantify_gel_worker, gelfile, args) for gelfile in pending]
+        for future in as_completed(futures):
+            gelfile, df, error = future.result()
+            if error is not None:
+                n_failed += 1
+                logger.error("Error quantifying gel %s: %s", gelfile, error)
+                print("ERROR quantifying gel %s: %s" % (gelfile, error.strip().splitlines()[-1]))
+                errors_writer.writerow([gelfile, error.strip().splitlines()[-1], error])
+                errorsfp.flush()
+                continue
+            df.insert(0, 'gel_id', gelfile)
+            df.to_csv(outfp, header=write_header, index=False)
+            write_header = False
+            outfp.flush()
+            # Only mark the gel as completed after its results have been written:
+            progressfp.write(gelfile + '\n')
+            progressfp.flush()
+            n_completed += 1
+            print("Quantified gel %s (%s bands) [%s/%s]" % (gelfile, len(df), n_completed + n_failed, len(pending)))
+    return n_completed, n_failed
+
+
+def parse_args(argv=None):
+    """Parse gelquant command line arguments."""
+    ap = argparse.ArgumentParser(prog='gelquant', description="Batch quantification of gel bands.")
+    ap.add_argument('inputs', nargs='+', help="Gel files, directories or glob patterns.")
+    ap.add_argument('--output', '-o', default='gelquant_bands.csv', help="Combined output CSV file.")
+    ap.add_argument('--progress-file', dest='progressfile', metavar="filename",
+                    help="File with completed gels, used to resume. Default is <output>.progress")
+    ap.add_argument('--errors-file', dest='errorsfile', metavar="filename",
+                    help="Report with failed gels. Default is <output>.errors.csv")
+    ap.add_argument('--no-resume', action='store_false', dest='resume', default=True,
+                    help="Start over instead of skipping gels that have already been quantified.")
+    ap.add_argument('--workers', '-j', type=int, help="Number of worker processes (default: number of CPUs).")
+    ap.add_argument('--cache-dir', dest='cache_dir', metavar="directory", default=DEFAULT_ARRAY_CACHE_DIR,
+                    help="Directory for cached intermediate images (opened gel, background, find_peaks stages). "
+                         "Default is %(default)s")
+    ap.add_argument('--no-cache', action='store_const', const=None, dest='cache_dir',
+                    help="Do not cache intermediate images.")
+    ap.add_argument('--mode', dest='find_peaks_mode', default=DEFAULT_ARGS['find_peaks_mode'], choices=('2d', '1d'),
+                    help="Peak finding mode, see band_quantification.find_peaks().")
+    ap.add_argument('--band-shape', type=int, nargs=2, metavar=("HEIGHT", "WIDTH"),
+                    default=DEFAULT_ARGS['band_shape'], help="Band shape (also used as lane width).")
+    ap.add_argument('--band-height', type=int, default=DEFAULT_ARGS['band_height'],
+                    help="Height of the window used to integrate band volumes.")
+    ap.add_argument('--bg-size', type=int, nargs=2, metavar=("HEIGHT", "WIDTH"), default=DEFAULT_ARGS['bg_size'],
+                    help="Size of the rolling-percentile background filter.")
+    ap.add_argument('--bg-percentile', type=float, default=DEFAULT_ARGS['bg_percentile'],
+                    help="Percentile used for rolling background (0 for rolling minimum).")
+    ap.add_argument('--hdist', type=float, default=DEFAULT_ARGS['hdist'], help="Lane clustering distance.")
+    ap.add_argument('--vdist', type=float, default=DEFAULT_ARGS['vdist'], help="Band clustering distance.")
+    ap.add_argument('--lane-centers', nargs='+', metavar="X",
+                    help="Only search for bands in lanes at these x-positions, or 'auto' to detect the lanes.")
+    ap.add_argument('--crop', type=int, nargs=4, metavar=("LEFT", "TOP", "RIGHT", "BOTTOM"),
+                    help="Crop gels before quantification.")
+    ap.add_argument('--autocrop', action='store_const', const='auto', dest='crop',
+                    help="Crop each gel automatically from the empty scanner bed before quantification.")
+    ap.add_argument('--linearize', action='store_true', default=None,
+                    help="Linearize pixel values (default for .GEL files).")
+    ap.add_argument('--no-linearize', action='store_false', dest='linearize')
+    ap.add_argument('--loglevel', default='WARNING', help="Logging level.")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    """gelquant command line entry point."""
+    argns = parse_args(argv)
+    logging.basicConfig(level=argns.loglevel)
+    args = {k: v for k, v in vars(argns).items()
+            if k in DEFAULT_ARGS or k in ('crop', 'linearize')}
+    args['band_shape'] = tuple(args['band_shape'])
+    args['bg_size'] = tuple(args['bg_size'])
+    if args['lane_centers'] and args['lane_centers'] != ['auto']:
+        args['lane_centers'] = [float(x) for x in args['lane_centers']]
+    gelfiles = find_gel_files(argns.inputs)
+    if not gelfiles:
+        print("No gel files found in", argns.inputs)
+        return 1
+    n_completed, n_failed = quantify_gels(gelfiles, argns.output, args=args, workers=argns.workers,
+                                          progressfile=argns.progressfile, errorsfile=argns.errorsfile,
+                                          resume=argns.resume, cache_dir=argns.cache_dir)
+    print("Done: %s gels quantified, %s failed." % (n_completed, n_failed))
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
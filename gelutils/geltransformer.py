@@ -153,7 +153,7 @@ SciPy alone:
 from __future__ import print_function, absolute_import
 from six import string_types  # python 2*3 compatability
 import os
-import glob
+import io
 import re
 from itertools import cycle, chain
 import numpy
@@ -169,6 +169,8 @@ import logging
 # Local imports
 from .utils import init_logging, printdict, getrelfilepath, getabsfilepath, ensure_numeric, mergedicts
 from .argutils import parseargs
+from .config import get_dtype_policy
+from . import dirindex
 
 logging.addLevelName(4, 'SPAM')  # Can be invoked as much as you'd like.
 logger = logging.getLogger(__name__)
@@ -207,7 +209,6 @@ PIL_IS_PILLOW = getattr(Image, 'PILLOW_VERSION', False)
 
 # Note: logging might not have been initialized yet...:
 logger.info("PIL version: %s || PILLOW? - %s", PIL_VERSION, PIL_IS_PILLOW)
-print("PIL version: %s || PILLOW? - %s" % (PIL_VERSION, PIL_IS_PILLOW))
 
 
 def assert_image(img):
@@ -417,36 +418,24 @@ def adjust_dynamic_range(npimg, args, info, output_mode, dr=None):
     dr_low, dr_high = info['dynamicrange'] = dr
     logger.debug("Output minval, maxval: %s, %s", minval, maxval)
     logger.debug("Dynamic range (dr_low, dr_high): %s, %s", dr_low, dr_high)
-    # Define closure to adjust the values, depending on whether to invert the image:
+    # Scale values within the dynamic range linearly, and set values at or beyond the dynamic range bounds
+    # to minval/maxval. (If inverting, high bound becomes low bound.)
+    # The scaling is done in the accumulate dtype (float64), in the same order as maxval*((val - low)/(high - low)),
+    # since the result is truncated to the (integer) output dtype, where float32 rounding changes some pixels by one.
+    dtype = get_dtype_policy(args)['accumulate_dtype']
     if args.get('invert'):
-        def adjust_fun(val):
-            """ Function to adjust dynamic range of image, inverting the image in the process. """
-            if val <= dr_low:
-                return maxval  # This is correct when we are inverting the image.
-            elif val >= dr_high:
-                return minval  # This is correct when we are inverting the image.
-            # This might also be an issue: maxval*70000 > 2**32 ??
-            # Multiply maxval before or after division?
-            # If we want to stay in the integer domain, we should multiply maxval before
-            # otherwise the fraction will always interger-divide to equal zero.
-            # However, if using signed integers, the the integer multiplication may wrap around to negative numbers.
-            return maxval*((dr_high - val)/(dr_high - dr_low)) + minval
-        logger.debug('Using adjust_fun that will invert the pixel values...')
+        logger.debug('Adjusting dynamic range, inverting the pixel values...')
+        adjusted = numpy.subtract(dr_high, npimg, dtype=dtype)
+        low_val, high_val = maxval, minval
     else:
-        def adjust_fun(val):
-            """ Function to adjust dynamic range of image. """
-            if val <= dr_low:
-                return minval
-            elif val >= dr_high:
-                return maxval
-            else:
-                # return maxval*(val-dr_low)/(dr_high-dr_low)+minval
-                return maxval*((val - dr_low)/(dr_high - dr_low)) + minval
-                # return int(float(maxval)*(val-dr_low)/(dr_high-dr_low)+minval)
-    # Numpy adjustment:
-    # Note: This seems correct when I try it manually and plot it.
-    adjust_vec = numpy.vectorize(adjust_fun)    # pylint: disable=E1101
-    npimg = adjust_vec(npimg)
+        adjusted = numpy.subtract(npimg, dr_low, dtype=dtype)
+        low_val, high_val = minval, maxval
+    adjusted /= (dr_high - dr_low)
+    adjusted *= maxval
+    adjusted += minval
+    adjusted[npimg <= dr_low] = low_val
+    adjusted[npimg >= dr_high] = high_val
+    npimg = adjusted
     logger.debug('npimg min, max after adjusting dynamic range: %s, %s', npimg.min(), npimg.max())
 
     # Preview with matplotlib: (After adjusting dynamic range)
@@ -456,7 +445,7 @@ def adjust_dynamic_range(npimg, args, info, output_mode, dr=None):
     return npimg
 
 
-def linearize_pixel_values(gelimg, scalefactor):
+def linearize_pixel_values(gelimg, scalefactor, dtype=None):
     """Perform "linearization" of pixel values for GEL images stored in MD Tiff format.
 
     Background:
@@ -470,29 +459,26 @@ def linearize_pixel_values(gelimg, scalefactor):
         Note that scalefactor is typically stored as a tuple, (1, scalefactor).
 
     Args:
-        :param gelimg:
+        :param gelimg: PIL image or numpy array (not modified).
         :param scalefactor:
+        :param dtype: dtype of the returned array, default is the compute_dtype from config.get_dtype_policy().
+            The linearization itself is calculated in float64 (the accumulate dtype).
 
     Returns:
         image as numpy.ndarray
     """
     assert_image(gelimg)
+    if dtype is None:
+        dtype = get_dtype_policy()['compute_dtype']
 
-    # Default numpy value is int32 (signed).
-    # We need to specify that we want 32-bit *unsigned* intergers;
-    # otherwise values above 2**15*sqrt(2) gets squashed to negative values when we square the values.
-    # Which dtype is better, float32 or uint32?
-    if isinstance(gelimg, numpy.ndarray):
-        npimg = gelimg
-    else:
-        # Important: Make sure to use unsigned integer values, dtype=numpy.uint32.
-        npimg = numpy.array(gelimg, dtype=numpy.uint32)  # pylint: disable=E1101
-        # npimg = numpy.array(gelimg, dtype=numpy.float32)  # pylint: disable=E1101
-        # TODO: Do performance test to see if float32 is better than uint32
-    #       And remember to alter mode when you return to Image.fromarray
+    # Squaring in floating point avoids the integer overflow we would get with signed (or 16-bit) integers.
+    # 16-bit pixel values squared need 32 bits, more than float32's 24-bit mantissa, so use float64:
+    npimg = numpy.asarray(gelimg)
     logger.debug('Linearizing gel data using scalefactor %s...', scalefactor)
     logger.debug('npimg min, max before linearization: %s, %s', npimg.min(), npimg.max())
-    npimg = (npimg**2)/scalefactor[1]
+    npimg = numpy.square(npimg, dtype=get_dtype_policy()['accumulate_dtype'])  # new array
+    npimg /= scalefactor[1]  # in-place
+    npimg = npimg.astype(dtype, copy=False)
     logger.debug('npimg min, max after linearization: %s, %s', npimg.min(), npimg.max())
     # You can use npimg.astype(<dtype>) to convert to other dtype:
     # We need to cast to lower or we cannot save back (at least for old PIL;
@@ -509,13 +495,137 @@ def linearize_pixel_values(gelimg, scalefactor):
     return npimg
 
 
-def transform_image(gelimg, args):
+# numpy dtypes for PIL raw modes that can be read directly from uncompressed image files:
+RAWMODE_DTYPES = {'L': 'u1', 'I;16': '<u2', 'I;16B': '>u2', 'I;16N': '=u2',
+                  'I;32': '<i4', 'I;32B': '>i4', 'I;32N': '=i4', 'F;32F': '<f4', 'F;32BF': '>f4'}
+
+
+def _raw_tiles(gelimg):
+    """Return list of (top, bottom, offset, dtype) for the image strips of an uncompressed image file,
+    or None if the image data cannot be read directly from the file."""
+    width = gelimg.size[0]
+    tiles = getattr(gelimg, 'tile', None)
+    if not (getattr(gelimg, 'filename', None) and tiles):
+        return None
+    raw_tiles = []
+    for tile in tiles:
+        codec, extents, offset, tile_args = tile[:4]
+        if not (codec == 'raw' and extents[0] == 0 and extents[2] == width and tile_args[0] in RAWMODE_DTYPES
+                and tuple(tile_args[1:]) in ((0, 1), (0,), ())):
+            return None
+        raw_tiles.append((extents[1], extents[3], offset, numpy.dtype(RAWMODE_DTYPES[tile_args[0]])))
+    return raw_tiles
+
+
+def image_memmap(gelimg):
+    """Return the pixel data of an uncompressed image file as read-only numpy.memmap (without loading it),
+    or None if the image data is not stored as a single contiguous block."""
+    raw_tiles = _raw_tiles(gelimg)
+    if not raw_tiles:
+        return None
+    width, height = gelimg.size
+    top0, _, offset0, dtype = raw_tiles[0]
+    rowbytes = width * dtype.itemsize
+    if top0 != 0 or any(tile_dtype != dtype or offset != offset0 + top*rowbytes
+                        for top, _, offset, tile_dtype in raw_tiles):
+        return None
+    return numpy.memmap(gelimg.filename, dtype=dtype, mode='r', offset=offset0, shape=(height, width))
+
+
+def read_image_rows(gelimg, step):
+    """Return every step'th row of gelimg (rows 0, step, 2*step, ...) as numpy array.
+
+    For uncompressed images (e.g. .GEL and most TIFF files), the rows are read directly from the file
+    using numpy.memmap, so only the strips containing the selected rows are read from disk.
+    For other images, the whole image is loaded.
+    """
+    raw_tiles = _raw_tiles(gelimg)
+    if not raw_tiles:
+        logger.debug("Image cannot be read directly, loading the whole image to read every %s'th row.", step)
+        return numpy.asarray(gelimg)[::step]
+    width = gelimg.size[0]
+    rows = []
+    for top, bottom, offset, dtype in raw_tiles:
+        first = -top % step  # first selected row within this strip
+        if top + first < bottom:
+            strip = numpy.memmap(gelimg.filename, dtype=dtype, mode='r', offset=offset, shape=(bottom - top, width))
+            rows.append(numpy.array(strip[first::step]))
+    return numpy.concatenate(rows)
+
+
+def _block_mean(npimg, row_factor, col_factor, rms=False):
+    """Mean of row_factor x col_factor blocks of npimg, optionally root-mean-square (float32).
+
+    The rows of each block are summed first, then the columns, which is much faster than
+    reducing over both block axes at once.
+    """
+    height, width = (npimg.shape[0] // row_factor) * row_factor, (npimg.shape[1] // col_factor) * col_factor
+    npimg = npimg[:height, :width]
+    if rms:
+        npimg = numpy.square(npimg, dtype=numpy.float32)
+    sum_dtype = numpy.int64 if npimg.dtype.kind in 'ui' else numpy.float32
+    binned = npimg.reshape(height // row_factor, row_factor, width).sum(axis=1, dtype=sum_dtype)
+    binned = binned.reshape(height // row_factor, width // col_factor, col_factor).sum(axis=2)
+    binned = (binned / (row_factor * col_factor)).astype(numpy.float32)
+    return numpy.sqrt(binned, out=binned) if rms else binned
+
+
+def preview_image(gelimg, preview_scale, rms=False, mode='bin', chunk_rows=256):
+    """Make a decimated preview of gelimg, preview_scale times smaller in each dimension.
+
+    Args:
+        gelimg: PIL image.
+        preview_scale: decimation factor, e.g. 2, 4 or 8.
+        rms: Use root-mean-square binning of the stored pixel values. Since .GEL pixel values are stored
+            as square roots, this makes the linearized preview equal to the mean of the linearized pixels
+            (i.e. binning is done in the linearized domain). Use for .GEL files that will be linearized.
+        mode: 'bin' to average all pixels in each preview_scale x preview_scale block, or
+            'stride' to only read every preview_scale'th row (see read_image_rows) and average
+            preview_scale pixels horizontally, which is faster but may skip thin bands.
+        chunk_rows: number of preview rows binned at a time (limits memory use for large images).
+
+    Returns:
+        PIL image with the preview. For rms binning the image mode is 'F' (32-bit float),
+        otherwise the mode of gelimg.
+    """
+    preview_scale = int(preview_scale)
+    if mode == 'stride':
+        binned = _block_mean(read_image_rows(gelimg, preview_scale), 1, preview_scale, rms=rms)
+    elif mode == 'bin':
+        npimg = image_memmap(gelimg)
+        if npimg is None:
+            npimg = numpy.asarray(gelimg)
+        step = chunk_rows * preview_scale
+        binned = numpy.concatenate([_block_mean(npimg[start:start+step], preview_scale, preview_scale, rms=rms)
+                                    for start in range(0, (npimg.shape[0] // preview_scale) * preview_scale, step)])
+    else:
+        raise ValueError("preview_mode must be either 'bin' or 'stride', not %r" % (mode,))
+    if rms:
+        return Image.fromarray(binned, 'F')
+    dtype = numpy.asarray(gelimg.crop((0, 0, 1, 1))).dtype
+    if dtype.kind in 'ui':
+        binned = numpy.round(binned)
+    return Image.fromarray(binned.astype(dtype))
+
+
+def _scale_box(box, preview_scale):
+    """Convert box from full-resolution coordinates to preview coordinates."""
+    if preview_scale == 1:
+        return tuple(box)
+    return tuple(int(round(val/preview_scale)) for val in box)
+
+
+def transform_image(gelimg, args, preview_scale=1):
     """Apply geometric image transformation - rotate, crop, flip/transpose, scale.
 
     Args:
         gelimg: image
+        preview_scale: If gelimg is a decimated preview (see preview_image), the preview scale.
+            Crop values in args are always relative to the full-resolution image.
         args: dict with "rotate", "crop", "transpose", "scale" entries.
             args dict may be updated in-place with auto-determined values, e.g. for rotate="auto".
+            If crop is "auto", the gel is cropped from the empty scanner bed (see auto_crop.find_auto_crop),
+            with a margin of args["autocrop_margin"], and args["crop"] is updated with the absolute crop values.
 
     Returns:
         gelimg - transformed gel image.
@@ -538,18 +648,30 @@ def transform_image(gelimg, args):
                     args['rotate'], args.get('rotateexpands'))
         gelimg = gelimg.rotate(angle=args['rotate'], resample=BILINEAR, expand=args.get('rotateexpands'))
 
+    if isinstance(args['crop'], string_types) and args['crop'].strip().lower() == "auto":
+        from .auto_crop import find_auto_crop, DEFAULT_AUTOCROP_MARGIN
+        margin = args.get('autocrop_margin')
+        args['crop'] = [val*preview_scale for val in
+                        find_auto_crop(gelimg, margin=DEFAULT_AUTOCROP_MARGIN if margin is None else margin)]
+        args['cropfromedges'] = False
+        logger.info("Auto-crop: %s", args['crop'])
+        if args.get('crop_update_to_absolute') == "str":
+            args['crop'] = ", ".join(map(str, args["crop"]))
+
     if args['crop']:
         # crop is 4-tuple of (left, upper, right, lower)
         # convert fraction values (0.05 or "5%") to absolute pixels:
         width, height = gelimg.size  # Update, in case rotateexpands is True. # = widthheight
-        left, upper, right, lower = crop = ensure_numeric(args['crop'], cycle(gelimg.size))
+        # Crop values are relative to the full-resolution image:
+        width, height = width*preview_scale, height*preview_scale
+        left, upper, right, lower = crop = ensure_numeric(args['crop'], cycle((width, height)))
         # OBS: Origin is lower left corner, which makes the (left, upper, right, lower) notation a little awkward.
         if args.get('cropfromedges'):
             if width-right <= left or height-lower <= upper:
                 raise ValueError("Wrong from-edge cropping values: width-right <= left or height-lower <= upper: "
                                  "%s-%s <= %s or %s-%s <= %s" % (width, right, left, height, lower, upper))
             logger.debug("Cropping image to: %s", (left, upper, width-right, height-lower))
-            gelimg = gelimg.crop((left, upper, width-right, height-lower))
+            gelimg = gelimg.crop(_scale_box((left, upper, width-right, height-lower), preview_scale))
         else:
             if right <= left or height-lower < upper:
                 raise ValueError((
@@ -560,7 +682,7 @@ def transform_image(gelimg, args):
                     "{right} <= {left} or {upper} <= {lower}").format(
                     right=right, left=left, lower=lower, upper=upper))
             logger.debug("Cropping image to: %s", (left, upper, right, lower))
-            gelimg = gelimg.crop(crop)
+            gelimg = gelimg.crop(_scale_box(crop, preview_scale))
         if args.get('crop_update_to_absolute'):
             args['cropfromedges'] = False
             args['crop'] = [left, upper, right, lower]
@@ -608,8 +730,47 @@ def transform_image(gelimg, args):
     return gelimg
 
 
+def get_gel_info(gelimg):
+    """Extract image info (size, extrema, MD tiff tags, scan info and scalefactor) from gel image.
+
+    Args:
+        gelimg: PIL.Image.Image object.
+
+    Returns:
+        info dict. Note that this is gelimg.info, updated in-place.
+    """
+    info = gelimg.info
+    width, height = gelimg.size
+    # using "ante"/"post" rather than "pre"/"post" or "before"/"after", because "ante" is ordered before "post".
+    info['extrema_ante'] = gelimg.getextrema()
+    tifftags = {33445: 'MD_FileTag', 33446: 'MD_ScalePixel', 33447: 'unknown', 33448: 'user'}
+    for tifnum, desc in tifftags.items():
+        try:
+            info[desc] = gelimg.tag[tifnum]
+        except KeyError:
+            pass
+        except AttributeError:
+            # gelimg does not have a tag property, e.g. if png file:
+            break
+    try:
+        # Extract scaninfo and scalefactors:
+        scaninfo = gelimg.tag[33449]
+        scalefactor = gelimg.tag.getscalar(33446)  # or tifimg.tag.tags[33446][0]
+    except (AttributeError, KeyError):
+        # AttributeError if gelimg does not have .tag attribute (e.g. PNG file),
+        # KeyError if .tag dict does not include 33449 key (e.g. TIFF file)
+        scaninfo = ""
+        scalefactor = None
+    info.update({
+        'width': width, 'height': height, 'pmt': get_pmt_string(scaninfo),
+        'scalefactor': scalefactor, 'scaninfo': scaninfo})
+    logger.debug("Gel scaninfo: %s", scaninfo)
+    logger.debug("Image info dict: %s", info)
+    return info
+
+
 def processimage(gelimg, args=None, linearize=None, dynamicrange=None, invert=None,
-                 crop=None, rotate=None, scale=None, **kwargs):          # pylint: disable=R0912
+                 crop=None, rotate=None, scale=None, info=None, **kwargs):          # pylint: disable=R0912
     """process a given gel image (rotate, scale, crop, image contrast, etc).
 
     TODO: Split this function up into two parts:
@@ -627,6 +788,8 @@ def processimage(gelimg, args=None, linearize=None, dynamicrange=None, invert=No
         crop:  4-tuple of (left, top, right, bottom) used to crop the image.
         rotate: rotate image by this amount (degrees).
         scale: scale the image by this factor.
+        info: info dict for gelimg, e.g. from the original image if gelimg is a preview (see get_gel).
+            Default is get_gel_info(gelimg). If info has a 'preview_scale', crop values are mapped accordingly.
         kwargs: Further kwargs used to alter behaviour, e.g.:
             cropfromedges: Instead of crop <right> and <bottom> being absolute values (from upper left corner),
                            crop the amount from the right and bottom edge.
@@ -663,37 +826,13 @@ def processimage(gelimg, args=None, linearize=None, dynamicrange=None, invert=No
     logger.debug("--combined args dict is: %s", printdict(args))
 
     # unpack variables (that are not changed - if values are updated, leave in `args`):
-    info = gelimg.info
-    width, height = gelimg.size
-    # using "ante"/"post" rather than "pre"/"post" or "before"/"after", because "ante" is ordered before "post".
-    info['extrema_ante'] = gelimg.getextrema()
-    tifftags = {33445: 'MD_FileTag', 33446: 'MD_ScalePixel', 33447: 'unknown', 33448: 'user'}
-    for tifnum, desc in tifftags.items():
-        try:
-            info[desc] = gelimg.tag[tifnum]
-        except KeyError:
-            pass
-        except AttributeError:
-            # gelimg does not have a tag property, e.g. if png file:
-            break
-    try:
-        # Extract scaninfo and scalefactors:
-        scaninfo = gelimg.tag[33449]
-        scalefactor = gelimg.tag.getscalar(33446)  # or tifimg.tag.tags[33446][0]
-    except (AttributeError, KeyError):
-        # AttributeError if gelimg does not have .tag attribute (e.g. PNG file),
-        # KeyError if .tag dict does not include 33449 key (e.g. TIFF file)
-        scaninfo = ""
-        scalefactor = None
-    info.update({
-        'width': width, 'height': height, 'pmt': get_pmt_string(scaninfo),
-        'scalefactor': scalefactor, 'scaninfo': scaninfo})
-    logger.debug("Gel scaninfo: %s", scaninfo)
-    logger.debug("Image info dict: %s", info)
+    if info is None:
+        info = get_gel_info(gelimg)
+    scalefactor = info['scalefactor']
 
     #
     # Perform geometric image transformations (rotate, crop, flip/transpose, scale):
-    gelimg = transform_image(gelimg=gelimg, args=args)
+    gelimg = transform_image(gelimg=gelimg, args=args, preview_scale=info.get('preview_scale', 1))
     info['size_after'] = gelimg.size
     info['height_after'], info['width_after'] = gelimg.size
     # width, height = gelimg.size  # Make sure to update width and height
@@ -720,10 +859,10 @@ def processimage(gelimg, args=None, linearize=None, dynamicrange=None, invert=No
             # TODO: Make sure the PIL image returned here has the proper image mode
             return gelimg, info
 
-    # To linearize and apply dynamic range, we convert PIL image to 2D numpy.ndarray:
-    # Important: Make sure to use unsigned integer values, dtype=numpy.uint32,
-    # Otherwise it may use signed integers and wrap around to negative values.
-    npimg = numpy.array(gelimg, dtype=numpy.uint32)
+    # To linearize and apply dynamic range, we convert PIL image to 2D numpy.ndarray.
+    # The pixel data is in the compute dtype (float32 by default), see config.get_dtype_policy();
+    # the linearized values and the dynamic range scaling (truncated to the output dtype) are float64.
+    npimg = numpy.array(gelimg, dtype=get_dtype_policy(args)['compute_dtype'])
     if args.get("debug_show_all_image_transformations"):
         show_npimage(npimg, title="before_linearize")
 
@@ -737,7 +876,8 @@ def processimage(gelimg, args=None, linearize=None, dynamicrange=None, invert=No
     # LINEARIZE, using numpy to do pixel transforms:
     # ----------------------------------------------
     if args['linearize'] and scalefactor:
-        npimg = linearize_pixel_values(npimg, scalefactor=scalefactor)
+        npimg = linearize_pixel_values(npimg, scalefactor=scalefactor,
+                                       dtype=get_dtype_policy(args)['accumulate_dtype'])
 
     #
     # ADJUST DYNAMIC RANGE:
@@ -794,48 +934,74 @@ def get_gel(filepath, args):
     If linearize is True (default), the .GEL data will be linearized before returning.
     Note that invert only takes effect if you specify a dynamic range.
 
+    If args['preview_scale'] is given (e.g. 2, 4 or 8), a decimated preview of the gel is loaded
+    instead of the full image, see preview_image(); args['preview_mode'] selects 'bin' (default) or 'stride'.
+    For .GEL files that are linearized, the binning is done in the linearized domain.
+    The preview scale is stored in info['preview_scale'], so coordinates in the returned image
+    can be mapped back to the full-resolution image (x_full = x_preview * preview_scale).
+    Crop values in args are always given (and updated) in full-resolution coordinates.
+
     Returns:
          2-Tuple of (image, info), where image is a PIL.Image instance
          and info is a dict with information about the image.
     """
     gelimage = Image.open(filepath)
+    preview_scale = args.get('preview_scale')
+    info = None
+    if preview_scale and int(preview_scale) > 1:
+        info = get_gel_info(gelimage)
+        rms = bool(args.get('linearize') and info['scalefactor'])
+        logger.info("Loading %sx preview of %s (rms binning: %s)", preview_scale, filepath, rms)
+        gelimage = preview_image(gelimage, preview_scale, rms=rms, mode=args.get('preview_mode') or 'bin')
+        info['preview_scale'] = int(preview_scale)
     if args.get("debug_show_all_image_transformations"):
         show_npimage(numpy.array(gelimage), title="right after Image.open(filepath)")
-    gelimage, info = processimage(gelimage, args)
+    gelimage, info = processimage(gelimage, args, info=info)
     return gelimage, info
 
 
-# (too many branches, statements) pylint: disable=R0912,R0915
-def convert(gelfile, args, yamlfile=None, lanefile=None, **kwargs):
-    """Convert gel file to png given the info in args (using processimage to apply transformations).
-
-    Args:
-        gelfile: <str> file path pointing to a gel file.
-        args: config dict, forwarded to get_gel/processimage together with gelfile
-            to load gelfile data and apply image transformations.
-        yamlfile: load args from this file and merge with args.
-        lanefile: Load lane annotations from this file. Only used as argument to format png filename.
-
-    Return:
-        2-tuple of (image, info), where
-        Image is a PIL.Image.Image object of the gel after processing as specified by args.
-        Info is a dict with various info on the original image (before round-trip to numpy).
+def get_gel_array(filepath, args=None):
+    """Open gelfile and return the (linearized) pixel data as numpy array, e.g. for band quantification.
 
-    <args> may be updated in-place by the process to contain transformed arguments, e.g.
-      dynamicrange='auto' being converted to an actual (min, max) tuple value.
+    Only the geometric transformations (crop, rotate, flip, scale) are applied to the image;
+    the dynamic range is not adjusted and the image is not inverted, so the pixel values remain
+    proportional to the measured signal.
+    If linearize is None (default), .GEL files are linearized and other files are not.
 
-    If linearize is True (default for gel data), the .GEL data will be linearized before returning.
+    Returns:
+        2-Tuple of (npimg, info), where npimg is a 2D numpy.ndarray
+        and info is a dict with information about the image.
+        npimg is in the storage dtype (uint16) if not linearized, otherwise the compute dtype (float32),
+        see config.get_dtype_policy().
     """
-    logger.debug("convert() invoked with gelfile %s, args %s and kwargs %s", gelfile, args, kwargs)
-    if args is None:
-        args = {}
-    args.update(mergedicts(args, kwargs))
-    logger.debug("--combined args dict is: %s", printdict(args))  # printdict to sort keys
+    args = mergedicts(dict(rotate=None, crop=None), args or {})
+    gelimage = Image.open(filepath)
+    info = get_gel_info(gelimage)
+    gelimage = transform_image(gelimg=gelimage, args=args)
+    info['size_after'] = gelimage.size
+    dtypes = get_dtype_policy(args)
+    linearize = args.get('linearize')
+    if linearize is None:
+        linearize = os.path.splitext(filepath)[1].lower() == '.gel'
+    if linearize and info['scalefactor']:
+        npimg = linearize_pixel_values(gelimage, scalefactor=info['scalefactor'], dtype=dtypes['compute_dtype'])
+    else:
+        # Raw pixel data is returned in the storage dtype (uint16), unless the values do not fit:
+        minval, maxval = gelimage.getextrema()
+        dtype = dtypes['storage_dtype']
+        if dtype.kind in 'ui' and not (numpy.iinfo(dtype).min <= minval and maxval <= numpy.iinfo(dtype).max):
+            logger.info("Pixel values (%s, %s) do not fit in storage dtype %s, using compute dtype %s instead.",
+                        minval, maxval, dtype, dtypes['compute_dtype'])
+            dtype = dtypes['compute_dtype']
+        npimg = numpy.array(gelimage, dtype=dtype)
+    info['linearized'] = bool(linearize and info['scalefactor'])
+    return npimg, info
 
-    gelfile = gelfile or args['gelfile']
-    basename, gelext = os.path.splitext(gelfile)
-    gelext = gelext.lower()
 
+# (too many branches, statements) pylint: disable=R0912,R0915
+def set_filetype_defaults(gelfile, args):
+    """Set the file type specific defaults in args (in-place), e.g. linearize and invert for .GEL files."""
+    gelext = os.path.splitext(gelfile)[1].lower()
     if gelext == '.gel':
         logger.debug("GEL filetype detected (extension '%s'), enabling linearize and invert if not specified.", gelext)
         if args.get('linearize') is None:
@@ -843,16 +1009,17 @@ def convert(gelfile, args, yamlfile=None, lanefile=None, **kwargs):
         if args.get('invert') is None:
             args['invert'] = True
 
-    # Parsing/conforming dynamicrange is done by transform()
 
-    # Process and transform gel:
-    # Good to have gel info even if args is locked for updates:
-    logger.debug("getting image file...")
-    gelimg, info = get_gel(gelfile, args)
-    print("Loaded gelfile:", gelfile)
-    print("Gel info: ", ", ".join("{}: {}".format(k, v) for k, v in info.items()))
-    # Use orgimg for info, e.g. orgimg.info and orgimg.tag
-    logger.debug("gelimg extrema: %s", gelimg.getextrema())
+def get_pngfilename(gelfile, args, info, yamlfile=None, lanefile=None):
+    """Return the (absolute) output filename for the converted gelfile, formatted using args['pngfnfmt'].
+
+    Args:
+        gelfile: the gel file (path).
+        args: config dict; args['convertgelto'] (the output format) is set to 'png' if not given.
+        info: gel info dict, from get_gel(); the dynamic range and PMT voltage is used in the filename.
+        yamlfile, lanefile: only used to format the filename ({yamlfnroot} and {lanefnroot}).
+    """
+    basename, _ = os.path.splitext(gelfile)
     dr = info.get('dynamicrange')
     logger.debug("dynamic range: %s", dr)
     # Dynamic range is used to format the PNG filename:
@@ -873,7 +1040,7 @@ def convert(gelfile, args, yamlfile=None, lanefile=None, **kwargs):
 
     # Calculate existing. basename is gelfile minus extension but with directory:
     if not args.get('overwrite', True):
-        n_existing = "_{}".format(len(glob.glob(basename+'*.'+ext)))
+        n_existing = "_{}".format(len(dirindex.glob(basename+'*'+ext)))
     else:
         n_existing = ""
     pngfnfmt_default = u'{gelfnroot}_{dr_rng}{n_existing}{ext}'
@@ -886,7 +1053,7 @@ def convert(gelfile, args, yamlfile=None, lanefile=None, **kwargs):
     lanefnroot = os.path.splitext(os.path.basename(yamlfile))[0] if lanefile else args.get('lanefile', '')
     pngfilename = pngfnfmt.format(gelfnroot=basename, pmt=info['pmt'], dr_rng=rng,
                                   lanefnroot=lanefnroot, yamlfnroot=yamlfnroot,
-                                  N_existing=n_existing, ext=ext)
+                                  n_existing=n_existing, N_existing=n_existing, ext=ext)
     # Substitute bad characters/strings in filename:
     if args.get('filename_sub'):
         logger.info("Doing filename substitution using filename_sub = %s", args['filename_sub'])
@@ -930,19 +1097,125 @@ def convert(gelfile, args, yamlfile=None, lanefile=None, **kwargs):
 
     # The 'pngfile' in args is relative to the gelfile, but it should be absolute when passed to save():
     pngfilename = getabsfilepath(gelfile, pngfilename)
-    pngfilename_relative = getrelfilepath(gelfile, pngfilename)
     logger.debug("pngfilename: %s", pngfilename)
+    return pngfilename
+
+
+def encode_image(gelimg, ext='.png'):
+    """Return the gel image encoded in the image file format given by the file extension ext."""
+    buf = io.BytesIO()
+    gelimg.save(buf, format=Image.registered_extensions().get(ext.lower()))
+    return buf.getvalue()
+
+
+def convert(gelfile, args, yamlfile=None, lanefile=None, return_encoded=False, **kwargs):
+    """Convert gel file to png given the info in args (using processimage to apply transformations).
+
+    Args:
+        gelfile: <str> file path pointing to a gel file.
+        args: config dict, forwarded to get_gel/processimage together with gelfile
+            to load gelfile data and apply image transformations.
+        yamlfile: load args from this file and merge with args.
+        lanefile: Load lane annotations from this file. Only used as argument to format png filename.
+        return_encoded: If True, also return the encoded image file data (the bytes written to args['pngfile']),
+            so it can be used without reading the file again, e.g. for embedding in an SVG.
+
+    Return:
+        2-tuple of (image, info), where
+        Image is a PIL.Image.Image object of the gel after processing as specified by args.
+        Info is a dict with various info on the original image (before round-trip to numpy).
+        If return_encoded is True, a 3-tuple of (image, info, encoded_bytes).
+
+    <args> may be updated in-place by the process to contain transformed arguments, e.g.
+      dynamicrange='auto' being converted to an actual (min, max) tuple value.
+
+    If linearize is True (default for gel data), the .GEL data will be linearized before returning.
+    """
+    logger.debug("convert() invoked with gelfile %s, args %s and kwargs %s", gelfile, args, kwargs)
+    if args is None:
+        args = {}
+    args.update(mergedicts(args, kwargs))
+    logger.debug("--combined args dict is: %s", printdict(args))  # printdict to sort keys
+
+    gelfile = gelfile or args['gelfile']
+    set_filetype_defaults(gelfile, args)
+
+    # Parsing/conforming dynamicrange is done by transform()
+
+    # Process and transform gel:
+    # Good to have gel info even if args is locked for updates:
+    logger.debug("getting image file...")
+    gelimg, info = get_gel(gelfile, args)
+    print("Loaded gelfile:", gelfile)
+    print("Gel info: ", ", ".join("{}: {}".format(k, v) for k, v in info.items()))
+    # Use orgimg for info, e.g. orgimg.info and orgimg.tag
+    logger.debug("gelimg extrema: %s", gelimg.getextrema())
+    pngfilename = get_pngfilename(gelfile, args, info, yamlfile=yamlfile, lanefile=lanefile)
+    pngfilename_relative = getrelfilepath(gelfile, pngfilename)
     logger.debug("pngfilename_relative: %s", pngfilename_relative)
     logger.debug("Saving converted gel image to: %s", pngfilename)
     # Note: gelimg may be in 16-bit; saving would produce a 16-bit grayscale PNG.
     # Image size can possibly be reduced by 50% by saving as 8-bit grayscale.
-    gelimg.save(pngfilename)
+    # The image is encoded in memory, so the encoded data can be passed on without re-reading the file:
+    encoded = encode_image(gelimg, '.' + args['convertgelto'])
+    with open(pngfilename, 'wb') as fp:
+        fp.write(encoded)
     # Note: 'pngfile' may also be a jpeg file, if the user specified convertgelto: jpg
     args['pngfile'] = info['pngfile'] = pngfilename_relative
 
+    if return_encoded:
+        return gelimg, info, encoded
     return gelimg, info
 
 
+def is_gel_image(gelimg):
+    """Return True if gelimg has the .GEL file tags (MD_FileTag/MD_ScalePixel), e.g. if the file extension is unknown."""
+    tags = getattr(gelimg, 'tag', None)
+    return tags is not None and (33445 in tags or 33446 in tags)
+
+
+def convert_bytes(gel, args=None, filename=None, return_image=False, **kwargs):
+    """Convert gel image data to png (or args['convertgelto']) in memory, without reading or writing any files.
+
+    Args:
+        gel: the gel file data, either bytes (or bytearray/memoryview) or a binary file-like object,
+            e.g. sys.stdin.buffer or a network stream. Non-seekable streams are read into memory.
+        args: config dict, as for convert(). Updated in-place, e.g. with the actual dynamic range.
+        filename: optional file name of the gel data, used for the file type defaults (e.g. linearize and
+            invert for .GEL files). If not given, gel.name is used (if it has a file extension), and otherwise
+            .GEL data is detected from the GEL tiff tags.
+        return_image: also return the processed image.
+
+    Returns:
+        2-tuple of (encoded_bytes, info), or 3-tuple of (encoded_bytes, info, image) if return_image is True.
+    """
+    if args is None:
+        args = {}
+    args.update(mergedicts(args, kwargs))
+    if isinstance(gel, (bytes, bytearray, memoryview)):
+        fp = io.BytesIO(gel)
+    elif hasattr(gel, 'seekable') and gel.seekable():
+        fp = gel
+    else:
+        fp = io.BytesIO(gel.read())
+    if filename is None and isinstance(getattr(gel, 'name', None), string_types):
+        filename = gel.name
+    if filename and os.path.splitext(filename)[1]:
+        set_filetype_defaults(filename, args)
+    else:
+        start = fp.tell()
+        if is_gel_image(Image.open(fp)):
+            set_filetype_defaults('stream.gel', args)
+        fp.seek(start)
+    gelimg, info = get_gel(fp, args)
+    if not args.get('convertgelto'):
+        args['convertgelto'] = 'png'
+    encoded = encode_image(gelimg, '.' + args['convertgelto'])
+    if return_image:
+        return encoded, info, gelimg
+    return encoded, info
+
+
 def show_npimage(npimg, hold=None, interactive=False, cmap="gray_r", block=False, title=None, backend='tkagg'):
     """Show image (in numpy array format) using matplotlib."""
     if backend:
@@ -92,6 +92,11 @@ from __future__ import print_function, absolute_import
 from six import string_types  # python 2*3 compatability
 import os
 import sys
+import shlex
+import shutil
+import traceback
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from subprocess import Popen, PIPE, STDOUT
 import logging
 
@@ -118,7 +123,7 @@ def gel2png(filepath, linearize=True, dynamicrange=None, crop=None, rotate=None,
     return args['pngfile']
 
 
-def svg2png(svgfilepath, target='png', tool=None, remove_ext=True, **kwargs):
+def svg2png(svgfilepath, target='png', tool=None, remove_ext=True, svgdata=None, **kwargs):
     """create a png file by converting a svg file.
 
     Converts svgfilepath file to target format.
@@ -130,25 +135,32 @@ def svg2png(svgfilepath, target='png', tool=None, remove_ext=True, **kwargs):
     If tool is not specified, the best available tool is used.
     Tool can also be a tuple of choices from most to least preferred.
 
+    If svgdata (the content of svgfilepath, str or bytes) is given, cairo converts the svg document
+    from memory instead of re-reading and re-parsing svgfilepath (linked files are still resolved relative
+    to svgfilepath). Other tools use svgfilepath.
+
     Returns outputfilepath on success.
     Returns None if file could not be converted.
     Raises a ValueError if any arguments could not be interpreted.
     """
 
-    # Cairo reads linked files relative to the cwd, not the svg file.
-    # This is kind of weird, but easy to mitigate:
-    initialcwd = os.getcwd()
-    svgfiledir = os.path.dirname(svgfilepath)
-    svgfilename = os.path.basename(svgfilepath)
-    if svgfiledir:
-        os.chdir(svgfiledir)
-
     if tool is None:
         # cairo renders the text annotations much better:
         tool = ('cairo', 'imagemagick')
     if isinstance(tool, string_types):
         tool = (tool, )
 
+    if svgdata is not None and 'cairo' in tool:
+        try:
+            outputfn = cairo_convert(svgfilepath, target, svgdata=svgdata)
+            logger.debug("--conversion of in-memory svg data succeeded, output file: '%s'", outputfn)
+            return os.path.abspath(outputfn)
+        except RuntimeError as e:
+            logger.info("Conversion of in-memory svg data with cairo failed: %s", e)
+
+    # Linked files are resolved relative to the svg file by each convert method
+    # (cairo uses the absolute file url, imagemagick runs in the svg file's directory),
+    # so we do not need to change the (process-wide) current working directory.
     methods = {'cairo': cairo_convert,
                'imagemagick': imagemagick_convert}
 
@@ -156,19 +168,62 @@ def svg2png(svgfilepath, target='png', tool=None, remove_ext=True, **kwargs):
     for key in tool:
         convert_method = methods[key]
         try:
-            # outputfn = convert_method(svgfilepath, target, kwargs)
-            logger.debug("Trying to convert '%s' using method %s", svgfilename, convert_method)
-            outputfn = convert_method(svgfilename, target, kwargs)  # currently using filename, not path.
+            logger.debug("Trying to convert '%s' using method %s", svgfilepath, convert_method)
+            outputfn = convert_method(svgfilepath, target, **kwargs)
             outputfn = os.path.abspath(outputfn)
             logger.debug("--conversion succeeded, output file: '%s'", outputfn)
             break
         except RuntimeError as e:
             logger.info("Conversion with method '%s' failed: %s", convert_method, e)
-    if svgfiledir:
-        os.chdir(initialcwd)
     return outputfn
 
 
+def _svg2png_worker(svgfilepath, target, tool, kwargs):
+    """Process pool worker: convert svgfilepath, returning (svgfilepath, outputfilepath, error)."""
+    try:
+        return svgfilepath, svg2png(svgfilepath, target=target, tool=tool, **kwargs), None
+    except Exception:  # pylint: disable=W0703
+        return svgfilepath, None, traceback.format_exc()
+
+
+def svg2png_batch(svgfilepaths, target='png', tool=None, workers=None, executor=None, **kwargs):
+    """Convert many svg files with svg2png, using a bounded pool of worker processes.
+
+    Each worker process is re-used for many files, so the converter libraries are only imported,
+    and the available tools only probed, once per worker.
+
+    Args:
+        svgfilepaths: list of svg files.
+        target, tool, kwargs: passed to svg2png().
+        workers: number of worker processes (default: number of CPUs, at most the number of files).
+        executor: optional executor to run the conversions in, e.g. a ThreadPoolExecutor;
+            default is a ProcessPoolExecutor with `workers` processes.
+
+    Returns:
+        List with the output file path of each svg file (in the same order), or None if conversion failed.
+    """
+    svgfilepaths = list(svgfilepaths)
+    if not svgfilepaths:
+        return []
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(svgfilepaths)))
+    outputs = {}
+    try:
+        results = executor.map(_svg2png_worker, svgfilepaths, [target]*len(svgfilepaths),
+                               [tool]*len(svgfilepaths), [kwargs]*len(svgfilepaths))
+        for svgfilepath, outputfn, error in results:
+            if error is not None:
+                logger.error("Error converting %s: %s", svgfilepath, error)
+            elif outputfn is None:
+                logger.warning("Could not convert %s with any of the available tools.", svgfilepath)
+            outputs[svgfilepath] = outputfn
+    finally:
+        if own_executor:
+            executor.shutdown(wait=True)
+    return [outputs[svgfilepath] for svgfilepath in svgfilepaths]
+
+
 def target2outputfilepath(inputfilepath, target, remove_ext=True):
     """convert input file to target format.
 
@@ -195,8 +250,9 @@ def target2outputfilepath(inputfilepath, target, remove_ext=True):
     return outputfilepath
 
 
+@lru_cache(maxsize=None)
 def cairosvg_available():
-    """Probe whether cairosvg module is available."""
+    """Probe whether cairosvg module is available. The result is cached for the process."""
     try:
         import cairosvg                     # pylint: disable=W0612
         return True
@@ -302,10 +358,12 @@ def cairo_available():
     return available
 
 
-def cairo_convert(inputfilepath, target='png', remove_ext=True, **kwargs):  # I do not use kwargs, pylint: disable=W0613
+def cairo_convert(inputfilepath, target='png', remove_ext=True, svgdata=None, **kwargs):  # pylint: disable=W0613
     """Use cairo to convert a file to the given target format.
 
     Convert with cairo library.
+    If svgdata is given, the svg document is converted from memory (cairosvg bytestring),
+    using inputfilepath only to resolve linked files and to determine the output filepath.
 
     Several cairo-based libraries:
     * Pycairo   : "original" cairo bindings.
@@ -359,6 +417,12 @@ def cairo_convert(inputfilepath, target='png', remove_ext=True, **kwargs):  # I
     # Fix for Windows where cairosvg doesn't handle local filenames well:
     inputfilepath = 'file://localhost/{}'.format(os.path.abspath(inputfilepath))
     convert_method = converters[ext]
+    if svgdata is not None:
+        if isinstance(svgdata, string_types):
+            svgdata = svgdata.encode('utf-8')
+        logger.info("Converting in-memory svg data to %r using method %r", outputfilepath, convert_method)
+        convert_method(bytestring=svgdata, url=inputfilepath, write_to=outputfilepath)
+        return outputfilepath
     print("Converting %r to %r using method %r" % (inputfilepath, outputfilepath, convert_method))
     print("Current directory:", os.getcwd())
     print("Absolute file path:", os.path.abspath(inputfilepath))
@@ -373,20 +437,30 @@ def cairo_convert(inputfilepath, target='png', remove_ext=True, **kwargs):  # I
 # ImageMagick functions:
 # ----------------------
 
-def imagemagick_available():
-    """Probe whether ImageMagick command line tool is available on the current system."""
-    # Test for ImageMagik
-    process = Popen('convert --version', shell=True,
-                    stdin=PIPE, stdout=PIPE, stderr=STDOUT,
-                    close_fds=CLOSE_FDS)
-    res = process.stdout.read()
+@lru_cache(maxsize=None)
+def find_imagemagick():
+    """Find the ImageMagick convert command line tool. The result is cached for the process.
+
+    Returns:
+        Path to the convert executable, or None if ImageMagick is not available.
+    """
+    exe = shutil.which('convert')
+    if exe is None:
+        logger.warning("ImageMagick NOT FOUND: No 'convert' executable on PATH.")
+        return None
+    process = Popen([exe, '--version'], stdin=PIPE, stdout=PIPE, stderr=STDOUT, close_fds=CLOSE_FDS)
+    res, _ = process.communicate()
     # On Windows, there is a 'convert' command, which is used to convert FAT to NTFS.
     logger.debug("Imagemagick check: %s", res)
-    if 'imagemagick' in res.decode().lower():
-        return True
-    else:
-        logger.warn("ImageMagick NOT FOUND: ")
-        return False
+    if 'imagemagick' in res.decode(errors='replace').lower():
+        return exe
+    logger.warning("ImageMagick NOT FOUND: %s is not ImageMagick's convert.", exe)
+    return None
+
+
+def imagemagick_available():
+    """Probe whether ImageMagick command line tool is available on the current system."""
+    return find_imagemagick() is not None
 
 
 def imagemagick_convert(inputfilepath, target='png', remove_ext=True,
@@ -429,43 +503,38 @@ def imagemagick_convert(inputfilepath, target='png', remove_ext=True,
     # dirpath = os.path.dirname(inputfilepath)
     # filename = os.path.basename(inputfilepath)
     # filenamestem, filenameext = os.path.splitext(filename)
-    outputfilepath = target2outputfilepath(inputfilepath, target)
+    outputfilepath = os.path.abspath(target2outputfilepath(inputfilepath, target))
     # Check that ImageMagick is available:
-    if not imagemagick_available():
+    exe = find_imagemagick()
+    if exe is None:
         raise RuntimeError('ImageMagick is not installed. Aborting...')
 
+    options = []
     if resize:
         if isinstance(resize, string_types):
-            resize = '-resize ' + resize
+            options += ['-resize', resize]
         elif len(resize) == 2:
-            resize = "-resize {}x{}".format(*resize)
+            options += ['-resize', "{}x{}".format(*resize)]
         else:
             raise ValueError("Format for argument resize '%s' not recognized." % (resize, ))
     elif scale:
-        if isinstance(scale, string_types):
-            scale = '-scale ' + scale
-        else:
-            scale = '-scale {}'.format(scale)
+        options += ['-scale', str(scale)]
     if rotate:
-        if isinstance(rotate, string_types):
-            scale = '-rotate ' + rotate
-        else:
-            scale = '-rotate {}'.format(rotate)
+        options += ['-rotate', str(rotate)]
     if crop:
-        if isinstance(rotate, string_types):
-            scale = '-crop ' + rotate
-        else:
-            scale = '-crop {}'.format(rotate)       # Not really sure this would work...
+        options += ['-crop', str(crop)]
+    if cmdlineargs:
+        options += shlex.split(cmdlineargs) if isinstance(cmdlineargs, string_types) else list(cmdlineargs)
 
     # ImageMagick convert command format is:
     # convert [reader options] <inputfile> [converter options] outputfile
-    cmd = "convert {infile} {rotate} {resize} {scale} {crop} {cmdargs} {outfile}".format(
-        infile=inputfilepath, rotate=rotate, resize=resize, scale=scale, crop=crop,
-        cmdargs=cmdlineargs, outfile=outputfilepath
-    )
-    process = Popen(
-        cmd, shell=True, stdin=PIPE, stdout=PIPE, stderr=STDOUT, close_fds=CLOSE_FDS)
-    res = process.stdout.read()
+    # The command is run without a shell, in the input file's directory (so linked files are found):
+    cmd = [exe, os.path.abspath(inputfilepath)] + options + [outputfilepath]
+    process = Popen(cmd, stdin=PIPE, stdout=PIPE, stderr=STDOUT, close_fds=CLOSE_FDS,
+                    cwd=os.path.dirname(os.path.abspath(inputfilepath)))
+    res, _ = process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError("ImageMagick convert failed (exit code %s): %s" % (process.returncode, res))
     if res:
         logger.info("ImageMagick command produced stdout messages: %s", res)
 
@@ -478,9 +547,9 @@ def svg2png_cli():
     ap = argparse.ArgumentParser()
     ap.add_argument('inputfiles', nargs="+")
     ap.add_argument('--target', default='png', help="Target file/filetype.")
+    ap.add_argument('--workers', '-j', type=int, help="Number of worker processes (default: number of CPUs).")
     argns = ap.parse_args()
-    for input_fn in argns.inputfiles:
-        svg2png(input_fn, target=argns.target)
+    svg2png_batch(argns.inputfiles, target=argns.target, workers=argns.workers)
 
 
 def main():
@@ -491,12 +560,16 @@ def main():
     ap.add_argument('function')
     ap.add_argument('inputfiles', nargs="+")
     ap.add_argument('--target', default='png', help="Target file/filetype.")
+    ap.add_argument('--workers', '-j', type=int, help="Number of worker processes for svg2png (default: number of CPUs).")
     ap.add_argument('--loglevel', default=logging.WARNING, help="Logging level.")
 
     argns = ap.parse_args()
 
-    functions = {'svg2png': svg2png,
-                 'convertgel': gel2png}
+    if argns.function == 'svg2png':
+        svg2png_batch(argns.inputfiles, target=argns.target, workers=argns.workers)
+        return
+
+    functions = {'convertgel': gel2png}
 
     # TODO: Use proper subparser/command approach..
     for input_fn in argns.inputfiles:
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Stage fingerprints for incremental (make-style) annotation, see annotate_gel() with args['incremental'].
+
+annotate_gel() runs three stages, each with a fingerprint of its inputs:
+    png:      the gel file and the pixel args (crop, rotate, dynamicrange, etc), see PNG_STAGE_ARGS.
+    svg:      the png file, the annotations file and the layout args, see SVG_STAGE_ARGS.
+    svgtopng: the svg stage fingerprint and the rasterization args, see SVGTOPNG_STAGE_ARGS.
+Files are fingerprinted by their size and modification time. If a stage is rebuilt, its output file changes,
+and so do the fingerprints of the following stages. The png stage is rebuilt from the gel file when its
+fingerprint changes, regardless of args['reusepng'].
+
+The fingerprints are saved in the yaml file under 'stage_fingerprints', as
+    {stage: {'fingerprints': [fingerprint, ...], 'output': output file (relative to gelfile)}}.
+Both the fingerprint of the args before the stage was run and after it was run (stages may update args,
+e.g. dynamicrange: auto) are saved, so a stage is up to date whether or not the updated args were saved.
+A stage is skipped if its current fingerprint is one of the saved fingerprints and its output file exists.
+
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+from .utils import getabsfilepath, getrelfilepath
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('png', 'svg', 'svgtopng')
+
+PNG_STAGE_ARGS = (
+    'linearize', 'dynamicrange', 'dynamicrange_round', 'dynamicrange_is_absolute', 'dr_auto_cutoff', 'invert',
+    'crop', 'cropfromedges', 'autocrop_margin', 'rotate', 'rotateexpands', 'scale', 'transpose', 'flip_h', 'flip_v',
+    'preview_scale', 'preview_mode', 'convertgelto', 'pngmode', 'pngfnfmt', 'filename_sub', 'filename_sub_re',
+)
+SVG_STAGE_ARGS = (
+    'xmargin', 'xspacing', 'lane_xpositions', 'yoffset', 'ypadding', 'textfmt', 'laneidxstart', 'embed',
+    'xtraspaceright', 'textrotation', 'fontsize', 'fontfamily', 'fontweight', 'svgfnfmt', 'laneannotations',
+    'fromclipboard', 'lines_inputsep', 'lines_listchar', 'lines_commentchar', 'lines_includeempty',
+    'lines_includeempty_start', 'lines_includeempty_end', 'lines_rstrip', 'lines_lstrip',
+)
+SVGTOPNG_STAGE_ARGS = ('svgtopng_renderer', 'svgtopng_dpi')
+
+
+def file_signature(filepath):
+    """Return [size, mtime_ns] of filepath, or None if the file does not exist."""
+    if not filepath:
+        return None
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def stage_fingerprint(stage, args, keys, files=(), upstream=None):
+    """Calculate the fingerprint of a stage from the given args keys, input files, and upstream fingerprint."""
+    h = hashlib.blake2b(digest_size=16)
+    data = [stage, {key: args.get(key) for key in keys}, [file_signature(fn) for fn in files], upstream]
+    h.update(json.dumps(data, sort_keys=True, default=repr).encode())
+    return h.hexdigest()
+
+
+def stage_is_current(record, fingerprint, gelfile):
+    """Return True if the saved stage record has the given fingerprint and its output file exists."""
+    if not record or fingerprint not in (record.get('fingerprints') or ()):
+        return False
+    output = record.get('output')
+    return bool(output) and os.path.isfile(getabsfilepath(gelfile, output))
+
+
+def make_stage_record(fingerprints, output, gelfile):
+    """Return stage record for stage_fingerprints, with the (unique) fingerprints and output relative to gelfile."""
+    unique = []
+    for fingerprint in fingerprints:
+        if fingerprint not in unique:
+            unique.append(fingerprint)
+    return {'fingerprints': unique, 'output': getrelfilepath(gelfile, output) if output else None}
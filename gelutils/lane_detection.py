@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Automatic detection of lane positions, e.g. for placing lane annotations (make_svg with xmargin: auto).
+
+Lanes are detected from the top band of the gel (usually the wells):
+    1. Find the first rows where the row-mean signal rises above the image mean (the top band).
+    2. Threshold the top band rows (vectorized) and take the column profile of the binary image.
+    3. Determine the lane pitch from the autocorrelation of the column profile (calculated by FFT).
+    4. Find the lane segments in the column profile and fit a regular lane grid to the segment centers.
+
+"""
+
+import numpy as np
+from scipy.signal import find_peaks as find_signal_peaks
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def as_signal_image(npimg, invert=None):
+    """Return npimg as float32 image where bands have high values.
+
+    Args:
+        npimg: 2d image (or PIL image).
+        invert: Whether to invert the image. If None (default), the image is inverted if it has
+            "dark bands on light background", i.e. if the median pixel value is closer to the max than the min.
+    """
+    img = np.asarray(npimg, dtype=np.float32)
+    if img.ndim == 3:
+        img = img.mean(axis=2)  # RGB(A) to grayscale
+    lo, median, hi = np.percentile(img, [0, 50, 100])
+    if invert is None:
+        invert = (hi - median) < (median - lo)
+    if invert:
+        img = hi - img
+    return img
+
+
+def find_top_band_rows(img, top_height=None):
+    """Return (start, stop) rows of the top band (wells) of the gel.
+
+    The top band starts at the first row where the row mean is above the mean of the image,
+    and stops where the row mean drops below the image mean again (or after top_height rows).
+
+    Args:
+        img: signal image (high values for bands), see as_signal_image().
+        top_height: max number of rows to include. Default is 5% of the image height (at least 3 rows).
+    """
+    height = img.shape[0]
+    if top_height is None:
+        top_height = max(3, int(0.05*height))
+    row_means = img.mean(axis=1)
+    above = row_means > row_means.mean()
+    start = int(np.argmax(above)) if above.any() else 0
+    below = np.nonzero(~above[start:start+top_height])[0]
+    stop = start + (int(below[0]) if len(below) else top_height)
+    return start, min(max(stop, start + 1), height)
+
+
+def lane_pitch_autocorrelation(profile, min_pitch=5, max_pitch=None):
+    """Determine the lane pitch (period) of a column profile from its autocorrelation.
+
+    The autocorrelation is calculated with FFT (zero-padded to avoid circular wrap-around).
+    The pitch is the first autocorrelation peak which is at least 80% of the highest peak
+    (to avoid selecting a multiple of the pitch), refined to sub-pixel precision by parabolic interpolation.
+
+    Returns:
+        The lane pitch in pixels (float), or None if no periodicity was found.
+    """
+    n = len(profile)
+    if max_pitch is None:
+        max_pitch = n//2
+    centered = profile - profile.mean()
+    spectrum = np.fft.rfft(centered, 2*n)
+    autocorr = np.fft.irfft(spectrum.real**2 + spectrum.imag**2)[:n]
+    if autocorr[0] <= 0:
+        return None
+    autocorr /= autocorr[0]
+    peaks, _ = find_signal_peaks(autocorr[:max_pitch+1], height=0)
+    peaks = peaks[peaks >= min_pitch]
+    if len(peaks) == 0:
+        return None
+    heights = autocorr[peaks]
+    lag = peaks[np.nonzero(heights >= 0.8*heights.max())[0][0]]
+    # Parabolic interpolation around the peak:
+    y0, y1, y2 = autocorr[lag-1], autocorr[lag], autocorr[min(lag+1, n-1)]
+    denom = y0 - 2*y1 + y2
+    offset = 0.5*(y0 - y2)/denom if denom else 0
+    return lag + offset
+
+
+def find_lane_segments(binary_profile, min_width=1):
+    """Return (start, stop) arrays of contiguous runs where binary_profile is True, at least min_width wide."""
+    edges = np.diff(np.concatenate(([0], binary_profile.astype(np.int8), [0])))
+    starts, stops = np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+    keep = (stops - starts) >= min_width
+    return starts[keep], stops[keep]
+
+
+def find_lane_positions(npimg, n_lanes=None, invert=None, top_height=None, threshold=0.5,
+                        min_pitch=5, regular=True, return_info=False):
+    """Find the x-position of every lane of a gel image from the top band (wells).
+
+    Args:
+        npimg: 2d gel image (numpy array or PIL image), e.g. the png image used for annotation.
+        n_lanes: expected number of lanes, e.g. the number of lane annotations. If the detected lane grid
+            has a different number of lanes, n_lanes lanes are evenly spaced between the outermost detected lanes.
+        invert: see as_signal_image().
+        top_height: number of rows in the top band, see find_top_band_rows().
+        threshold: threshold (fraction between low and high pixel values of the top band)
+            used to make the top band binary.
+        min_pitch: minimum lane pitch, in pixels.
+        regular: If True (default), return positions on a regular grid fitted to the detected lanes
+            (which also fills in lanes missing from the top band). If False, return the centers of the
+            detected lane segments.
+        return_info: also return dict with top band rows, column profile, and pitch.
+
+    Returns:
+        1d array with lane x-positions (pixels), left to right.
+        If return_info is True, a 2-tuple of (positions, info dict).
+    """
+    img = as_signal_image(npimg, invert=invert)
+    start, stop = find_top_band_rows(img, top_height=top_height)
+    top = img[start:stop]
+    lo, hi = np.percentile(top, [5, 95])
+    binary = top > (lo + threshold*(hi - lo))
+    profile = binary.mean(axis=0)
+    pitch = lane_pitch_autocorrelation(profile, min_pitch=min_pitch)
+    min_width = max(1, int(0.2*pitch)) if pitch else 1
+    seg_starts, seg_stops = find_lane_segments(profile > 0.5*profile.max(), min_width=min_width)
+    centers = (seg_starts + seg_stops - 1)/2
+    logger.debug("Top band rows %s-%s, lane pitch %s, %s lane segments.", start, stop, pitch, len(centers))
+
+    positions = centers
+    if regular and pitch and len(centers) >= 2:
+        # Fit a regular grid, x = x0 + pitch*i, to the segment centers:
+        idx = np.round((centers - centers[0])/pitch)
+        pitch, x0 = np.polyfit(idx, centers, 1)
+        positions = x0 + pitch*np.arange(int(idx[-1]) + 1)
+    if n_lanes and len(positions) != n_lanes and len(positions) >= 2:
+        logger.info("Detected %s lanes, but expected %s; spacing lanes evenly between the outermost lanes.",
+                    len(positions), n_lanes)
+        positions = np.linspace(positions[0], positions[-1], n_lanes) if n_lanes > 1 else positions[:1]
+    if return_info:
+        return positions, {'top_band_rows': (start, stop), 'profile': profile, 'pitch': pitch, 'segments': centers}
+    return positions
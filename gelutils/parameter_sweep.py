@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Parameter sweeps for the find_peaks() band detection pipeline.
+
+The pipeline is modelled as a sequence of stages, each taking the output of the previous stage
+and a few stage-specific parameters. When sweeping over a parameter grid, all parameter sets that
+share the same values for the first N stages also share the outputs of those stages.
+The parameter sets are therefore arranged as a tree of shared stage prefixes, and each node in the
+tree is only calculated once. The tree is evaluated one stage (tree level) at a time, with all
+nodes of a level running concurrently in a thread pool.
+
+Usage:
+    >>> results = sweep_find_peaks(img, {'min_distance': [5, 10], 'vdist': [3.0, 5.0]},
+    ...                            ground_truth=true_band_centers)
+    >>> results.sort_values('f1', ascending=False).head()
+
+"""
+
+import itertools
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pandas import DataFrame
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial.distance import cdist
+import logging
+
+from .band_quantification import (FIND_PEAKS_PARAMS, peaks_opening, peaks_subtract_global_bg,
+                                  peaks_rolling_background, peaks_subtract_background, peaks_convolve,
+                                  peaks_percentile_filter, peaks_gaussian_filter, peaks_local_max,
+                                  cluster_peaks_to_lanes_bands)
+from .config import get_dtype_policy
+
+logger = logging.getLogger(__name__)
+
+
+# A pipeline stage: name, OrderedDict of {param name: default value}, and func(data, **params) -> data.
+Stage = namedtuple('Stage', 'name params func')
+
+
+# Adapters from the sweep parameter names to the find_peaks() stages in band_quantification.
+# Stage outputs are shared between branches; the stage functions do not modify their input.
+
+def _opening(img, opening_shape):
+    return peaks_opening(img, opening_shape)
+
+
+def _band_opening(img, band_shape):
+    return peaks_opening(img, band_shape)
+
+
+def _subtract_global_percentile(img, global_percentile):
+    return peaks_subtract_global_bg(img, global_percentile)
+
+
+def _subtract_rolling_ellipse_bg(img, bg_el_size, bg_el_percentile):
+    return peaks_subtract_background(img, peaks_rolling_background(img, bg_el_size, bg_el_percentile,
+                                                                   geometry='ellipse'))
+
+
+def _subtract_rolling_bg(img, bg_size, bg_percentile):
+    return peaks_subtract_background(img, peaks_rolling_background(img, bg_size, bg_percentile))
+
+
+def _convolve(img, convolve_shape):
+    return peaks_convolve(img, convolve_shape)
+
+
+def _percentile_filter(img, pct_filter_size, pct_filter_percentile):
+    return peaks_percentile_filter(img, pct_filter_size, pct_filter_percentile)
+
+
+def _gaussian_filter(img, sigma):
+    return peaks_gaussian_filter(img, sigma)
+
+
+def _peak_local_max(img, min_distance):
+    return peaks_local_max(img, min_distance)
+
+
+def _cluster_band_centers(peak_pos, hdist, vdist):
+    """Cluster peaks to lanes and bands, returning (n, 2) array with [row, col] of each band center."""
+    if len(peak_pos) < 2:
+        return np.asarray(peak_pos, dtype=float).reshape(-1, 2)
+    _, _, lanes_bands_centers = cluster_peaks_to_lanes_bands(peak_pos, hdist=hdist, vdist=vdist)
+    return np.array([center for bands_centers in lanes_bands_centers.values()
+                     for center in bands_centers.values()])
+
+
+def _stage_params(*names):
+    return OrderedDict((name, FIND_PEAKS_PARAMS[name]) for name in names)
+
+
+# The stages of find_peaks() (mode='2d'), followed by clustering of the peaks into bands.
+# Defaults are the values used by find_peaks() (band_quantification.FIND_PEAKS_PARAMS)
+# and cluster_peaks_to_lanes_bands().
+FIND_PEAKS_STAGES = (
+    Stage('opening', _stage_params('opening_shape'), _opening),
+    Stage('subtract_global_percentile', _stage_params('global_percentile'), _subtract_global_percentile),
+    Stage('rolling_ellipse_bg', _stage_params('bg_el_size', 'bg_el_percentile'), _subtract_rolling_ellipse_bg),
+    Stage('rolling_bg', _stage_params('bg_size', 'bg_percentile'), _subtract_rolling_bg),
+    Stage('band_opening', OrderedDict([('band_shape', (3, 25))]), _band_opening),
+    Stage('convolve', _stage_params('convolve_shape'), _convolve),
+    Stage('percentile_filter', _stage_params('pct_filter_size', 'pct_filter_percentile'), _percentile_filter),
+    Stage('gaussian_filter', _stage_params('sigma'), _gaussian_filter),
+    Stage('peak_local_max', _stage_params('min_distance'), _peak_local_max),
+    Stage('cluster', OrderedDict([('hdist', 8.0), ('vdist', 5.0)]), _cluster_band_centers),
+)
+
+
+def _hashable(value):
+    """Make parameter value hashable (lists to tuples), so it can be used in a tree key."""
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+
+def expand_param_grid(param_grid, stages=FIND_PEAKS_STAGES):
+    """Expand a parameter grid to a list of complete parameter sets.
+
+    Args:
+        param_grid: dict of {param name: list of values}. Parameters not in the grid use the stage defaults.
+        stages: the pipeline stages.
+
+    Returns:
+        List of dicts with a value for every stage parameter.
+    """
+    defaults = OrderedDict((name, value) for stage in stages for name, value in stage.params.items())
+    unknown = set(param_grid) - set(defaults)
+    if unknown:
+        raise ValueError("Unknown sweep parameters: %s (stage parameters are: %s)"
+                         % (", ".join(sorted(unknown)), ", ".join(defaults)))
+    names = list(param_grid)
+    param_sets = []
+    for values in itertools.product(*(param_grid[name] for name in names)):
+        params = defaults.copy()
+        params.update(zip(names, values))
+        param_sets.append(params)
+    return param_sets
+
+
+def build_stage_tree(param_sets, stages=FIND_PEAKS_STAGES):
+    """Arrange parameter sets as a tree of shared stage prefixes.
+
+    Returns:
+        List with one OrderedDict per stage (tree level), mapping
+            node key -> (parent node key, stage params dict),
+        where a node key is the tuple of all parameter values for the stages up to and including that stage.
+        The root (input image) has key ().
+    """
+    levels = []
+    for i, stage in enumerate(stages):
+        level = OrderedDict()
+        for params in param_sets:
+            parent_key = _node_key(params, stages[:i])
+            key = parent_key + tuple(_hashable(params[name]) for name in stage.params)
+            if key not in level:
+                level[key] = (parent_key, {name: params[name] for name in stage.params})
+        levels.append(level)
+    return levels
+
+
+def _node_key(params, stages):
+    return tuple(_hashable(params[name]) for stage in stages for name in stage.params)
+
+
+def run_stage_tree(img, levels, stages=FIND_PEAKS_STAGES, max_workers=None):
+    """Evaluate the stage tree from build_stage_tree(), one level at a time, in a thread pool.
+
+    Outputs of a level are released once the next level has been calculated.
+
+    Returns:
+        dict with {leaf node key: final stage output}.
+    """
+    outputs = {(): img}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for stage, level in zip(stages, levels):
+            logger.debug("Running stage %s for %s parameter combinations.", stage.name, len(level))
+
+            def run_node(node, stage=stage):
+                parent_key, params = node
+                return stage.func(outputs[parent_key], **params)
+
+            results = list(executor.map(run_node, level.values()))
+            outputs = dict(zip(level.keys(), results))
+    return outputs
+
+
+def score_peaks(detected, ground_truth, tolerance=3.0):
+    """Score detected peak positions against ground-truth positions.
+
+    Detected and true peaks are matched one-to-one (minimizing the total distance),
+    and only matches within tolerance pixels are counted as true positives.
+
+    Returns:
+        dict with n_true, n_matched, precision, recall, f1, and mean_distance of matched peaks.
+    """
+    detected = np.asarray(detected, dtype=float).reshape(-1, 2)
+    ground_truth = np.asarray(ground_truth, dtype=float).reshape(-1, 2)
+    if len(detected) and len(ground_truth):
+        dist = cdist(detected, ground_truth)
+        rows, cols = linear_sum_assignment(dist)
+        matched = dist[rows, cols][dist[rows, cols] <= tolerance]
+    else:
+        matched = np.array([])
+    n_matched = len(matched)
+    precision = n_matched / len(detected) if len(detected) else 0.0
+    recall = n_matched / len(ground_truth) if len(ground_truth) else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'n_true': len(ground_truth), 'n_matched': n_matched,
+            'precision': precision, 'recall': recall, 'f1': f1,
+            'mean_distance': matched.mean() if n_matched else np.nan}
+
+
+def sweep(img, param_grid, stages=FIND_PEAKS_STAGES, ground_truth=None, tolerance=3.0,
+          max_workers=None, return_outputs=False):
+    """Run the pipeline stages for all parameter combinations in param_grid, sharing common stage prefixes.
+
+    Args:
+        img: 2d image.
+        param_grid: dict of {param name: list of values}, see expand_param_grid().
+        stages: the pipeline stages. The last stage must return an (n, 2) array of peak positions.
+        ground_truth: optional (n, 2) array with the true [row, col] peak positions. If given,
+            each parameter set is scored with score_peaks().
+        tolerance: max distance between a detected and a true peak to count as a match.
+        max_workers: max number of threads.
+        return_outputs: If True, also return the list of final outputs (peak positions) for each parameter set.
+
+    Returns:
+        DataFrame with one row per parameter set, with the parameter values, n_peaks, and the scores
+        (if ground_truth is given). If return_outputs is True, a 2-tuple of (DataFrame, outputs list).
+    """
+    img = np.asarray(img, dtype=get_dtype_policy()['compute_dtype'])
+    param_sets = expand_param_grid(param_grid, stages)
+    levels = build_stage_tree(param_sets, stages)
+    logger.info("Parameter sweep: %s parameter sets, %s stage evaluations (vs %s without sharing).",
+                len(param_sets), sum(len(level) for level in levels), len(param_sets) * len(stages))
+    leaf_outputs = run_stage_tree(img, levels, stages, max_workers=max_workers)
+    rows, outputs = [], []
+    for params in param_sets:
+        peaks = leaf_outputs[_node_key(params, stages)]
+        row = {name: params[name] for name in param_grid}
+        row['n_peaks'] = len(peaks)
+        if ground_truth is not None:
+            row.update(score_peaks(peaks, ground_truth, tolerance=tolerance))
+        rows.append(row)
+        outputs.append(peaks)
+    df = DataFrame(rows)
+    if return_outputs:
+        return df, outputs
+    return df
+
+
+def sweep_find_peaks(img, param_grid, ground_truth=None, tolerance=3.0, max_workers=None, return_outputs=False):
+    """Sweep find_peaks() and cluster_peaks_to_lanes_bands() parameters, scoring band centers against ground truth.
+
+    Sweepable parameters (with defaults) are listed in FIND_PEAKS_STAGES, e.g. band_shape, bg_size, bg_percentile,
+    min_distance, hdist and vdist. See sweep() for details.
+    """
+    return sweep(img, param_grid, stages=FIND_PEAKS_STAGES, ground_truth=ground_truth, tolerance=tolerance,
+                 max_workers=max_workers, return_outputs=return_outputs)
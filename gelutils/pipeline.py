@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Staged read - compute - encode pipeline for converting many gel files, see convert_gels().
+
+Converting a gel (convert()) has three stages, which use different resources:
+    read:    read the gel file from disk or network share (I/O bound).
+    compute: decode the gel and apply the transformations (linearize, crop, rotate, dynamic range; CPU bound).
+    encode:  encode the image as png and write the png file (CPU bound (zlib) and I/O bound).
+Running these one after another leaves the CPU idle while reading, and the disk/network idle while computing.
+convert_gels() runs each stage in its own pool: reader threads, compute worker processes, and encoder/writer
+threads (zlib releases the GIL), so that the next files are read while the current files are processed.
+
+Backpressure: at most `prefetch` files are in flight (read ahead but not yet written), which bounds the
+memory used for file data and images. Results are yielded in the same order as the input files.
+
+Usage:
+    $ gel2png "scans/*.gel" --workers 4 --prefetch 8
+    $ cat gel1.gel | gel2png - - > gel1.png
+    >>> for result in convert_gels(gelfiles, args, workers=4):
+    ...     print(result['gelfile'], result['pngfile'], result['error'])
+
+"""
+
+import os
+import io
+import sys
+import time
+import glob
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+
+from .argutils import make_parser
+from .config import config_ext
+from .geltransformer import get_gel, get_pngfilename, encode_image, set_filetype_defaults, convert_bytes
+from .utils import getrelfilepath
+
+logger = logging.getLogger(__name__)
+
+# Options only used by the pipeline runner, not passed on to convert:
+PIPELINE_OPTIONS = ('inputs', 'workers', 'prefetch', 'readers', 'encoders', 'serial')
+
+DEFAULT_PREFETCH = 8
+
+
+def _read_stage(gelfile):
+    """Read the gel file into memory."""
+    start = time.time()
+    with open(gelfile, 'rb') as fp:
+        data = fp.read()
+    return data, time.time() - start
+
+
+def _compute_stage(gelfile, data, args, yamlfile=None, lanefile=None):
+    """Process pool worker: decode and process the gel file data.
+
+    Returns:
+        5-tuple of (image, info, updated args, output filename, seconds).
+    """
+    start = time.time()
+    if yamlfile is None:
+        # The yaml file is only used for the png filename (pngfnfmt {yamlfnroot}):
+        yamlfile = os.path.splitext(gelfile)[0] + config_ext
+    set_filetype_defaults(gelfile, args)
+    gelimg, info = get_gel(io.BytesIO(data), args)
+    pngfilename = get_pngfilename(gelfile, args, info, yamlfile=yamlfile, lanefile=lanefile)
+    args['pngfile'] = info['pngfile'] = getrelfilepath(gelfile, pngfilename)
+    return gelimg, info, args, pngfilename, time.time() - start
+
+
+def _encode_stage(gelimg, pngfilename, ext):
+    """Encode the image and write the output file."""
+    start = time.time()
+    encoded = encode_image(gelimg, ext)
+    with open(pngfilename, 'wb') as fp:
+        fp.write(encoded)
+    return len(encoded), time.time() - start
+
+
+def _new_result(gelfile):
+    return {'gelfile': gelfile, 'pngfile': None, 'info': None, 'args': None, 'nbytes': None, 'error': None,
+            'read_seconds': None, 'compute_seconds': None, 'encode_seconds': None}
+
+
+def convert_gel_serial(gelfile, args=None):
+    """Convert a single gel file, running the read, compute and encode stages one after another.
+
+    Returns:
+        result dict, the same as yielded by convert_gels().
+    """
+    result = _new_result(gelfile)
+    args = dict(args or {})
+    try:
+        data, result['read_seconds'] = _read_stage(gelfile)
+        gelimg, info, args, pngfilename, result['compute_seconds'] = _compute_stage(gelfile, data, args)
+        result['nbytes'], result['encode_seconds'] = _encode_stage(gelimg, pngfilename, '.' + args['convertgelto'])
+        result.update(pngfile=pngfilename, info=info, args=args)
+    except Exception:  # pylint: disable=W0703
+        result['error'] = traceback.format_exc()
+    return result
+
+
+class _GelJob(object):
+    """A gel file passing through the pipeline; the stages are chained with future done-callbacks."""
+
+    def __init__(self, gelfile, args, readers, computers, encoders):
+        self.result = _new_result(gelfile)
+        self.args = dict(args or {})
+        self.computers, self.encoders = computers, encoders
+        self.done = Future()
+        readers.submit(_read_stage, gelfile).add_done_callback(self._read_done)
+
+    def _fail(self, future=None):
+        if future is not None and future.exception() is not None:
+            exc = future.exception()
+            self.result['error'] = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        else:
+            self.result['error'] = traceback.format_exc()
+        self.done.set_result(self.result)
+
+    def _read_done(self, future):
+        if future.exception() is not None:
+            return self._fail(future)
+        try:
+            data, self.result['read_seconds'] = future.result()
+            self.computers.submit(_compute_stage, self.result['gelfile'], data, self.args) \
+                .add_done_callback(self._compute_done)
+        except Exception:  # pylint: disable=W0703
+            self._fail()
+
+    def _compute_done(self, future):
+        if future.exception() is not None:
+            return self._fail(future)
+        try:
+            gelimg, info, args, pngfilename, self.result['compute_seconds'] = future.result()
+            self.result.update(pngfile=pngfilename, info=info, args=args)
+            self.encoders.submit(_encode_stage, gelimg, pngfilename, '.' + args['convertgelto']) \
+                .add_done_callback(self._encode_done)
+        except Exception:  # pylint: disable=W0703
+            self._fail()
+
+    def _encode_done(self, future):
+        if future.exception() is not None:
+            return self._fail(future)
+        self.result['nbytes'], self.result['encode_seconds'] = future.result()
+        self.done.set_result(self.result)
+
+
+def convert_gels(gelfiles, args=None, workers=None, prefetch=DEFAULT_PREFETCH, readers=2, encoders=2,
+                 compute_executor=None):
+    """Convert gel files to png with a staged read - compute - encode pipeline.
+
+    Args:
+        gelfiles: iterable of gel files (may be a generator; it is consumed as the pipeline proceeds).
+        args: convert args (the same args are used for all gels; each gel gets its own copy).
+        workers: number of compute worker processes (default: number of CPUs).
+        prefetch: max number of gels in flight, i.e. read ahead of the gels being written (backpressure).
+        readers: number of reader threads.
+        encoders: number of encoder/writer threads.
+        compute_executor: optional executor for the compute stage, e.g. a ThreadPoolExecutor;
+            default is a ProcessPoolExecutor with `workers` processes.
+
+    Yields:
+        A result dict for each gel, in input order, with gelfile, pngfile (absolute path), info, args
+        (the updated args, e.g. with the actual dynamicrange), nbytes (size of the png file),
+        read_seconds, compute_seconds, encode_seconds, and error (traceback string, or None).
+    """
+    prefetch = max(1, int(prefetch or 1))
+    own_computers = compute_executor is None
+    computers = ProcessPoolExecutor(max_workers=workers) if own_computers else compute_executor
+    readers_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='gel-reader')
+    encoders_pool = ThreadPoolExecutor(max_workers=encoders, thread_name_prefix='gel-encoder')
+    in_flight = deque()
+    try:
+        for gelfile in gelfiles:
+            if len(in_flight) >= prefetch:
+                yield in_flight.popleft().done.result()
+            in_flight.append(_GelJob(gelfile, args, readers_pool, computers, encoders_pool))
+        while in_flight:
+            yield in_flight.popleft().done.result()
+    finally:
+        # Wait for jobs still in flight (e.g. if the caller stopped iterating early):
+        for job in in_flight:
+            job.done.result()
+        readers_pool.shutdown(wait=True)
+        encoders_pool.shutdown(wait=True)
+        if own_computers:
+            computers.shutdown(wait=True)
+
+
+def convert_stream(source='-', dest='-', args=None):
+    """Convert a single gel from source to dest, without temporary files; '-' is stdin/stdout (gel2png - -).
+
+    Returns:
+        The gel info dict.
+    """
+    stdout = sys.stdout
+    # Only the image data may be written to stdout; print() output from the conversion goes to stderr:
+    sys.stdout = sys.stderr
+    try:
+        if source == '-':
+            encoded, info = convert_bytes(sys.stdin.buffer, args)
+        else:
+            with open(source, 'rb') as fp:
+                encoded, info = convert_bytes(fp, args)
+    finally:
+        sys.stdout = stdout
+    if dest == '-':
+        stdout.buffer.write(encoded)
+        stdout.buffer.flush()
+    else:
+        with open(dest, 'wb') as fp:
+            fp.write(encoded)
+    return info
+
+
+def find_gel_files(inputs):
+    """Expand list of gel files and glob patterns (sorted, without duplicates; other files are ignored)."""
+    gelfiles = set()
+    for inp in inputs:
+        gelfiles.update(fn for fn in (glob.glob(inp) or [inp]) if os.path.isfile(fn))
+    return sorted(gelfiles)
+
+
+def main(argv=None):
+    """gel2png command line entry point."""
+    ap = make_parser(prog='gel2png', description="Convert gel files to png.")
+    argns = ap.parse_args(argv)
+    logging.basicConfig(level=argns.loglevel or logging.WARNING)
+    cmdlineargs = vars(argns)
+    args = {k: v for k, v in cmdlineargs.items() if k not in PIPELINE_OPTIONS}
+    if args.get('dynamicrange') and args['dynamicrange'][0] == 'auto':
+        args['dynamicrange'] = 'auto'
+
+    if '-' in argns.inputs:
+        # Streaming mode, e.g. "gel2png - -" (stdin to stdout), "gel2png gel1.gel -" or "gel2png - gel1.png":
+        if len(argns.inputs) > 2:
+            ap.error("Streaming mode ('-') takes one input and (optionally) one output: gel2png INPUT OUTPUT")
+        source, dest = (argns.inputs + ['-'])[:2]
+        info = convert_stream(source, dest, args)
+        logger.info("Converted gel %s -> %s (dynamic range %s)", source, dest, info.get('dynamicrange'))
+        return 0
+
+    gelfiles = find_gel_files(argns.inputs)
+    if not gelfiles:
+        print("No gel files found in", argns.inputs)
+        return 1
+    start = time.time()
+    if argns.serial:
+        results = (convert_gel_serial(gelfile, args) for gelfile in gelfiles)
+    else:
+        results = convert_gels(gelfiles, args, workers=argns.workers, prefetch=argns.prefetch,
+                               readers=argns.readers, encoders=argns.encoders)
+    n_failed = 0
+    for i, result in enumerate(results, 1):
+        if result['error'] is not None:
+            n_failed += 1
+            logger.error("Error converting gel %s: %s", result['gelfile'], result['error'])
+            print("ERROR converting gel %s: %s [%s/%s]" % (
+                result['gelfile'], result['error'].strip().splitlines()[-1], i, len(gelfiles)))
+        else:
+            print("Converted gel %s -> %s [%s/%s]" % (result['gelfile'], result['pngfile'], i, len(gelfiles)))
+    print("Done: %s gels converted, %s failed (%.2f s)." % (len(gelfiles) - n_failed, n_failed, time.time() - start))
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Render annotated gel images directly as PNG, without going through the SVG file.
+
+The lane annotations are drawn with Pillow (ImageDraw/ImageFont) onto a padded copy of the gel image,
+using the same layout as make_svg (see gelannotator.annotation_layout), so the output corresponds to
+rendering the annotated svg file with svg2png, but does not require cairo, inkscape or ImageMagick.
+
+Sizes in the layout are in svg pixels (96 dpi); the image is rendered at scale dpi/96 for each requested dpi.
+
+"""
+
+import os
+import math
+from functools import lru_cache
+import numpy
+from PIL import Image, ImageDraw, ImageFont
+import logging
+
+logger = logging.getLogger(__name__)
+
+SVG_DPI = 96
+DEFAULT_FONTSIZE = 16  # px; the svg default font-size ('medium').
+
+# Font files tried for each generic font family (the family name itself is tried first).
+FONT_FAMILY_FILES = {
+    'sans-serif': ('DejaVuSans', 'LiberationSans', 'Arial', 'Helvetica'),
+    'serif': ('DejaVuSerif', 'LiberationSerif', 'Times New Roman', 'Times'),
+    'monospace': ('DejaVuSansMono', 'LiberationMono', 'Courier New', 'Courier'),
+}
+
+
+def parse_fontsize(fontsize):
+    """Return svg font-size (number or string with px/pt unit) in pixels."""
+    if not fontsize:
+        return DEFAULT_FONTSIZE
+    if isinstance(fontsize, str):
+        value = fontsize.strip().lower()
+        try:
+            if value.endswith('pt'):
+                return float(value[:-2])*SVG_DPI/72
+            return float(value[:-2] if value.endswith('px') else value)
+        except ValueError:
+            logger.warning("Could not parse font-size %r, using default font size.", fontsize)
+            return DEFAULT_FONTSIZE
+    return float(fontsize)
+
+
+@lru_cache(maxsize=32)
+def get_font(fontfamily='sans-serif', fontweight='bold', size=DEFAULT_FONTSIZE):
+    """Load a TrueType font for the given svg font-family and font-weight.
+
+    Falls back to Pillow's default font if none of the candidate font files are found.
+    """
+    bold = str(fontweight).lower() in ('bold', 'bolder', '600', '700', '800', '900')
+    families = [family.strip().strip('"\'') for family in (fontfamily or 'sans-serif').split(',')]
+    names = []
+    for family in families:
+        names.append(family)
+        names.extend(FONT_FAMILY_FILES.get(family.lower(), ()))
+    for name in names:
+        stems = [name + '-Bold', name + ' Bold', name + 'bd', name] if bold else [name]
+        for stem in stems:
+            try:
+                return ImageFont.truetype(stem + '.ttf', size=size)
+            except (IOError, OSError):
+                continue
+    logger.debug("No font file found for font-family %r, using Pillow's default font.", fontfamily)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 default font does not support size.
+        return ImageFont.load_default()
+
+
+def draw_rotated_text(canvas, text, position, font, rotation=0, fill=(0, 0, 0, 255)):
+    """Draw text onto canvas, rotated counter-clockwise around position (the start of the text baseline).
+
+    This corresponds to an svg text element with transform="translate(x, y) rotate(-rotation)".
+    """
+    x, y = position
+    left, top, right, bottom = font.getbbox(text, anchor='ls')
+    radius = int(math.ceil(max(abs(left), abs(top), abs(right), abs(bottom)))) + 2
+    # Draw and rotate the text in a mask, with the text origin at the same sub-pixel offset as on the canvas:
+    x0, y0 = int(math.floor(x)), int(math.floor(y))
+    origin = (radius + x - x0, radius + y - y0)
+    mask = Image.new('L', (2*radius + 1, 2*radius + 1), 0)
+    ImageDraw.Draw(mask).text(origin, text, fill=255, font=font, anchor='ls')
+    if rotation:
+        mask = mask.rotate(rotation, resample=Image.BICUBIC, center=origin)
+    canvas.paste(fill, (x0 - radius, y0 - radius), mask)
+
+
+def to_8bit(image):
+    """Return 8-bit grayscale ('L') version of image.
+
+    16-bit, 32-bit ('I') and float ('F') images are scaled the same way as when the 16-bit png file
+    is shown by a viewer (or the svg), i.e. value >> 8 (after clipping to 0-65535), instead of being
+    clipped at 255 as by image.convert('L').
+    """
+    if image.mode in ('I', 'F') or image.mode.startswith('I;16'):
+        npimg = numpy.clip(numpy.asarray(image), 0, 65535).astype(numpy.uint32) >> 8
+        return Image.fromarray(npimg.astype(numpy.uint8))
+    return image.convert('L')
+
+
+def render_annotated_image(image, layout, scale=1.0):
+    """Render the gel image with lane annotations.
+
+    Args:
+        image: the (processed) gel image, e.g. the image from convert().
+        layout: annotation layout, from gelannotator.annotation_layout().
+        scale: scale factor relative to the svg pixel size, e.g. dpi/96.
+
+    Returns:
+        LA image (RGBA for color gel images); the gel image is placed below a transparent area
+        with the lane annotations.
+    """
+    if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        image = to_8bit(image)
+    mode = 'LA' if image.mode in ('L', 'LA') else 'RGBA'
+    size = (int(round(layout['width']*scale)), int(round(layout['height']*scale)))
+    canvas = Image.new(mode, size, 0)
+    gel_size = (int(round(layout['imgwidth']*scale)), int(round(layout['imgheight']*scale)))
+    if gel_size != image.size:
+        image = image.resize(gel_size, resample=Image.LANCZOS)
+    canvas.paste(image.convert(mode), (0, int(round(layout['yoffset']*scale))))
+    fill = (0, 255) if mode == 'LA' else (0, 0, 0, 255)
+    font = get_font(layout['fontfamily'], layout['fontweight'],
+                    size=max(1, int(round(parse_fontsize(layout['fontsize'])*scale))))
+    ypos = (layout['yoffset'] - layout['ypadding'])*scale
+    for text, xpos in zip(layout['texts'], layout['lane_xpositions']):
+        draw_rotated_text(canvas, text, (xpos*scale, ypos), font, rotation=layout['textrotation'], fill=fill)
+    return canvas
+
+
+def save_annotated_pngs(image, layout, filepath, dpis=(SVG_DPI,)):
+    """Render the annotated gel image at each of dpis and save as png.
+
+    Args:
+        image: the (processed) gel image.
+        layout: annotation layout, from gelannotator.annotation_layout().
+        filepath: output png file. If more than one dpi is given, '_<dpi>dpi' is appended
+            to the filename (before the extension) for each dpi.
+        dpis: output resolution(s), in dots per inch. 96 dpi has the same pixel size as the svg file.
+
+    Returns:
+        List of the saved png files, one for each dpi.
+    """
+    if isinstance(dpis, (int, float)):
+        dpis = [dpis]
+    fnroot, ext = os.path.splitext(filepath)
+    filenames = []
+    for dpi in dpis:
+        fn = filepath if len(dpis) == 1 else "{}_{}dpi{}".format(fnroot, dpi, ext or '.png')
+        canvas = render_annotated_image(image, layout, scale=float(dpi)/SVG_DPI)
+        canvas.save(fn, dpi=(dpi, dpi))
+        logger.info("Annotated gel rendered to file: %s (%s dpi)", fn, dpi)
+        filenames.append(fn)
+    return filenames
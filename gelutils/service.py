@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Resident service mode, for integrations (e.g. a LIMS) that process many gels one request at a time.
+
+Each gelutils command line invocation pays for interpreter start-up, importing numpy/scipy/PIL/svgwrite,
+and loading the config before processing a single gel. The service does this once, and then processes
+convert, annotate and quantify jobs in a pool of worker processes with all modules already loaded.
+
+Usage:
+    $ gelutils serve --http 127.0.0.1:8765 --workers 4
+    $ gelutils serve --stdio
+
+Jobs are JSON objects:
+    {"id": 1, "job": "convert", "gelfile": "scans/gel1.gel", "args": {"dynamicrange": "auto"}}
+    {"id": 2, "job": "annotate", "gelfile": "scans/gel1.gel", "args": {"svgtopng": true}}
+    {"id": 3, "job": "quantify", "gelfile": "scans/gel1.gel", "args": {"band_shape": [3, 25]}}
+with optional keys:
+    yamlfile: config file for the gel (annotate; default is <gelfile>.gaml).
+    annotationsfile: lane annotations file (annotate).
+    return_data: also return the output file data (base64-encoded png, svg text).
+args are the same as for convert() and annotate_gel() (layered on top of the parser defaults and system config,
+like batchannotate), and for quantify the same as for gelquant.quantify_gel() (incl. the find_peaks() args).
+
+Responses are JSON objects:
+    {"id": 1, "job": "convert", "status": "ok", "result": {"pngfile": ..., "info": {...}},
+     "seconds": 0.21, "total_seconds": 0.23, "error": null}
+where seconds is the time spent processing the job and total_seconds includes the time waiting for a worker.
+
+Front ends:
+    stdio: one job per line on stdin, one response per line on stdout. Jobs are processed concurrently,
+        so responses are written as the jobs complete, not necessarily in order; use "id" to match them.
+    http: POST the job to /convert, /annotate or /quantify (or to / with the "job" key).
+        GET /status returns the available jobs and the number of jobs completed.
+
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import base64
+import argparse
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+
+from .argutils import make_parser
+from .batchannotator import BATCH_OPTIONS, get_base_config, make_job_args
+from .gelannotator import annotate_gel, find_yamlfilepath
+from .geltransformer import convert
+from .gelquant import quantify_gel
+from .utils import getabsfilepath, mergedicts
+
+logger = logging.getLogger(__name__)
+
+JOBS = ('convert', 'annotate', 'quantify')
+
+# Config layers resolved once per worker process, see _init_worker():
+_worker_config = {'defaults': {}, 'base_config': {}}
+
+
+def get_service_defaults():
+    """Return the annotation/conversion parser defaults, as used by batchannotate."""
+    ap = make_parser(prog='batch')
+    return {action.dest: action.default for action in ap._actions
+            if action.dest not in BATCH_OPTIONS and action.default is not argparse.SUPPRESS}
+
+
+def _init_worker(defaults, base_config, stdout_to_stderr=False):
+    """Process pool initializer: keep the resolved config layers in the worker process.
+
+    If stdout_to_stderr is True, print() output from the gelutils functions goes to stderr,
+    so it does not interfere with the responses (stdio front end).
+    """
+    _worker_config['defaults'] = defaults
+    _worker_config['base_config'] = base_config
+    if stdout_to_stderr:
+        sys.stdout = sys.stderr
+
+
+def _json_default(obj):
+    """json.dumps default: numpy arrays/scalars to lists/numbers, everything else to str."""
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    return str(obj)
+
+
+def _convert_job(request):
+    gelfile = request['gelfile']
+    # The yaml file is only used for the png filename (pngfnfmt {yamlfnroot}):
+    yamlfile = request.get('yamlfile') or find_yamlfilepath(gelfile)
+    args = mergedicts(_worker_config['defaults'], _worker_config['base_config'], request.get('args') or {})
+    if request.get('return_data'):
+        _, info, encoded = convert(gelfile, args, yamlfile=yamlfile, return_encoded=True)
+    else:
+        _, info = convert(gelfile, args, yamlfile=yamlfile)
+    result = {'pngfile': os.path.abspath(getabsfilepath(gelfile, args['pngfile'])), 'info': info}
+    if request.get('return_data'):
+        result['pngdata'] = base64.b64encode(encoded).decode('ascii')
+    return result
+
+
+def _annotate_job(request):
+    gelfile = request['gelfile']
+    yamlfile = request.get('yamlfile') or find_yamlfilepath(gelfile)
+    user_args = dict(request.get('args') or {})
+    if request.get('annotationsfile'):
+        user_args['annotationsfile'] = request['annotationsfile']
+    job = make_job_args([(gelfile, yamlfile)], defaults=_worker_config['defaults'],
+                        base_config=_worker_config['base_config'], user_args=user_args)[0]
+    info = {}
+    _, svgfilename, args = annotate_gel(gelfile, job['args'], yamlfile=yamlfile,
+                                        yamlsettings=job['yamlsettings'], info=info)
+    result = {'svgfile': svgfilename and os.path.abspath(svgfilename),
+              'pngfile': args.get('pngfile') and os.path.abspath(getabsfilepath(gelfile, args['pngfile'])),
+              'stages': info.get('stages')}
+    if args.get('svgtopng') and svgfilename:
+        result['annotated_pngfile'] = os.path.splitext(result['svgfile'])[0] + '.png'
+    if request.get('return_data') and svgfilename:
+        with io.open(svgfilename, encoding='utf-8') as fp:
+            result['svgdata'] = fp.read()
+        if result.get('annotated_pngfile') and os.path.isfile(result['annotated_pngfile']):
+            with open(result['annotated_pngfile'], 'rb') as fp:
+                result['annotated_pngdata'] = base64.b64encode(fp.read()).decode('ascii')
+    return result
+
+
+def _quantify_job(request):
+    args = dict(request.get('args') or {})
+    # JSON has no tuples:
+    for key in ('band_shape', 'bg_size', 'tile_shape'):
+        if isinstance(args.get(key), list):
+            args[key] = tuple(args[key])
+    df = quantify_gel(request['gelfile'], args)
+    return {'bands': df.to_dict('records')}
+
+
+JOB_FUNCTIONS = {'convert': _convert_job, 'annotate': _annotate_job, 'quantify': _quantify_job}
+
+
+def run_job(request):
+    """Run a single job request (dict) and return the response dict (never raises)."""
+    start = time.time()
+    response = {'id': request.get('id'), 'job': request.get('job'), 'status': 'ok',
+                'result': None, 'seconds': None, 'error': None}
+    try:
+        if request.get('job') not in JOB_FUNCTIONS:
+            raise ValueError("Unknown job %r; must be one of %s." % (request.get('job'), ", ".join(JOBS)))
+        if not request.get('gelfile'):
+            raise ValueError("No gelfile given for %s job." % request['job'])
+        response['result'] = JOB_FUNCTIONS[request['job']](request)
+    except Exception:  # pylint: disable=W0703
+        response['status'], response['error'] = 'error', traceback.format_exc()
+    response['seconds'] = time.time() - start
+    # Make sure the response can be sent back as JSON (and pickled back from the worker process):
+    return json.loads(json.dumps(response, default=_json_default))
+
+
+class GelutilsService(object):
+    """Pool of worker processes with the gelutils modules and config loaded, processing job requests."""
+
+    def __init__(self, workers=None, load_system_config=True, config_template=None, stdout_to_stderr=False):
+        """
+        Args:
+            workers: number of worker processes (default: number of CPUs).
+            load_system_config: layer the system config (DEFAULT_CONFIG_FILEPATHS) on the parser defaults.
+            config_template: optional config file, layered on top of the system config.
+            stdout_to_stderr: redirect print() output in the worker processes to stderr.
+        """
+        defaults = get_service_defaults()
+        base_config = get_base_config(load_system_config, config_template)
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                            initargs=(defaults, base_config, stdout_to_stderr))
+        self.workers = self.executor._max_workers
+        self.n_completed = 0
+        self._lock = threading.Lock()
+
+    def submit(self, request):
+        """Submit job request; returns a Future with the response dict.
+
+        The response's total_seconds (time since submission) is set before any other done-callbacks are called.
+        """
+        start = time.time()
+        future = self.executor.submit(run_job, request)
+
+        def _done(fut):
+            with self._lock:
+                self.n_completed += 1
+            if not fut.cancelled() and fut.exception() is None:
+                fut.result()['total_seconds'] = time.time() - start
+        future.add_done_callback(_done)
+        return future
+
+    def run(self, request):
+        """Run job request and wait for the response."""
+        start = time.time()
+        response = dict(self.submit(request).result())
+        response['total_seconds'] = time.time() - start
+        return response
+
+    def status(self):
+        return {'status': 'ok', 'jobs': list(JOBS), 'workers': self.workers, 'completed': self.n_completed}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+def serve_stdio(service, stdin=None, stdout=None):
+    """JSON-lines front end: read one job per line from stdin, write one response per line to stdout.
+
+    Returns when stdin is closed and all submitted jobs have completed.
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+    pending = []
+
+    def write_response(response):
+        with write_lock:
+            stdout.write(json.dumps(response) + '\n')
+            stdout.flush()
+
+    def write_future_response(future):
+        try:
+            write_response(future.result())
+        except Exception:  # pylint: disable=W0703
+            write_response({'id': None, 'status': 'error', 'error': traceback.format_exc()})
+
+    for line in stdin:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Job request must be a JSON object.")
+        except ValueError as e:
+            write_response({'id': None, 'status': 'error', 'error': "Invalid job request: %s" % e})
+            continue
+        future = service.submit(request)
+        future.add_done_callback(write_future_response)
+        pending.append(future)
+    for future in pending:
+        future.exception()  # wait
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end: POST /<job> (or /) with a JSON job, GET /status."""
+
+    service = None  # Set by make_http_server()
+
+    def _send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/') == '/status':
+            self._send_json(200, self.service.status())
+        else:
+            self._send_json(404, {'status': 'error', 'error': "Not found: %s" % self.path})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            request = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+            if not isinstance(request, dict):
+                raise ValueError("Job request must be a JSON object.")
+        except ValueError as e:
+            self._send_json(400, {'status': 'error', 'error': "Invalid job request: %s" % e})
+            return
+        job = self.path.strip('/')
+        if job:
+            request['job'] = job
+        if request.get('job') not in JOBS:
+            self._send_json(404, {'status': 'error', 'error': "Unknown job: %s" % request.get('job')})
+            return
+        response = self.service.run(request)
+        self._send_json(200 if response['status'] == 'ok' else 500, response)
+
+    def log_message(self, format, *args):  # pylint: disable=W0622
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+def make_http_server(service, host='127.0.0.1', port=8765):
+    """Create (threading) HTTP server for service. Use server.serve_forever() to start serving."""
+    handler = type('BoundServiceRequestHandler', (ServiceRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def parse_args(argv=None):
+    """Parse gelutils command line arguments."""
+    ap = argparse.ArgumentParser(prog='gelutils', description="Gelutils command line tool.")
+    subparsers = ap.add_subparsers(dest='command')
+    sp = subparsers.add_parser('serve', help="Run resident service, processing convert/annotate/quantify jobs.")
+    sp.add_argument('--http', metavar="HOST:PORT", nargs='?', const='127.0.0.1:8765',
+                    help="Serve jobs over HTTP (default address 127.0.0.1:8765).")
+    sp.add_argument('--stdio', action='store_true',
+                    help="Read JSON job requests from stdin (one per line), write responses to stdout (default).")
+    sp.add_argument('--workers', '-j', type=int, help="Number of worker processes (default: number of CPUs).")
+    sp.add_argument('--no-system-config', action='store_false', dest='load_system_config', default=True,
+                    help="Do not load the system (user) config.")
+    sp.add_argument('--config-template', help="Config file layered on top of the system config.")
+    sp.add_argument('--loglevel', default='WARNING', help="Logging level.")
+    argns = ap.parse_args(argv)
+    if argns.command is None:
+        ap.error("No command given.")
+    return argns
+
+
+def main(argv=None):
+    """gelutils command line entry point."""
+    argns = parse_args(argv)
+    # Log to stderr; in stdio mode stdout is reserved for responses.
+    logging.basicConfig(level=argns.loglevel, stream=sys.stderr)
+    stdio = not argns.http
+    if stdio:
+        # Responses are written to the real stdout; any other output goes to stderr.
+        responses_out, sys.stdout = sys.stdout, sys.stderr
+    service = GelutilsService(workers=argns.workers, load_system_config=argns.load_system_config,
+                              config_template=argns.config_template, stdout_to_stderr=stdio)
+    try:
+        if argns.http:
+            host, _, port = argns.http.rpartition(':')
+            server = make_http_server(service, host or '127.0.0.1', int(port))
+            print("Serving gelutils jobs on http://%s:%s/ (%s workers)" % (
+                server.server_address[0], server.server_address[1], service.workers), file=sys.stderr)
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+        else:
+            serve_stdio(service, stdout=responses_out)
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -31,6 +31,7 @@ import logging
 from argparse import Namespace
 
 from gelutils.utils import mergeargs
+from gelutils.argutils import make_parser
 
 logger = logging.getLogger(__name__)
 
@@ -97,3 +98,12 @@ def test_mergeargs():
     assert test2['nonetesta'] == 'a'        # variable, depending on excludeNone and then precedence
     assert test2['nonetestb'] is None        # variable, depending on excludeNone and then precedence
     assert test2['nonetestc'] is None       # constant
+
+
+def test_xmargin_args():
+    ap = make_parser()
+    assert ap.parse_args(['gel.gel', '--xmargin', '30', '40']).xmargin == ['30', '40']
+    assert ap.parse_args(['gel.gel', '--xmargin', 'auto']).xmargin == ['auto']
+    for xmargin in (['30'], ['10', '20', '30'], ['auto', '20']):
+        with pytest.raises(SystemExit):
+            ap.parse_args(['gel.gel', '--xmargin'] + xmargin)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for arraycache.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import os
+import pytest
+import logging
+import numpy as np
+
+from gelutils.arraycache import ArrayCache
+from gelutils.band_quantification import find_peaks
+from gelutils.tests.test_band_quantification import make_test_gel
+
+logger = logging.getLogger(__name__)
+
+
+def test_arraycache_get_put(tmp_path):
+    cache = ArrayCache(str(tmp_path))
+    arr = np.random.rand(20, 30).astype('f')
+    key = cache.make_key(cache.hash_array(arr), 'double', {'factor': 2})
+    assert cache.get(key) is None
+    calls = []
+
+    def double(a):
+        calls.append(1)
+        return a * 2
+
+    first = cache.get_or_compute(key, double, arr)
+    second = cache.get_or_compute(key, double, arr)
+    assert len(calls) == 1
+    assert isinstance(second, np.memmap) and not second.flags.writeable
+    assert np.array_equal(first, arr * 2) and np.array_equal(second, arr * 2)
+    assert (cache.hits, cache.misses) == (1, 2)
+    # Keys depend on the input content and the stage parameters:
+    assert cache.hash_array(arr) != cache.hash_array(arr + 1)
+    assert key != cache.make_key(cache.hash_array(arr), 'double', {'factor': 3})
+
+
+def test_arraycache_lru_eviction(tmp_path):
+    arr = np.zeros(1000, dtype='f8')  # 8000 bytes + header
+    entry_size = None
+    cache = ArrayCache(str(tmp_path), max_size=None)
+    for i, key in enumerate('abc'):
+        cache.put(key, arr)
+        os.utime(cache.filepath(key), (1000 + i, 1000 + i))
+        entry_size = os.path.getsize(cache.filepath(key))
+    cache.get('a')  # 'a' is now the most recently used entry
+    cache.max_size = 2 * entry_size
+    cache.put('d', arr)
+    assert 'a' in cache and 'd' in cache
+    assert 'b' not in cache and 'c' not in cache
+    cache.clear()
+    assert cache.size() == 0
+
+
+def test_find_peaks_cache(tmp_path):
+    img = make_test_gel() * 100 + np.random.rand(180, 200).astype('f')
+    expected = find_peaks(img)
+    cache = ArrayCache(str(tmp_path))
+    assert np.array_equal(find_peaks(img, cache=cache), expected)
+    n_entries = len(cache.entries())
+    assert n_entries > 0 and cache.hits == 0
+    warm_cache = ArrayCache(str(tmp_path))
+    assert np.array_equal(find_peaks(img, cache=warm_cache), expected)
+    assert warm_cache.hits == n_entries and warm_cache.misses == 0
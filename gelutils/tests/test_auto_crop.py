@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for auto_crop.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import pytest
+import numpy as np
+from PIL import Image
+
+from gelutils.auto_crop import find_gel_bounds, find_auto_crop
+from gelutils.geltransformer import transform_image
+
+
+def make_scan(shape=(1500, 1200), gel_box=(150, 200, 1050, 1300), invert=False):
+    """Make a synthetic 16-bit scan with a gel (left, upper, right, lower) on a noisy, empty scanner bed."""
+    rs = np.random.RandomState(0)
+    img = rs.normal(200, 20, shape)
+    left, upper, right, lower = gel_box
+    img[upper:lower, left:right] += 3000
+    img[400:410, 300:500] += 20000  # a band
+    img = np.clip(img, 0, 65535).astype(np.uint16)
+    return 65535 - img if invert else img
+
+
+@pytest.mark.parametrize("invert", [False, True])
+def test_find_gel_bounds(invert):
+    gel_box = (150, 200, 1050, 1300)
+    bounds = find_gel_bounds(make_scan(gel_box=gel_box, invert=invert))
+    assert np.abs(np.array(bounds) - gel_box).max() <= 2
+
+
+def test_find_auto_crop_margin():
+    assert find_auto_crop(make_scan(), margin=10) == (140, 190, 1060, 1310)
+    assert find_auto_crop(make_scan(), margin=0.5) == (0, 0, 1200, 1500)  # clipped to the image
+
+
+def test_transform_image_auto_crop():
+    args = {'crop': 'auto', 'rotate': None, 'autocrop_margin': 20, 'crop_update_to_absolute': "str"}
+    gelimg = transform_image(Image.fromarray(make_scan()), args)
+    assert gelimg.size == (1050 - 150 + 40, 1300 - 200 + 40)
+    assert args['crop'] == "130, 180, 1070, 1320"
+    assert args['cropfromedges'] is False
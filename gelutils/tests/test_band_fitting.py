@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for band_fitting.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+from collections import OrderedDict
+import pytest
+import logging
+import numpy as np
+from scipy.optimize import approx_fprime
+
+from gelutils.band_fitting import (band_profile, band_profile_jacobian, fit_lane_profile, fit_bands,
+                                   BAND_MODELS, SQRT_2PI)
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize("model", BAND_MODELS)
+def test_band_profile_jacobian(model):
+    x = np.arange(80.)
+    params = np.array([5, 3, 30, 38, 3, 2.5] + ([1.5, -0.7] if model == 'skew_gaussian' else []) + [0.5])
+    jac = band_profile_jacobian(x, params, n_bands=2, model=model)
+    numerical = np.array([approx_fprime(params, lambda p: band_profile(x, p, 2, model)[i], 1e-7)
+                          for i in range(len(x))])
+    assert np.allclose(jac, numerical, atol=1e-5)
+
+
+def test_fit_lane_profile_overlapping_bands():
+    x = np.arange(100.)
+    params = np.array([5, 3, 40, 46, 3, 2.5, 0.5])
+    fit = fit_lane_profile(band_profile(x, params, 2), [41, 45], sigma=2)
+    assert fit['success']
+    assert np.allclose(fit['center'], [40, 46], atol=1e-3)
+    assert np.allclose(fit['sigma'], [3, 2.5], atol=1e-3)
+    assert np.allclose(fit['area'], params[:2] * params[4:6] * SQRT_2PI, rtol=1e-3)
+
+
+def test_fit_bands():
+    rows, cols = np.mgrid[0:120, 0:100]
+    img = np.zeros((120, 100))
+    truth = {1: [(30, 3.0, 50.0), (38, 2.0, 20.0)], 2: [(70, 2.5, 10.0)]}  # ypos, sigma, amplitude per lane
+    lane_xpos = {1: 30, 2: 70}
+    for lane_id, bands in truth.items():
+        in_lane = np.abs(cols - lane_xpos[lane_id]) <= 5
+        for ypos, sigma, amplitude in bands:
+            img += in_lane * amplitude * np.exp(-0.5*((rows - ypos)/sigma)**2)
+    lanes_bands_centers = OrderedDict([
+        (1, OrderedDict([(1, np.array([31.0, 30.0])), (2, np.array([37.0, 30.0]))])),
+        (2, OrderedDict([(1, np.array([69.0, 70.0]))])),
+    ])
+    df = fit_bands(img, lanes_bands_centers, lane_width=15, max_workers=2)
+    assert df['fit_success'].all()
+    assert np.allclose(df['fit_center'], [30, 38, 70], atol=1e-2)
+    expected_area = [11 * amplitude * sigma * SQRT_2PI for bands in truth.values() for _, sigma, amplitude in bands]
+    assert np.allclose(df['fit_area'], expected_area, rtol=1e-3)
+
+
+def test_fit_bands_empty_lane():
+    rows, cols = np.mgrid[0:120, 0:100]
+    img = (np.abs(cols - 30) <= 5) * 50.0 * np.exp(-0.5*((rows - 40)/3.0)**2)
+    lanes_bands_centers = OrderedDict([
+        (1, OrderedDict([(1, np.array([41.0, 30.0]))])),
+        (2, OrderedDict()),
+        (3, OrderedDict([(1, np.array([80.0, 70.0]))])),
+    ])
+    df = fit_bands(img, lanes_bands_centers, lane_width=15)
+    assert list(df['lane_id']) == [1, 3]
+    assert df['fit_success'].all()
+    assert np.allclose(df['fit_center'].iloc[0], 40, atol=1e-2)
+    # A lane with a non-finite lane center is not fitted, and its fit columns are left as NaN:
+    df = fit_bands(img, lanes_bands_centers, lane_width=15, lane_centers=[30, np.nan, np.nan])
+    assert list(df['fit_success']) == [True, False]
+    assert np.isnan(df['fit_center'].iloc[1]) and np.isnan(df['fit_area'].iloc[1])
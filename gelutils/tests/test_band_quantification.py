@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for band_quantification.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+from collections import OrderedDict
+import pytest
+import logging
+import numpy as np
+from scipy.signal import savgol_filter
+
+from gelutils.band_quantification import (extract_lane_profiles, lane_column_bounds, integrate_band_volumes,
+                                          quantify_bands, find_peaks_lane_profiles, cluster_peaks_to_lanes_bands,
+                                          flatten_band_centers_to_dataframe, add_band_region_stats,
+                                          subtract_row_col_percentile, find_peaks, subtract_global_percentile,
+                                          find_peaks_in_rois, merge_column_intervals, lane_centers_from_band_centers)
+
+logger = logging.getLogger(__name__)
+
+
+def make_test_gel(lane_centers=(40, 100, 160), band_rows=(30, 80, 130), shape=(180, 200), band_shape=(5, 21)):
+    """Make a synthetic gel image with rectangular bands of value 1 on a zero background."""
+    img = np.zeros(shape, dtype='f')
+    for x in lane_centers:
+        for y in band_rows:
+            img[y-band_shape[0]//2:y+band_shape[0]//2+1, x-band_shape[1]//2:x+band_shape[1]//2+1] = 1
+    return img
+
+
+def test_extract_lane_profiles():
+    img = np.random.rand(50, 120).astype('f')
+    lane_centers = [5, 30.4, 60, 117]  # first and last lane are clipped by the image edges
+    profiles = extract_lane_profiles(img, lane_centers, lane_width=10)
+    assert profiles.shape == (len(lane_centers), img.shape[0])
+    col_start, col_stop = lane_column_bounds(lane_centers, 10, img.shape[1])
+    expected = np.array([img[:, start:stop].sum(axis=1) for start, stop in zip(col_start, col_stop)])
+    assert np.allclose(profiles, expected)
+
+
+def test_integrate_band_volumes():
+    profiles = np.arange(20, dtype=float).reshape(2, 10)
+    volumes = integrate_band_volumes(profiles, [0, 1, 1], [0, 2, 8], [3, 5, 12])
+    assert np.allclose(volumes, [0+1+2, 12+13+14, 18+19])
+
+
+def test_quantify_bands():
+    lane_centers, band_rows = (40, 100, 160), (30, 80, 130)
+    img = make_test_gel(lane_centers, band_rows)
+    lanes_bands_centers = OrderedDict(
+        (lane_id, OrderedDict((band_id, np.array([y, x])) for band_id, y in enumerate(band_rows)))
+        for lane_id, x in enumerate(lane_centers))
+    df = quantify_bands(img, lanes_bands_centers, lane_width=25, band_height=11)
+    assert len(df) == len(lane_centers)*len(band_rows)
+    assert np.allclose(df['volume'], 5*21)
+    assert np.allclose(df['lane_xpos'], np.repeat(lane_centers, len(band_rows)))
+
+
+def test_quantify_bands_empty_lane():
+    img = make_test_gel(lane_centers=(40,), band_rows=(30,))
+    lanes_bands_centers = OrderedDict([(0, OrderedDict([(0, np.array([30, 40]))])), (1, OrderedDict())])
+    df = quantify_bands(img, lanes_bands_centers, lane_width=25, band_height=11)
+    assert len(df) == 1
+    assert np.allclose(df['volume'], 5*21)
+    # The empty lane has no column bounds and an all-NaN profile:
+    col_start, col_stop = lane_column_bounds([40, np.nan], 25, img.shape[1])
+    assert (col_start[1], col_stop[1]) == (0, 0)
+    profiles = extract_lane_profiles(img, [40, np.nan], lane_width=25)
+    assert np.allclose(profiles[0], extract_lane_profiles(img, [40], lane_width=25)[0])
+    assert np.isnan(profiles[1]).all()
+
+
+def test_find_peaks_lane_profiles():
+    lane_centers, band_rows = (40, 100, 160), (30, 80, 130)
+    img = make_test_gel(lane_centers, band_rows)
+    peak_pos = find_peaks_lane_profiles(img, lane_width=21)
+    assert peak_pos.shape == (len(lane_centers)*len(band_rows), 2)
+    assert set(peak_pos[:, 0]) == set(band_rows)
+    assert set(peak_pos[:, 1]) == set(lane_centers)
+    # The peaks can be clustered the same way as peaks from find_peaks:
+    peaks_by_lane, lanes_bands_peaks, lanes_bands_centers = cluster_peaks_to_lanes_bands(peak_pos)
+    assert len(lanes_bands_centers) == len(lane_centers)
+    assert all(len(lane_bands) == len(band_rows) for lane_bands in lanes_bands_centers.values())
+
+
+def test_add_band_region_stats():
+    lane_centers, band_rows = (40, 100, 160), (30, 80, 130)
+    img = make_test_gel(lane_centers, band_rows)
+    img[30, 100] = 2  # One band with a higher max
+    lanes_bands_centers = OrderedDict(
+        (lane_id, OrderedDict((band_id, np.array([y, x])) for band_id, y in enumerate(band_rows)))
+        for lane_id, x in enumerate(lane_centers))
+    df = flatten_band_centers_to_dataframe(lanes_bands_centers, product_bands_dist=None)
+    df = add_band_region_stats(df, img, threshold=0.5, saturation_value=2)
+    assert len(df) == len(lane_centers)*len(band_rows)
+    assert df['region_id'].nunique() == len(df)
+    assert (df['region_area'] == 5*21).all()
+    assert np.allclose(df['region_ycom'], df['ypos'], atol=0.1)
+    assert (df['region_xstop'] - df['region_xstart'] == 21).all()
+    assert df['region_saturated'].sum() == 1
+    assert df.loc[df['region_saturated'], 'xpos'].iloc[0] == 100
+
+
+def _baseline_subtract_row_col_percentile(img, percentile=20, filters=(), window_length=17, polyorder=2):
+    """Reference: the original full-image implementation, with explicit column and row background planes."""
+    img = img - np.min(img)
+    global_max = np.max(img)
+    column_percentiles = np.percentile(img, percentile, axis=0)
+    for filter_1d in filters:
+        column_percentiles = filter_1d(column_percentiles, window_length=window_length, polyorder=polyorder)
+        column_percentiles = np.clip(column_percentiles, 0, column_percentiles.max())
+    column_background = np.vstack([column_percentiles.reshape(1, -1) for _ in range(img.shape[0])])
+    img = np.clip(img - column_background, 0, global_max)
+    row_percentiles = np.percentile(img, percentile, axis=1).reshape(-1, 1)
+    row_percentiles = np.hstack([row_percentiles for _ in range(img.shape[1])])
+    for filter_1d in filters:
+        row_percentiles = filter_1d(row_percentiles, window_length=window_length, polyorder=polyorder)
+        row_percentiles = np.clip(row_percentiles, 0, row_percentiles.max())
+    return np.clip(img - row_percentiles, 0, global_max)
+
+
+@pytest.mark.parametrize("block_rows", [None, 7])
+@pytest.mark.parametrize("filters", [(), (savgol_filter,)])
+@pytest.mark.parametrize("dtype", ['float32', 'float64', 'uint16'])
+def test_subtract_row_col_percentile(block_rows, filters, dtype):
+    img = (np.random.RandomState(0).rand(60, 45) * 1000).astype(dtype)
+    expected = _baseline_subtract_row_col_percentile(img, percentile=20, filters=filters)
+    result = subtract_row_col_percentile(img, percentile=20, block_rows=block_rows, filters=filters or None)
+    assert result.dtype == expected.dtype
+    if filters and block_rows:
+        # The filters are applied to each block of row backgrounds, which may change the rounding:
+        assert np.allclose(result, expected, rtol=0, atol=np.finfo(expected.dtype).eps * expected.max() * 4)
+    else:
+        assert np.array_equal(result, expected)
+    # Opt-in float32 working copy, e.g. for very large images:
+    result32 = subtract_row_col_percentile(img, percentile=20, block_rows=block_rows, filters=filters or None,
+                                           dtype=np.float32)
+    assert result32.dtype == np.float32
+    assert np.allclose(result32, expected, rtol=1e-4, atol=1e-2)
+
+
+def test_find_peaks_dtypes():
+    img = (make_test_gel() * 1000 + np.random.rand(180, 200) * 10).astype(np.uint16)
+    peak_pos, images = find_peaks(img, save_images=True)
+    assert len(peak_pos) > 0
+    for image, title, _ in images:
+        assert image.dtype == np.float32, title
+    assert subtract_global_percentile(img.astype(np.float32), 30).dtype == np.float32
+    assert subtract_global_percentile(img, 30).dtype == np.uint16
+
+
+
+def test_merge_column_intervals():
+    assert merge_column_intervals([10, 40, 200], [20, 50, 210], halo=15, img_width=220) == [(0, 65), (185, 220)]
+
+
+def test_find_peaks_in_rois():
+    lane_centers = (40, 80, 700)
+    img = make_test_gel(lane_centers, shape=(180, 1400)) + np.random.RandomState(0).rand(180, 1400).astype('f') * 0.05
+    expected = find_peaks(img)
+    peak_pos, strips = find_peaks_in_rois(img, lane_centers=lane_centers, lane_width=25, return_strips=True)
+    assert sum(stop - start for start, stop in strips) < img.shape[1] / 2
+    col_start, col_stop = lane_column_bounds(lane_centers, 25, img.shape[1])
+    in_lanes = np.zeros(img.shape[1], dtype=bool)
+    for start, stop in zip(col_start, col_stop):
+        in_lanes[start:stop] = True
+    expected = expected[in_lanes[expected[:, 1]]]
+    assert len(peak_pos) > 0
+    assert sorted(map(tuple, peak_pos)) == sorted(map(tuple, expected))
+
+
+def test_lane_centers_from_band_centers():
+    lanes_bands_centers = {0: {0: (10.0, 20.0), 1: (30.0, 22.0)}, 1: {}, 2: {0: (15.0, 80.0)}}
+    lane_centers = lane_centers_from_band_centers(lanes_bands_centers)
+    assert np.allclose(lane_centers[[0, 2]], [21.0, 80.0]) and np.isnan(lane_centers[1])
+    assert list(lane_centers_from_band_centers(lanes_bands_centers, [1, 2, 3])) == [1.0, 2.0, 3.0]
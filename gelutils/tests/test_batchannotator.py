@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for batchannotator.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import os
+import pytest
+import numpy
+from PIL import Image
+
+from gelutils.batchannotator import find_annotation_jobs, make_job_args, annotate_gels, group_jobs_by_gel
+
+
+def _make_gel(dirpath, name):
+    npimg = (numpy.arange(60*90) % 60000).reshape(60, 90).astype(numpy.uint16)
+    Image.fromarray(npimg).save(str(dirpath.join(name + ".tif")))
+    dirpath.join(name + ".annotations.txt").write("lane 1\nlane 2\nlane 3\n")
+
+
+def test_find_annotation_jobs(tmpdir):
+    _make_gel(tmpdir, "gel1")
+    _make_gel(tmpdir, "gel2")
+    tmpdir.join("gel2.png").write("")  # previous output, not picked up from directory
+    tmpdir.join("other.gaml").write("gelfile: gel1.tif\n")
+    jobs = find_annotation_jobs([str(tmpdir), str(tmpdir.join("*.gaml"))])
+    gel1, gel2 = str(tmpdir.join("gel1.tif")), str(tmpdir.join("gel2.tif"))
+    assert jobs == sorted([(gel1, str(tmpdir.join("gel1.gaml"))), (gel1, str(tmpdir.join("other.gaml"))),
+                           (gel2, str(tmpdir.join("gel2.gaml")))])
+
+
+def test_make_job_args_layering(tmpdir):
+    tmpdir.join("gel1.gaml").write("yoffset: 80\nypadding: 7\n")
+    jobs = [(str(tmpdir.join("gel1.tif")), str(tmpdir.join("gel1.gaml"))),
+            (str(tmpdir.join("gel2.tif")), str(tmpdir.join("gel2.gaml")))]
+    job_args = make_job_args(jobs, defaults={'yoffset': 100, 'ypadding': 5, 'fontsize': None},
+                             base_config={'fontsize': 12, 'yoffset': 90}, user_args={'ypadding': 3})
+    args1, args2 = (job['args'] for job in job_args)
+    assert (args1['yoffset'], args1['ypadding'], args1['fontsize']) == (80, 3, 12)
+    assert (args2['yoffset'], args2['ypadding'], args2['fontsize']) == (90, 3, 12)
+    assert job_args[0]['yamlsettings'] == {'yoffset': 80, 'ypadding': 7}
+
+
+def test_annotate_gels(tmpdir):
+    _make_gel(tmpdir, "gel1")
+    _make_gel(tmpdir, "gel2")
+    tmpdir.join("gel3.tif").write("not a gel")
+    defaults = {'pngfnfmt': "{gelfnroot}{ext}", 'linearize': False, 'dynamicrange': None, 'crop': None,
+                'rotate': None, 'scale': None, 'svgtopng': True}
+    job_args = make_job_args(find_annotation_jobs([str(tmpdir)]), defaults=defaults)
+    reportfile = str(tmpdir.join("report.csv"))
+    results = annotate_gels(job_args, workers=2, reportfile=reportfile)
+    status = {os.path.basename(result['gelfile']): result for result in results}
+    assert status['gel1.tif']['status'] == status['gel2.tif']['status'] == 'ok'
+    assert status['gel3.tif']['status'] == 'error'
+    assert os.path.isfile(status['gel1.tif']['svgfile'])
+    annotated = numpy.asarray(Image.open(str(tmpdir.join("gel1_annotated.png"))))
+    # The gel (the bottom 60 rows) has the full 16-bit range scaled to 8 bits, not clipped to white:
+    gel = annotated[-60:, :90, 0].astype(int)
+    expected = (numpy.arange(60*90) % 60000).reshape(60, 90) >> 8
+    assert abs(gel - expected).max() <= 1
+    assert os.path.isfile(reportfile)
+
+
+def test_annotate_gels_same_gel(tmpdir):
+    # gel1.tif is annotated from both gel1.gaml and other.gaml; the jobs write the same output files:
+    _make_gel(tmpdir, "gel1")
+    _make_gel(tmpdir, "gel2")
+    tmpdir.join("other.gaml").write("gelfile: gel1.tif\nyoffset: 80\n")
+    defaults = {'pngfnfmt': "{gelfnroot}{ext}", 'linearize': False, 'dynamicrange': None, 'crop': None,
+                'rotate': None, 'scale': None}
+    job_args = make_job_args(find_annotation_jobs([str(tmpdir), str(tmpdir.join("*.gaml"))]), defaults=defaults)
+    groups = group_jobs_by_gel(job_args)
+    assert [[os.path.basename(job['yamlfile']) for job in jobs] for jobs in groups] == [
+        ["gel1.gaml", "other.gaml"], ["gel2.gaml"]]
+    results = annotate_gels(job_args, workers=3)
+    assert len(results) == 3 and all(status['status'] == 'ok' for status in results)
+    gel1_results = [status for status in results if status['gelfile'].endswith("gel1.tif")]
+    assert [os.path.basename(status['yamlfile']) for status in gel1_results] == ["gel1.gaml", "other.gaml"]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for config.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+import os
+import time
+import pytest
+
+from gelutils import config
+from gelutils.config import load_yaml, save_yaml, yaml_get
+
+
+def test_load_yaml_cache(tmpdir):
+    fn = str(tmpdir.join("gel1.gaml"))
+    with open(fn, 'w') as fd:
+        fd.write("yoffset: 80\nxmargin: [10, 20]\n")
+    config = load_yaml(fn)
+    assert config == {'yoffset': 80, 'xmargin': [10, 20]}
+    config['xmargin'].append(30)  # The cached data is not modified by the caller
+    assert load_yaml(fn) == {'yoffset': 80, 'xmargin': [10, 20]}
+    with open(fn, 'w') as fd:
+        fd.write("yoffset: 90\n")
+    os.utime(fn, ns=(os.stat(fn).st_atime_ns, os.stat(fn).st_mtime_ns + 10**9))
+    assert load_yaml(fn) == {'yoffset': 90}
+    assert yaml_get(str(tmpdir.join("missing.gaml")), default={}) == {}
+
+
+def test_save_yaml_skip_unchanged(tmpdir):
+    fn = str(tmpdir.join("gel1.gaml"))
+    args = {'yoffset': 80, 'crop': (1, 2, 3, 4), 'gelfile': 'gel1.gel'}
+    assert save_yaml(fn, args) is True
+    assert load_yaml(fn) == dict(args, crop=[1, 2, 3, 4])
+    mtime = os.stat(fn).st_mtime_ns
+    assert save_yaml(fn, dict(args)) is False
+    assert save_yaml(fn, dict(args, crop=[1, 2, 3, 4])) is False
+    assert os.stat(fn).st_mtime_ns == mtime
+    assert save_yaml(fn, dict(args, yoffset=90)) is True
+    assert load_yaml(fn)['yoffset'] == 90
+
+
+def test_load_yaml_racy_edit(tmpdir, monkeypatch):
+    # A same-size edit within the mtime resolution (here: the same mtime) is not missed for a recent file:
+    fn = str(tmpdir.join("gel1.gaml"))
+    with open(fn, 'w') as fd:
+        fd.write("yoffset: 80\n")
+    stat = os.stat(fn)
+    assert load_yaml(fn) == {'yoffset': 80}
+    with open(fn, 'w') as fd:
+        fd.write("yoffset: 90\n")
+    os.utime(fn, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_yaml(fn) == {'yoffset': 90}
+    # Once the file is older than the racy window, the cached data is used without reading the file:
+    monkeypatch.setattr(time, 'time', lambda: stat.st_mtime_ns/1e9 + config.dirindex.RACY_WINDOW + 1)
+    assert load_yaml(fn) == {'yoffset': 90}
+    with open(fn, 'w') as fd:
+        fd.write("yoffset: 70\n")
+    os.utime(fn, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert load_yaml(fn) == {'yoffset': 90}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for dirindex.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+import os
+import pytest
+
+from gelutils import dirindex
+from gelutils.dirindex import DirectoryIndex
+from gelutils.gelannotator import find_annotationsfilepath
+
+
+def _age_dir(dirpath, seconds=10):
+    """Set the directory mtime back in time, so the listing is outside the racy window."""
+    mtime = os.stat(str(dirpath)).st_mtime - seconds
+    os.utime(str(dirpath), (mtime, mtime))
+
+
+def test_directory_index(tmpdir):
+    for fn in ("gel1.gel", "gel1.annotations.txt", "gel1 [SYBR Gold].txt", ".hidden.txt"):
+        tmpdir.join(fn).write("")
+    tmpdir.mkdir("subdir.txt")
+    _age_dir(tmpdir)
+    index = DirectoryIndex()
+    assert index.isfile(str(tmpdir.join("gel1.gel")))
+    assert not index.isfile(str(tmpdir.join("subdir.txt")))
+    assert not index.isfile(str(tmpdir.join("missing", "gel1.gel")))
+    assert sorted(index.glob(str(tmpdir.join("gel1*.txt")))) == [
+        str(tmpdir.join("gel1 [SYBR Gold].txt")), str(tmpdir.join("gel1.annotations.txt"))]
+    assert (index.hits, index.misses) == (2, 1)
+
+    # A new file changes the directory mtime, so the directory is listed again:
+    tmpdir.join("gel2.gel").write("")
+    _age_dir(tmpdir, seconds=5)
+    assert index.isfile(str(tmpdir.join("gel2.gel")))
+    assert index.misses == 2
+
+
+def test_directory_index_racy(tmpdir):
+    index = DirectoryIndex()
+    assert not index.isfile(str(tmpdir.join("gel1.gel")))
+    # The first listing was made right after the directory changed, so it is not trusted:
+    tmpdir.join("gel1.gel").write("")
+    os.utime(str(tmpdir), ns=(index._listings[str(tmpdir)][0],)*2)
+    assert index.isfile(str(tmpdir.join("gel1.gel")))
+
+
+def test_find_annotationsfilepath_precedence(tmpdir):
+    dirindex.default_index.invalidate()
+    base = str(tmpdir.join("gel1"))
+    tmpdir.join("gel1_samples.txt").write("")
+    assert find_annotationsfilepath([base + ".gel"], fallback=False) == base + "_samples.txt"
+    tmpdir.join("gel1.txt").write("")
+    assert find_annotationsfilepath([base + ".gel"], fallback=False) == base + ".txt"
+    tmpdir.join("gel1.annotations.txt").write("")
+    assert find_annotationsfilepath([base + ".gel"], fallback=False) == base + ".annotations.txt"
+    with pytest.raises(ValueError):
+        find_annotationsfilepath([str(tmpdir.join("other.gel"))], fallback=False)
@@ -29,3 +29,76 @@ import pytest
 import logging
 logger = logging.getLogger(__name__)
 
+
+import io
+import base64
+import numpy
+from PIL import Image
+
+from gelutils import gelannotator
+from gelutils.gelannotator import make_svg
+from gelutils.raster_annotation import save_annotated_pngs, render_annotated_image
+
+
+def test_make_svg_in_memory(tmpdir):
+    pngfile = str(tmpdir.join("gel.png"))
+    Image.new('L', (120, 80), 200).save(pngfile)
+    args = dict(pngfile=pngfile, embed=False, svgfnfmt="{pngfnroot}_annotated.svg")
+    dwg, svgfilename, svgdata = make_svg(pngfile, args, laneannotations=["a", "b", "c"],
+                                         pngimage=Image.open(pngfile), return_svgdata=True)
+    with open(svgfilename, encoding='utf-8') as fp:
+        assert fp.read() == svgdata
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_make_svg_streamed_embedding(tmpdir, monkeypatch, in_memory):
+    # Several chunks, the last one partial:
+    monkeypatch.setattr(gelannotator, 'EMBED_CHUNK_LINES', 2)
+    pngfile = str(tmpdir.join("gel.png"))
+    Image.fromarray((numpy.random.RandomState(0).rand(40, 60)*255).astype(numpy.uint8)).save(pngfile)
+    with open(pngfile, 'rb') as fp:
+        pngdata = fp.read()
+    args = dict(pngfile=pngfile, embed=True, svgfnfmt="{pngfnroot}_annotated.svg")
+    dwg, svgfilename, svgdata = make_svg(pngfile, args, laneannotations=["a", "b", "c"],
+                                         pngdata=pngdata if in_memory else None, return_svgdata=True)
+    assert svgdata is None
+    # Reference: the drawing with the image data in the href, serialized by svgwrite:
+    image = dwg.elements[1].elements[0]
+    image['xlink:href'] = image['xlink:href'].replace(gelannotator.EMBED_PLACEHOLDER,
+                                                      base64.encodebytes(pngdata).decode())
+    buf = io.StringIO()
+    dwg.write(buf)
+    with open(svgfilename, encoding='utf-8') as fp:
+        assert fp.read() == buf.getvalue()
+
+
+def test_save_annotated_pngs(tmpdir):
+    pngfile = str(tmpdir.join("gel.png"))
+    Image.new('L', (120, 80), 200).save(pngfile)
+    args = dict(pngfile=pngfile, embed=False, svgfnfmt="{pngfnroot}_annotated.svg", yoffset=50,
+                fontsize=12)
+    info = {}
+    _, svgfilename = make_svg(pngfile, args, laneannotations=["a", "bb", "ccc"], info=info)
+    layout = info['layout']
+    assert (layout['width'], layout['height']) == (120, 130)
+    fns = save_annotated_pngs(Image.open(pngfile), layout, svgfilename.replace('.svg', '.png'), dpis=[96, 192])
+    images = [Image.open(fn) for fn in fns]
+    assert [img.size for img in images] == [(120, 130), (240, 260)]
+    arr = numpy.asarray(images[0])
+    # Gel image below yoffset, annotations (opaque black text) in the transparent area above:
+    assert (arr[50:, :, 0] == 200).all() and (arr[50:, :, 1] == 255).all()
+    assert arr[:45, :, 1].max() == 255 and arr[:45, :, 0][arr[:45, :, 1] == 255].max() == 0
+
+
+@pytest.mark.parametrize("mode", ['I;16', 'I', 'F'])
+def test_render_annotated_image_16bit(mode):
+    # 16-bit gel (e.g. converted with dynamicrange: None) is scaled to 8 bits, not clipped at 255:
+    npimg = (numpy.arange(60*90) * 12).reshape(60, 90).astype(numpy.uint16)
+    image = Image.fromarray(npimg)
+    if mode != 'I;16':
+        image = image.convert(mode)
+    layout = {'width': 90, 'height': 60, 'imgwidth': 90, 'imgheight': 60, 'yoffset': 0, 'ypadding': 0,
+              'texts': [], 'lane_xpositions': [], 'fontfamily': 'sans-serif', 'fontweight': 'bold',
+              'fontsize': 12, 'textrotation': 0}
+    arr = numpy.asarray(render_annotated_image(image, layout))
+    assert (arr[:, :, 0] == (npimg >> 8)).all()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for gelquant.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import os
+import pytest
+import logging
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from gelutils.gelquant import main, find_gel_files, read_progress, quantify_gel
+from gelutils.arraycache import ArrayCache
+from gelutils.tests.test_band_quantification import make_test_gel
+
+logger = logging.getLogger(__name__)
+
+
+def write_test_gels(tmpdir, n=2):
+    """Write n synthetic 16-bit PNG gels to tmpdir, plus one file that is not a valid image."""
+    for i in range(n):
+        img = make_test_gel() * 1000 + 100
+        Image.fromarray(img.astype(np.uint16)).save(os.path.join(tmpdir, "gel%s.png" % i))
+    with open(os.path.join(tmpdir, "broken.png"), 'w') as fp:
+        fp.write("not a png file")
+
+
+def test_gelquant_main(tmp_path):
+    gel_dir = str(tmp_path)
+    write_test_gels(gel_dir)
+    output = os.path.join(gel_dir, "bands.csv")
+    argv = [gel_dir, '--output', output, '--mode', '1d', '--band-shape', '5', '21', '--workers', '2',
+            '--cache-dir', str(tmp_path / "cache")]
+    assert len(find_gel_files([gel_dir])) == 3
+    assert main(argv) == 1  # one gel failed
+
+    df = pd.read_csv(output)
+    assert set(df['gel_id']) == {os.path.join(gel_dir, "gel0.png"), os.path.join(gel_dir, "gel1.png")}
+    assert len(df) == 2 * 9  # 3 lanes x 3 bands per gel
+    assert (df['volume'] > 0).all()
+    assert read_progress(output + '.progress') == set(df['gel_id'])
+    errors = pd.read_csv(output + '.errors.csv')
+    assert list(errors['gel_id']) == [os.path.join(gel_dir, "broken.png")]
+
+    # Resume: completed gels are skipped and no duplicate rows are added:
+    os.remove(os.path.join(gel_dir, "broken.png"))
+    assert main(argv) == 0
+    assert len(pd.read_csv(output)) == len(df)
+
+
+def test_quantify_gel_lane_centers(tmp_path):
+    gelfile = os.path.join(str(tmp_path), "gel.png")
+    img = make_test_gel() * 1000 + np.random.RandomState(0).rand(180, 200) * 20 + 100
+    Image.fromarray(img.astype(np.uint16)).save(gelfile)
+    df = quantify_gel(gelfile, {'band_shape': (5, 21), 'lane_centers': [40, 100, 160]})
+    assert len(df) > 0
+    assert (np.abs(df['xpos'].values[:, np.newaxis] - [40, 100, 160]).min(axis=1) <= 11).all()
+
+
+@pytest.mark.parametrize("lane_centers", [None, [40, 100, 160]])
+def test_quantify_gel_cache(tmp_path, lane_centers):
+    gelfile = os.path.join(str(tmp_path), "gel.png")
+    img = make_test_gel() * 1000 + np.random.RandomState(0).rand(180, 200) * 20 + 100
+    Image.fromarray(img.astype(np.uint16)).save(gelfile)
+    args = {'band_shape': (5, 21), 'lane_centers': lane_centers}
+    expected = quantify_gel(gelfile, args)
+    cache = ArrayCache(str(tmp_path / "cache"))
+    pd.testing.assert_frame_equal(quantify_gel(gelfile, args, cache=cache), expected)
+    assert cache.misses > 0
+    # Warm restart: the gel image, background and find_peaks stages are all loaded from the cache:
+    cache = ArrayCache(str(tmp_path / "cache"))
+    pd.testing.assert_frame_equal(quantify_gel(gelfile, args, cache=cache), expected)
+    assert cache.misses == 0 and cache.hits >= 8
@@ -30,9 +30,14 @@ assert value == expected_value
 
 import pytest
 import logging
+import numpy
+from PIL import Image
 
 # Tests are run from main directory
-from geltransformer import get_pmt_string, has_pmt_string, find_dynamicrange, processimage, get_gel, convert
+from gelutils.geltransformer import get_pmt_string, has_pmt_string, find_dynamicrange, processimage, get_gel, convert
+from gelutils.geltransformer import linearize_pixel_values, adjust_dynamic_range, get_gel_array
+from gelutils.geltransformer import preview_image, read_image_rows
+from gelutils.config import get_dtype_policy
 
 logger = logging.getLogger(__name__)
 
@@ -47,3 +52,112 @@ def test_has_pmt():
         assert has_pmt_string(fn) is not None
     for fn in hasnot:
         assert has_pmt_string(fn) is None
+
+
+def test_get_dtype_policy():
+    policy = get_dtype_policy()
+    assert policy['storage_dtype'] == numpy.uint16
+    assert policy['compute_dtype'] == numpy.float32
+    assert policy['accumulate_dtype'] == numpy.float64
+    assert get_dtype_policy({'compute_dtype': 'float64'})['compute_dtype'] == numpy.float64
+
+
+def test_linearize_pixel_values_dtype():
+    npimg = numpy.arange(1, 65536, 7, dtype=numpy.uint16).reshape(1, -1)
+    scalefactor = (1, 21474.83)
+    linearized = linearize_pixel_values(npimg, scalefactor)
+    assert linearized.dtype == numpy.float32
+    assert npimg.dtype == numpy.uint16  # input is not modified
+    expected = npimg.astype(numpy.float64)**2 / scalefactor[1]
+    assert numpy.allclose(linearized, expected, rtol=1e-6)
+    assert linearize_pixel_values(npimg, scalefactor, dtype='float64').dtype == numpy.float64
+
+
+@pytest.mark.parametrize("invert", [False, True])
+def test_adjust_dynamic_range(invert):
+    npimg = numpy.linspace(0, 5000, 40*50, dtype=numpy.float32).reshape(40, 50)
+    dr_low, dr_high = 1000, 4000
+    maxval = 255
+    args = {'dynamicrange': [dr_low, dr_high], 'invert': invert}
+    adjusted = adjust_dynamic_range(npimg, args, {}, 'L')
+    assert adjusted.dtype == numpy.float64
+    # Reference: the element-wise definition of the adjustment:
+    scaled = maxval * (npimg.astype(numpy.float64) - dr_low) / (dr_high - dr_low)
+    expected = numpy.clip(maxval - scaled if invert else scaled, 0, maxval)
+    assert numpy.allclose(adjusted, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize("invert", [False, True])
+def test_linearize_adjust_dynamic_range_regression(invert):
+    # The converted (uint8) pixels must be identical to the original element-wise implementation:
+    # npimg = (uint32 npimg**2)/scalefactor; numpy.vectorize(adjust_fun)(npimg).astype('uint8')
+    raw = numpy.random.RandomState(0).randint(0, 65536, size=(400, 500)).astype(numpy.uint16)
+    scalefactor = (1, 21474.83)
+    dr_low, dr_high, minval, maxval = 0, 200000, 0, 255
+
+    def adjust_fun(val):
+        if val <= dr_low:
+            return maxval if invert else minval
+        elif val >= dr_high:
+            return minval if invert else maxval
+        if invert:
+            return maxval*((dr_high - val)/(dr_high - dr_low)) + minval
+        return maxval*((val - dr_low)/(dr_high - dr_low)) + minval
+
+    expected = numpy.vectorize(adjust_fun)((raw.astype(numpy.uint32)**2)/scalefactor[1]).astype('uint8')
+    npimg = raw.astype(numpy.float32)  # as in processimage()
+    npimg = linearize_pixel_values(npimg, scalefactor, dtype=numpy.float64)
+    args = {'dynamicrange': [dr_low, dr_high], 'invert': invert}
+    assert numpy.array_equal(adjust_dynamic_range(npimg, args, {}, 'L').astype('uint8'), expected)
+
+
+def test_get_gel_array_dtype(tmpdir):
+    npimg = (numpy.arange(60*80) % 60000).reshape(60, 80).astype(numpy.uint16)
+    filepath = str(tmpdir.join("gel.png"))
+    Image.fromarray(npimg).save(filepath)
+    loaded, info = get_gel_array(filepath)
+    assert loaded.dtype == numpy.uint16
+    assert numpy.array_equal(loaded, npimg)
+    assert not info['linearized']
+
+
+
+@pytest.mark.parametrize("mode", ['bin', 'stride'])
+def test_preview_image(tmpdir, mode):
+    npimg = (numpy.random.RandomState(0).rand(120, 80) * 60000).astype(numpy.uint16)
+    filepath = str(tmpdir.join("gel.tif"))
+    Image.fromarray(npimg).save(filepath)
+    assert numpy.array_equal(read_image_rows(Image.open(filepath), 4), npimg[::4])
+    rows = npimg if mode == 'bin' else numpy.repeat(npimg[::4], 4, axis=0)
+    blocks = rows.astype(float).reshape(30, 4, 20, 4)
+    preview = preview_image(Image.open(filepath), 4, rms=True, mode=mode)
+    assert preview.mode == 'F' and preview.size == (20, 30)
+    # RMS binning makes the linearized preview equal to the mean of the linearized pixels:
+    assert numpy.allclose(numpy.asarray(preview)**2, (blocks**2).mean(axis=(1, 3)), rtol=1e-5)
+    preview = preview_image(Image.open(filepath), 4, mode=mode)
+    assert preview.mode == 'I;16'
+    assert numpy.abs(numpy.asarray(preview) - blocks.mean(axis=(1, 3))).max() <= 0.5
+
+
+def test_get_gel_preview_scale(tmpdir):
+    npimg = (numpy.arange(200*160) % 60000).reshape(200, 160).astype(numpy.uint16)
+    filepath = str(tmpdir.join("gel.png"))
+    Image.fromarray(npimg).save(filepath)
+    args = dict(preview_scale=4, crop=[20, 40, 140, 120], linearize=False, dynamicrange=None,
+                invert=False, rotate=None, scale=None, crop_update_to_absolute=True)
+    gelimg, info = get_gel(filepath, args)
+    assert info['preview_scale'] == 4
+    assert gelimg.size == (30, 20)
+    assert args['crop'] == [20, 40, 140, 120]  # still full-resolution coordinates
+
+
+def test_convert_return_encoded(tmpdir):
+    npimg = (numpy.arange(60*80) % 60000).reshape(60, 80).astype(numpy.uint16)
+    filepath = str(tmpdir.join("gel.tif"))
+    Image.fromarray(npimg).save(filepath)
+    args = dict(linearize=False, dynamicrange=None, invert=False, crop=None, rotate=None, scale=None,
+                convertgelto='png', pngfnfmt="{gelfnroot}.png")
+    gelimg, info, encoded = convert(filepath, args, return_encoded=True)
+    with open(str(tmpdir.join(args['pngfile'])), 'rb') as fp:
+        assert fp.read() == encoded
+    assert gelimg.size == (80, 60)
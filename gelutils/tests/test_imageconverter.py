@@ -28,11 +28,54 @@ assert value == expected_value
 
 """
 
+import os
 import pytest
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from gelutils import imageconverter
+from gelutils.imageconverter import svg2png, svg2png_batch, imagemagick_available
+
 logger = logging.getLogger(__name__)
 
 
 @pytest.mark.skipif(True, reason="Not ready yet")
 def test_argsnstodict():
     pass
+
+
+def test_imagemagick_available_cached(monkeypatch):
+    calls = []
+    monkeypatch.setattr(imageconverter.shutil, 'which', lambda cmd: calls.append(cmd) or None)
+    imageconverter.find_imagemagick.cache_clear()
+    try:
+        assert not imagemagick_available()
+        assert not imagemagick_available()
+        assert calls == ['convert']
+    finally:
+        imageconverter.find_imagemagick.cache_clear()
+
+
+def test_svg2png_keeps_cwd(tmpdir, monkeypatch):
+    svgfile = str(tmpdir.mkdir("svgs").join("gel.svg"))
+    with open(svgfile, 'w') as fp:
+        fp.write('<svg xmlns="http://www.w3.org/2000/svg" width="10px" height="10px"/>')
+    converted = []
+
+    def fake_convert(inputfilepath, target='png', **kwargs):
+        converted.append((inputfilepath, os.getcwd()))
+        return os.path.splitext(inputfilepath)[0] + '.' + target
+
+    monkeypatch.setattr(imageconverter, 'imagemagick_convert', fake_convert)
+    cwd = os.getcwd()
+    assert svg2png(svgfile, tool='imagemagick') == os.path.abspath(svgfile[:-4] + '.png')
+    assert converted == [(svgfile, cwd)]
+
+
+def test_svg2png_batch_no_tools(tmpdir, monkeypatch):
+    # The patch is only seen by the conversions if they run in this process, so use a thread pool:
+    monkeypatch.setattr(imageconverter, 'cairosvg_available', lambda: False)
+    svgfiles = [str(tmpdir.join("gel%s.svg" % i)) for i in range(3)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        assert svg2png_batch(svgfiles, tool='cairo', executor=executor) == [None, None, None]
+
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for incremental.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+import os
+import time
+import pytest
+import numpy
+from PIL import Image
+
+from gelutils.incremental import stage_fingerprint, PNG_STAGE_ARGS
+from gelutils.batchannotator import find_annotation_jobs, make_job_args, annotate_gels
+
+DEFAULTS = {'pngfnfmt': "{gelfnroot}{ext}", 'linearize': False, 'dynamicrange': None, 'crop': None,
+            'rotate': None, 'scale': None, 'svgtopng': True, 'incremental': True}
+
+
+def _make_gel(dirpath, name):
+    npimg = (numpy.arange(60*90) % 60000).reshape(60, 90).astype(numpy.uint16)
+    Image.fromarray(npimg).save(str(dirpath.join(name + ".tif")))
+    dirpath.join(name + ".annotations.txt").write("lane 1\nlane 2\nlane 3\n")
+
+
+def _run(tmpdir, **kwargs):
+    job_args = make_job_args(find_annotation_jobs([str(tmpdir)]), defaults=dict(DEFAULTS, **kwargs))
+    results = annotate_gels(job_args, workers=1)
+    return {os.path.basename(result['gelfile']): result for result in results}
+
+
+def _mtimes(tmpdir):
+    return {path.basename: path.mtime() for path in tmpdir.listdir() if path.ext != '.txt'}
+
+
+def test_stage_fingerprint(tmpdir):
+    gelfile = tmpdir.join("gel.tif")
+    gelfile.write("data")
+    args = {'rotate': 2, 'crop': None, 'unrelated': 1}
+    fingerprint = stage_fingerprint('png', args, PNG_STAGE_ARGS, files=[str(gelfile)])
+    assert fingerprint == stage_fingerprint('png', dict(args, unrelated=2), PNG_STAGE_ARGS, files=[str(gelfile)])
+    assert fingerprint != stage_fingerprint('png', dict(args, rotate=3), PNG_STAGE_ARGS, files=[str(gelfile)])
+    gelfile.write("other data")
+    assert fingerprint != stage_fingerprint('png', args, PNG_STAGE_ARGS, files=[str(gelfile)])
+
+
+def test_incremental_annotate(tmpdir):
+    _make_gel(tmpdir, "gel1")
+    _make_gel(tmpdir, "gel2")
+    status = _run(tmpdir)
+    assert [status[gel]['rebuilt'] for gel in ('gel1.tif', 'gel2.tif')] == ['png svg svgtopng']*2
+    before = _mtimes(tmpdir)
+    assert 'gel1_annotated.svg' in before and 'gel1_annotated.png' in before
+
+    time.sleep(0.01)
+    status = _run(tmpdir)
+    assert status['gel1.tif']['status'] == status['gel2.tif']['status'] == 'up-to-date'
+    assert _mtimes(tmpdir) == before
+
+    # Editing an annotations file only rebuilds that gel's svg (and annotated png):
+    tmpdir.join("gel1.annotations.txt").write("lane A\nlane B\nlane C\n")
+    status = _run(tmpdir, dry_run=True)
+    assert (status['gel1.tif']['status'], status['gel1.tif']['rebuilt']) == ('dry-run', 'svg svgtopng')
+    assert status['gel2.tif']['rebuilt'] == ''
+    assert _mtimes(tmpdir) == before
+
+    status = _run(tmpdir)
+    assert status['gel1.tif']['rebuilt'] == 'svg svgtopng'
+    after = _mtimes(tmpdir)
+    changed = {fn for fn in after if after[fn] != before[fn]}
+    assert changed <= {'gel1_annotated.svg', 'gel1_annotated.png', 'gel1.gaml'}
+    assert 'gel1_annotated.svg' in changed
+    assert 'lane A' in tmpdir.join("gel1_annotated.svg").read()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for lane_detection.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import numpy as np
+
+from gelutils.lane_detection import find_lane_positions, lane_pitch_autocorrelation
+
+
+def make_lanes_gel(lane_xpos, shape=(400, 600), lane_width=24, well_rows=(20, 32), dark_bands=True):
+    """Make a synthetic gel image with wells at lane_xpos and a few bands in each lane."""
+    img = np.full(shape, 10.0)
+    for x in lane_xpos:
+        x0, x1 = int(x - lane_width/2), int(x + lane_width/2)
+        img[well_rows[0]:well_rows[1], x0:x1] = 200
+        img[150:156, x0:x1] = 120
+        img[260:265, x0:x1] = 80
+    img += np.random.RandomState(0).normal(0, 2, shape)
+    if dark_bands:
+        img = 255 - img
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def test_lane_pitch_autocorrelation():
+    x = np.arange(500)
+    profile = (np.sin(2*np.pi*x/37.5) > 0.3).astype(float)
+    assert abs(lane_pitch_autocorrelation(profile) - 37.5) < 0.5
+
+
+def test_find_lane_positions():
+    lane_xpos = 50 + 45.5*np.arange(12)
+    img = make_lanes_gel(lane_xpos)
+    positions = find_lane_positions(img)
+    assert len(positions) == len(lane_xpos)
+    assert np.abs(positions - (lane_xpos - 0.5)).max() < 1.5
+
+
+def test_find_lane_positions_missing_well():
+    lane_xpos = 50 + 45.5*np.arange(12)
+    img = make_lanes_gel(np.delete(lane_xpos, 4), dark_bands=False)
+    positions = find_lane_positions(img, n_lanes=12)
+    assert len(positions) == 12
+    assert np.abs(positions - (lane_xpos - 0.5)).max() < 1.5
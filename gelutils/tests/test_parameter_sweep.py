@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for parameter_sweep.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import threading
+from collections import OrderedDict, Counter
+import pytest
+import logging
+import numpy as np
+
+from gelutils.parameter_sweep import (Stage, FIND_PEAKS_STAGES, expand_param_grid, build_stage_tree, sweep,
+                                     score_peaks)
+from gelutils.band_quantification import find_peaks
+from gelutils.tests.test_band_quantification import make_test_gel
+
+logger = logging.getLogger(__name__)
+
+
+def make_counting_stages(calls):
+    """Make three simple stages that count how many times each is called."""
+    lock = threading.Lock()
+
+    def counted(name, func):
+        def stage_func(data, **params):
+            with lock:
+                calls[name] += 1
+            return func(data, **params)
+        return stage_func
+
+    return (
+        Stage('add', OrderedDict([('a', 0)]), counted('add', lambda data, a: data + a)),
+        Stage('mul', OrderedDict([('b', 1)]), counted('mul', lambda data, b: data * b)),
+        Stage('peaks', OrderedDict([('c', 0)]), counted('peaks', lambda data, c: np.array([[data[0, 0] + c, 0]]))),
+    )
+
+
+def test_sweep_shares_stage_prefixes():
+    calls = Counter()
+    stages = make_counting_stages(calls)
+    param_grid = {'a': [1, 2], 'b': [10, 20, 30], 'c': [0, 5]}
+    img = np.zeros((4, 4))
+    df, outputs = sweep(img, param_grid, stages=stages, return_outputs=True, max_workers=4)
+    assert len(df) == 12
+    assert calls == {'add': 2, 'mul': 6, 'peaks': 12}
+    for (_, row), output in zip(df.iterrows(), outputs):
+        assert output[0, 0] == row['a'] * row['b'] + row['c']
+    assert (df['n_peaks'] == 1).all()
+
+
+def test_build_stage_tree():
+    calls = Counter()
+    stages = make_counting_stages(calls)
+    param_sets = expand_param_grid({'b': [10, 20]}, stages)
+    assert param_sets == [{'a': 0, 'b': 10, 'c': 0}, {'a': 0, 'b': 20, 'c': 0}]
+    levels = build_stage_tree(param_sets, stages)
+    assert [len(level) for level in levels] == [1, 2, 2]
+    assert levels[1][(0, 20)] == ((0,), {'b': 20})
+    with pytest.raises(ValueError):
+        expand_param_grid({'d': [1]}, stages)
+
+
+def test_score_peaks():
+    ground_truth = [(10, 10), (20, 10), (30, 10)]
+    detected = [(11, 10), (20, 12), (50, 50), (51, 50)]
+    scores = score_peaks(detected, ground_truth, tolerance=3)
+    assert scores['n_matched'] == 2
+    assert scores['precision'] == 0.5
+    assert scores['recall'] == pytest.approx(2/3)
+    assert scores['f1'] == pytest.approx(2 * 0.5 * 2/3 / (0.5 + 2/3))
+    assert score_peaks([], ground_truth)['f1'] == 0
+
+
+def test_sweep_default_params_match_find_peaks():
+    # The sweep runs the same stage functions as find_peaks(), so the default parameters give the same peaks:
+    img = make_test_gel() * 1000 + np.random.RandomState(0).rand(180, 200) * 20 + 100
+    stages = FIND_PEAKS_STAGES[:-1]  # without clustering
+    _, outputs = sweep(img, {'min_distance': [10]}, stages=stages, return_outputs=True)
+    assert np.array_equal(outputs[0], find_peaks(img))
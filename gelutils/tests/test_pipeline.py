@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for pipeline.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+import os
+import io
+import sys
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import numpy
+from PIL import Image
+
+from gelutils.pipeline import convert_gels, convert_gel_serial, main
+from gelutils.geltransformer import convert, convert_bytes
+
+ARGS = {'linearize': False, 'dynamicrange': None, 'pngfnfmt': "{gelfnroot}{ext}"}
+
+
+def _make_gels(tmpdir, n=5):
+    gelfiles = []
+    for i in range(n):
+        npimg = ((numpy.arange(60*90) * (i + 1)) % 60000).reshape(60, 90).astype(numpy.uint16)
+        gelfiles.append(str(tmpdir.join("gel%s.tif" % i)))
+        Image.fromarray(npimg).save(gelfiles[-1])
+    return gelfiles
+
+
+def test_convert_gels(tmpdir):
+    gelfiles = _make_gels(tmpdir)
+    broken = str(tmpdir.join("broken.tif"))
+    with open(broken, 'w') as fp:
+        fp.write("not a gel")
+    inputs = gelfiles[:2] + [broken] + gelfiles[2:]
+    results = list(convert_gels(inputs, ARGS, workers=2, prefetch=3))
+    assert [result['gelfile'] for result in results] == inputs
+    assert [result['error'] is None for result in results] == [True, True, False, True, True, True]
+    # Same output as convert() and the serial loop:
+    result = results[0]
+    with open(result['pngfile'], 'rb') as fp:
+        pipeline_data = fp.read()
+    assert result['nbytes'] == len(pipeline_data)
+    _, _, encoded = convert(gelfiles[0], dict(ARGS), return_encoded=True)
+    assert encoded == pipeline_data
+    serial = convert_gel_serial(gelfiles[0], ARGS)
+    assert serial['error'] is None and serial['pngfile'] == result['pngfile']
+    assert result['args']['pngfile'] == "gel0.png"
+
+
+def test_convert_gels_backpressure(tmpdir):
+    gelfiles = _make_gels(tmpdir, n=6)
+    consumed = []
+
+    def gen():
+        for gelfile in gelfiles:
+            consumed.append(gelfile)
+            yield gelfile
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        results = convert_gels(gen(), ARGS, prefetch=2, compute_executor=executor)
+        first = next(results)
+        assert first['gelfile'] == gelfiles[0]
+        assert len(consumed) <= 3
+        assert [result['gelfile'] for result in results] == gelfiles[1:]
+
+
+def test_gel2png_main(tmpdir):
+    _make_gels(tmpdir, n=3)
+    assert main([str(tmpdir.join("*.tif")), '--no-linearize', '--pngfnfmt', "{gelfnroot}{ext}",
+                 '--workers', '2', '--prefetch', '2']) == 0
+    assert all(os.path.isfile(str(tmpdir.join("gel%s.png" % i))) for i in range(3))
+
+
+class _Stream(io.RawIOBase):
+    """Non-seekable binary stream, like a pipe."""
+
+    def __init__(self, data):
+        self._fp = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._fp.readinto(b)
+
+
+def test_convert_bytes(tmpdir):
+    gelfile = _make_gels(tmpdir, n=1)[0]
+    _, _, expected = convert(gelfile, dict(ARGS), return_encoded=True)
+    with open(gelfile, 'rb') as fp:
+        data = fp.read()
+    args = dict(ARGS)
+    encoded, info = convert_bytes(data, args)
+    assert encoded == expected
+    assert 'width_after' in info and args['convertgelto'] == 'png'
+    encoded, _ = convert_bytes(io.BufferedReader(_Stream(data)), dict(ARGS))
+    assert encoded == expected
+    assert sorted(tmpdir.listdir()) == [tmpdir.join("gel0.png"), tmpdir.join("gel0.tif")]
+
+
+def test_gel2png_stdin_stdout(tmpdir):
+    gelfile = _make_gels(tmpdir, n=1)[0]
+    _, _, expected = convert(gelfile, dict(ARGS), return_encoded=True)
+    with open(gelfile, 'rb') as fp:
+        data = fp.read()
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    proc = subprocess.run([sys.executable, '-m', 'gelutils.pipeline', '-', '-', '--no-linearize'],
+                          input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, check=True)
+    assert proc.stdout == expected
+    proc = subprocess.run([sys.executable, '-m', 'gelutils.pipeline', gelfile, '-', '--no-linearize'],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, check=True)
+    assert proc.stdout == expected
+    outfile = str(tmpdir.join("out.png"))
+    stdin = sys.stdin
+    sys.stdin = io.TextIOWrapper(io.BytesIO(data))
+    try:
+        assert main(['-', outfile, '--no-linearize']) == 0
+    finally:
+        sys.stdin = stdin
+    with open(outfile, 'rb') as fp:
+        assert fp.read() == expected
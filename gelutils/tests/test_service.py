@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for service.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+import io
+import os
+import json
+import base64
+import threading
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError
+import pytest
+import numpy
+from PIL import Image
+
+from gelutils.service import GelutilsService, serve_stdio, make_http_server, run_job
+from gelutils.tests.test_band_quantification import make_test_gel
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = GelutilsService(workers=2, load_system_config=False)
+    yield service
+    service.close()
+
+
+def _make_gel(dirpath, name):
+    npimg = (numpy.arange(60*90) % 60000).reshape(60, 90).astype(numpy.uint16)
+    Image.fromarray(npimg).save(str(dirpath.join(name + ".tif")))
+    dirpath.join(name + ".annotations.txt").write("lane 1\nlane 2\nlane 3\n")
+    return str(dirpath.join(name + ".tif"))
+
+
+def test_serve_stdio(service, tmpdir):
+    gelfile = _make_gel(tmpdir, "gel1")
+    args = {'linearize': False, 'pngfnfmt': "{gelfnroot}{ext}"}
+    requests = [
+        {'id': 1, 'job': 'convert', 'gelfile': gelfile, 'args': args, 'return_data': True},
+        {'id': 2, 'job': 'annotate', 'gelfile': gelfile, 'args': dict(args, svgtopng=True)},
+        {'id': 3, 'job': 'quantify', 'gelfile': str(tmpdir.join("missing.gel"))},
+    ]
+    stdin = io.StringIO("\n".join(json.dumps(request) for request in requests) + "\nnot json\n")
+    stdout = io.StringIO()
+    serve_stdio(service, stdin=stdin, stdout=stdout)
+    responses = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert len(responses) == 4
+    by_id = {response['id']: response for response in responses}
+    assert by_id[1]['status'] == 'ok' and by_id[1]['result']['pngfile'] == str(tmpdir.join("gel1.png"))
+    assert base64.b64decode(by_id[1]['result']['pngdata'])[:8] == b'\x89PNG\r\n\x1a\n'
+    assert by_id[2]['status'] == 'ok' and os.path.isfile(by_id[2]['result']['svgfile'])
+    assert os.path.isfile(by_id[2]['result']['annotated_pngfile'])
+    assert by_id[2]['total_seconds'] >= by_id[2]['seconds']
+    assert by_id[3]['status'] == 'error' and by_id[3]['error']
+    assert by_id[None]['status'] == 'error'
+
+
+def test_serve_http(service, tmpdir):
+    gelfile = _make_gel(tmpdir, "gel1")
+    server = make_http_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = "http://%s:%s" % server.server_address
+    try:
+        data = json.dumps({'gelfile': gelfile, 'args': {'linearize': False, 'pngfnfmt': "{gelfnroot}{ext}"}})
+        response = json.loads(urlopen(Request(url + "/convert", data=data.encode())).read().decode())
+        assert response['status'] == 'ok' and os.path.isfile(response['result']['pngfile'])
+        assert json.loads(urlopen(url + "/status").read().decode())['completed'] >= 1
+        with pytest.raises(HTTPError):
+            urlopen(Request(url + "/unknown", data=data.encode()))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_run_job_quantify(tmpdir):
+    gelfile = str(tmpdir.join("gel.png"))
+    Image.fromarray((make_test_gel() * 1000 + 100).astype(numpy.uint16)).save(gelfile)
+    response = run_job({'job': 'quantify', 'gelfile': gelfile, 'args': {'band_shape': [5, 21],
+                                                                        'find_peaks_mode': '1d'}})
+    assert response['status'] == 'ok', response['error']
+    assert len(response['result']['bands']) == 9
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#    Copyright 2014 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+# pylint: disable=W0142
+
+"""
+Test module for tiling.py
+
+Usage:
+* To invoke all tests from command line in the root directory:
+>>> python -m pytest
+
+Use standard python assert statement to assert statements:
+assert value == expected_value
+
+"""
+
+import pytest
+import logging
+import numpy as np
+from scipy.ndimage import gaussian_filter, percentile_filter, minimum_filter
+from scipy.signal import convolve2d
+
+from gelutils.tiling import run_tiled, tiled, filter_halo
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.mark.parametrize("func, args, kwargs", [
+    (gaussian_filter, (), dict(sigma=2)),
+    (percentile_filter, (), dict(percentile=5, size=(31, 51))),
+    (minimum_filter, (), dict(footprint=np.ones((7, 5)))),
+    (convolve2d, (np.ones((3, 29))/87,), dict(mode='same')),
+])
+def test_run_tiled_is_identical(func, args, kwargs):
+    img = np.random.rand(150, 230).astype('f')
+    expected = func(img, *args, **kwargs)
+    result = run_tiled(func, img, args, kwargs, tile_shape=(40, 64), max_workers=4)
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_tiled_opening():
+    morphology = pytest.importorskip("skimage.morphology")
+    img = np.random.rand(120, 200).astype('f')
+    footprint = np.ones((3, 23))
+    assert filter_halo(morphology.opening, img, footprint) == (2, 22)
+    assert np.array_equal(tiled(morphology.opening, tile_shape=(32, 48))(img, footprint),
+                          morphology.opening(img, footprint))
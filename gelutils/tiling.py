@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+#    Copyright 2014-2016 Rasmus Scholer Sorensen, rasmusscholer@gmail.com
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+
+Module for running image filters on tiles of an image in a thread pool.
+
+The image is split into tiles, each tile is extended by a "halo" of neighbouring pixels
+large enough to cover the filter's footprint, the filter is applied to each extended tile,
+and the halo is cropped away again before the tiles are stitched together.
+Since each output pixel is calculated from exactly the same input pixels as when filtering
+the whole image, the output is identical to the untiled call.
+
+Most scipy.ndimage filters release the GIL, so the tiles are processed concurrently
+using a ThreadPoolExecutor.
+
+Usage:
+    >>> from scipy.ndimage import percentile_filter
+    >>> tiled_percentile_filter = tiled(percentile_filter, tile_shape=(512, 512))
+    >>> bg = tiled_percentile_filter(img, percentile=5, size=(31, 51))
+
+"""
+
+import inspect
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE_SHAPE = (512, 512)
+
+# Filters where each output pixel depends on input pixels within the footprint, by function name:
+FOOTPRINT_FILTERS = ('minimum_filter', 'maximum_filter', 'percentile_filter', 'median_filter', 'rank_filter',
+                     'uniform_filter', 'convolve', 'correlate', 'generic_filter',
+                     'grey_erosion', 'grey_dilation', 'erosion', 'dilation')
+# Filters that apply the footprint twice (erosion followed by dilation, or vice versa):
+MORPHOLOGY_FILTERS = ('opening', 'closing', 'grey_opening', 'grey_closing', 'white_tophat', 'black_tophat')
+
+
+def _as_tuple(value, ndim):
+    """Return value as a tuple of length ndim (repeating value if it is a scalar)."""
+    if np.isscalar(value):
+        return (value,) * ndim
+    return tuple(value)
+
+
+def _footprint_shape(arguments, ndim):
+    """Return the footprint shape from a filter's bound arguments (footprint, selem, structure, weights, size)."""
+    for key in ('footprint', 'selem', 'structure', 'weights', 'in2'):
+        if arguments.get(key) is not None:
+            return np.shape(arguments[key])
+    if arguments.get('size') is not None:
+        return _as_tuple(arguments['size'], ndim)
+    raise ValueError("Could not determine the footprint shape from the filter arguments %s" % (list(arguments),))
+
+
+def filter_halo(func, img, *args, **kwargs):
+    """Determine the halo needed to tile the filter call func(img, *args, **kwargs) without changing the output.
+
+    Args:
+        func: the filter function, e.g. scipy.ndimage.gaussian_filter. The halo is determined from
+            the function's name and its sigma/size/footprint/selem/kernel arguments.
+        img: the image to be filtered.
+        args, kwargs: the other arguments for the filter call.
+
+    Returns:
+        Tuple with the halo (number of pixels) for each image axis.
+
+    Raises:
+        ValueError if the halo cannot be determined for the given filter.
+    """
+    ndim = img.ndim
+    name = getattr(func, '__name__', '')
+    arguments = inspect.signature(func).bind_partial(img, *args, **kwargs).arguments
+    if name == 'gaussian_filter':
+        sigma = _as_tuple(arguments.get('sigma'), ndim)
+        truncate = arguments.get('truncate', 4.0)
+        radius = arguments.get('radius')
+        if radius is not None:
+            return _as_tuple(radius, ndim)
+        return tuple(int(truncate * float(sd) + 0.5) for sd in sigma)
+    if name == 'convolve2d':
+        if arguments.get('mode', 'full') != 'same':
+            raise ValueError("Only convolve2d(..., mode='same') can be tiled.")
+        # The 'same' output is centered on the 'full' output, so a halo of kernel size - 1 is always enough:
+        return tuple(size - 1 for size in np.shape(arguments['in2']))
+    shape = _footprint_shape(arguments, ndim)
+    origin = _as_tuple(arguments.get('origin', 0), ndim)
+    if name in FOOTPRINT_FILTERS:
+        return tuple(size//2 + abs(orig) for size, orig in zip(shape, origin))
+    if name in MORPHOLOGY_FILTERS:
+        return tuple(2*(size//2 + abs(orig)) for size, orig in zip(shape, origin))
+    raise ValueError("Cannot determine halo for filter %r; please specify halo explicitly." % (name,))
+
+
+def tile_slices(shape, tile_shape, halo):
+    """Generate the slices needed to process an image of the given shape in tiles.
+
+    Yields:
+        3-tuples of (in_slices, out_slices, crop_slices), where
+            in_slices is the tile plus halo in the input image,
+            out_slices is the tile in the output image, and
+            crop_slices is the tile within the filtered halo-extended tile.
+    """
+    per_axis = []
+    for size, tile_size, axis_halo in zip(shape, tile_shape, halo):
+        axis_slices = []
+        for start in range(0, size, tile_size):
+            stop = min(start + tile_size, size)
+            in_start, in_stop = max(start - axis_halo, 0), min(stop + axis_halo, size)
+            axis_slices.append((slice(in_start, in_stop), slice(start, stop),
+                                slice(start - in_start, stop - in_start)))
+        per_axis.append(axis_slices)
+    for combination in itertools.product(*per_axis):
+        in_slices, out_slices, crop_slices = zip(*combination)
+        yield in_slices, out_slices, crop_slices
+
+
+def run_tiled(func, img, args=(), kwargs=None, halo=None, tile_shape=None, max_workers=None):
+    """Apply the filter func(img, *args, **kwargs) tile-by-tile in a thread pool.
+
+    Args:
+        func: filter function taking the image as first argument and returning an image of the same shape.
+        img: 2d (or n-d) image.
+        args, kwargs: other arguments for func.
+        halo: int or tuple with the number of pixels to extend each tile by on each side.
+            Determined with filter_halo() if not given.
+        tile_shape: shape of the tiles (excluding halo). Default is DEFAULT_TILE_SHAPE.
+        max_workers: max number of threads, passed to ThreadPoolExecutor.
+
+    Returns:
+        The filtered image, identical to func(img, *args, **kwargs).
+    """
+    if kwargs is None:
+        kwargs = {}
+    if tile_shape is None:
+        tile_shape = DEFAULT_TILE_SHAPE
+    tile_shape = _as_tuple(tile_shape, img.ndim)
+    if halo is None:
+        halo = filter_halo(func, img, *args, **kwargs)
+    halo = _as_tuple(halo, img.ndim)
+    tiles = list(tile_slices(img.shape, tile_shape, halo))
+    if len(tiles) < 2:
+        return func(img, *args, **kwargs)
+    logger.debug("Running %s on %s tiles of shape %s with halo %s",
+                 getattr(func, '__name__', func), len(tiles), tile_shape, halo)
+
+    def filter_tile(tile):
+        in_slices, _, crop_slices = tile
+        return func(img[in_slices], *args, **kwargs)[crop_slices]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(filter_tile, tiles)
+        out = None
+        for (_, out_slices, _), result in zip(tiles, results):
+            if out is None:
+                out = np.empty(img.shape, dtype=result.dtype)
+            out[out_slices] = result
+    return out
+
+
+def tiled(func, halo=None, tile_shape=None, max_workers=None):
+    """Wrap a filter function so it is executed tile-by-tile in a thread pool, see run_tiled().
+
+    Returns:
+        A function with the same call signature as func.
+    """
+    @wraps(func)
+    def tiled_func(img, *args, **kwargs):
+        return run_tiled(func, img, args, kwargs, halo=halo, tile_shape=tile_shape, max_workers=max_workers)
+    return tiled_func
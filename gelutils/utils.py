@@ -30,9 +30,11 @@ from six import string_types
 import codecs
 from itertools import chain
 import json
-import yaml
 import logging
 import logging.config
+
+from .config import load_yaml
+
 logger = logging.getLogger(__name__)
 
 
@@ -252,8 +254,7 @@ def init_logging(config=None, prefix="gelutils"):
             fnbase, fnext = os.path.splitext(dictconfig_fn)
             if fnext.lower() == ".yaml":
                 print("Configuring logging system using dict config from yaml-formatted file:", dictconfig_fn)
-                with open(dictconfig_fn) as fp:
-                    dictconfig = yaml.load(fp)
+                dictconfig = load_yaml(dictconfig_fn)
             else:
                 print("Configuring logging system using dict config from json-formatted file:", dictconfig_fn)
                 with open(dictconfig_fn) as fp:
@@ -62,6 +62,10 @@ setup(
             'annotategel_debug=gelutils.gelannotator_gui:main',  # Run as console script for debugging.
             'annotategel_gui=gelutils.gelannotator_gui:main',  # This may just be the official entry point.
             'svg2png=gelutils.imageconverter:svg2png_cli',  # edit: maybe just use cairosvg?
+            'gelquant=gelutils.gelquant:main',
+            'batchannotate=gelutils.batchannotator:main',
+            'gelutils=gelutils.service:main',  # gelutils serve
+            'gel2png=gelutils.pipeline:main',
         ],
         'gui_scripts': [
             'AnnotateGel=gelutils.gelannotator_gui:main',